@@ -1,4 +1,9 @@
 import streamlit as st
+import os
+
+
+# Folder served by Streamlit at app/static/ (see .streamlit/config.toml)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 
 
 
@@ -48,5 +53,30 @@ st.markdown("- **[:computer: CodeMaxGPT](./CodeMaxGPT)**")
 
 # Display an empty line
 st.text("")
-# Display an image from the 'assets' folder named 'cover-page.gif'
-st.image("assets/cover-page.gif")
+# Display the cover image from the 'static' folder. It is served once by ...
+# ...Streamlit's static file route (with ETag, Last-Modified and range ...
+# ...support) instead of being copied into every session. The route ...
+# ...serves only PNG, JPEG and GIF images as such, so the animated PNG ...
+# ...produced by scripts/transcode_cover.py is used when it is smaller
+covers = [
+    name for name in ("cover-page.png", "cover-page.gif")
+    if os.path.exists(os.path.join(STATIC_DIR, name))
+]
+cover_image = min(
+    covers,
+    key=lambda name: os.path.getsize(os.path.join(STATIC_DIR, name)),
+    default="cover-page.gif",
+)
+st.markdown(
+    f'<img src="app/static/{cover_image}" width="100%">',
+    unsafe_allow_html=True,
+)
+
+# Display the memory panel to administrators, who open the home page ...
+# ...with ?admin=<ADMIN_TOKEN> in the URL. The panel's modules are only ...
+# ...imported when a token is configured
+if os.environ.get("ADMIN_TOKEN"):
+    from utils.admin import is_admin, show_memory_panel
+
+    if is_admin():
+        show_memory_panel()
@@ -0,0 +1,106 @@
+"""Benchmark the audio preprocessing applied before Whisper uploads.
+
+Usage:
+    python benchmarks/bench_audio.py [clip.wav ...] [--transcribe]
+
+Without arguments, synthetic voice-like clips recorded at 44.1 kHz stereo
+with the recorder's 3 seconds of trailing silence are generated. Each clip
+goes through the same path as in Talk to GPT: it is preprocessed and split
+into segments of at most TRANSCRIPTION_SEGMENT_SECONDS. With --transcribe,
+the raw clip and its segments are also sent to whisper-1 (requires
+OPENAI_API_KEY) to compare transcription latency, the segments being
+transcribed concurrently as in the app.
+"""
+import io
+import os
+import sys
+import time
+import wave
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.audio import UPLOAD_FORMAT, preprocess_segments  # noqa: E402
+from utils.transcription import (  # noqa: E402
+    SEGMENT_SECONDS, transcribe_segments,
+)
+
+
+
+def synthetic_clip(speech_seconds: float, rate: int = 44100) -> bytes:
+    """Function that generates a stereo WAV clip of voice-like harmonics
+    surrounded by low-level background noise.
+    Args:
+    - speech_seconds (float): The length of the voiced part.
+    - rate (int): The sample rate.
+    Returns:
+    - bytes: The WAV data.
+    """
+    rng = np.random.default_rng(0)
+    lead, trail = 0.5, 3.0
+    n = int((lead + speech_seconds + trail) * rate)
+    t = np.arange(n) / rate
+    # Syllable-rate amplitude modulation of a 150 Hz voice with harmonics
+    voice = sum(np.sin(2 * np.pi * 150 * k * t) / k for k in range(1, 6))
+    envelope = (0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)) * (
+        (t >= lead) & (t < lead + speech_seconds)
+    )
+    signal = 0.3 * voice * envelope + 0.002 * rng.standard_normal(n)
+    pcm = (np.clip(signal, -1, 1) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.repeat(pcm, 2).tobytes())
+    return buffer.getvalue()
+
+
+def transcribe_seconds(core, client, segments: list) -> float:
+    """Function that measures the latency of a whisper-1 transcription of
+    segments transcribed concurrently.
+    """
+    start = time.perf_counter()
+    transcribe_segments(core, client, segments)
+    return time.perf_counter() - start
+
+
+def main(argv: list):
+    transcribe = "--transcribe" in argv
+    paths = [arg for arg in argv if arg != "--transcribe"]
+    if paths:
+        clips = [(os.path.basename(p), open(p, "rb").read()) for p in paths]
+    else:
+        clips = [
+            ("synthetic-{}s.wav".format(seconds), synthetic_clip(seconds))
+            for seconds in (3, 15, 60)
+        ]
+    core = client = None
+    if transcribe:
+        from openai import AsyncOpenAI
+        from utils.async_core import AsyncCore
+        core = AsyncCore()
+        client = AsyncOpenAI()
+
+    print("Upload format: {}".format(UPLOAD_FORMAT))
+    print("{:<22}{:>12}{:>12}{:>9}{:>10}{:>11}".format(
+        "clip", "raw bytes", "upload", "ratio", "segments", "prep ms"
+    ))
+    for name, data in clips:
+        start = time.perf_counter()
+        segments = preprocess_segments(data, SEGMENT_SECONDS)
+        prep_ms = (time.perf_counter() - start) * 1000
+        upload = sum(len(segment) for _, segment in segments)
+        print("{:<22}{:>12,}{:>12,}{:>8.1f}x{:>10}{:>11.1f}".format(
+            name, len(data), upload, len(data) / max(upload, 1),
+            len(segments), prep_ms,
+        ))
+        if client is not None and segments:
+            raw_s = transcribe_seconds(core, client, [(name, data)])
+            prep_s = transcribe_seconds(core, client, segments)
+            print("    whisper latency: raw {:.2f}s, preprocessed {:.2f}s"
+                  .format(raw_s, prep_s))
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,141 @@
+"""Benchmark the import cost paid when Home.py and each page cold-start.
+
+Usage:
+    python benchmarks/bench_imports.py [--runs N] [--check]
+
+The top-level imports of every entry script are executed in a fresh
+interpreter with `-X importtime`, third-party packages first, and the
+median over N runs is reported together with the five most expensive
+modules. Budgets apply to the app's own modules (utils and service),
+including whatever they import that the third-party packages of the
+script, such as Streamlit, have not imported already. The time of
+Streamlit itself depends on the machine and is only reported. With
+--check, the script exits with status 1 if any entry script exceeds its
+budget in benchmarks/import_budget.json, so that CI fails when the app's
+modules slow down the cold start.
+"""
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_FILE = os.path.join(ROOT, "benchmarks", "import_budget.json")
+# Packages of the app, whose import time is budgeted
+APP_PACKAGES = ("utils", "service")
+
+
+
+def entry_scripts() -> list:
+    """Function that lists the Streamlit entry scripts of the app.
+    """
+    pages = sorted(
+        os.path.join("pages", name)
+        for name in os.listdir(os.path.join(ROOT, "pages"))
+        if name.endswith(".py")
+    )
+    return ["Home.py"] + pages
+
+
+def is_app_import(node) -> bool:
+    """Function that tells whether an import statement imports a module
+    of the app.
+    Args:
+    - node (ast.Import or ast.ImportFrom): The statement.
+    Returns:
+    - bool: Whether the imported module belongs to APP_PACKAGES.
+    """
+    names = [node.module or ""] if isinstance(node, ast.ImportFrom) \
+        else [alias.name for alias in node.names]
+    return any(name.split(".")[0] in APP_PACKAGES for name in names)
+
+
+def top_level_imports(script: str) -> str:
+    """Function that extracts the module-level import statements of a
+    script, which are executed every time the script cold-starts. Those of
+    third-party packages come first, so that the time of the app's
+    modules excludes the dependencies they share with them.
+    Args:
+    - script (string): The path of the script, relative to the repo root.
+    Returns:
+    - str: The import statements as source code.
+    """
+    with open(os.path.join(ROOT, script)) as f:
+        tree = ast.parse(f.read())
+    imports = [
+        node for node in tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+    ]
+    return "\n".join(
+        ast.unparse(node) for node in sorted(imports, key=is_app_import)
+    )
+
+
+def measure(source: str) -> tuple:
+    """Function that runs import statements in a fresh interpreter.
+    Args:
+    - source (string): The import statements.
+    Returns:
+    - tuple: (total milliseconds, milliseconds of the app's modules,
+    {top-level module: milliseconds}).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", source],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Only count modules imported directly by the script; nested ...
+        # ...imports are already included in their parent's time
+        if not name.startswith("  "):
+            modules[name.strip()] = int(cumulative) / 1000
+    own = sum(
+        ms for name, ms in modules.items()
+        if name.split(".")[0] in APP_PACKAGES
+    )
+    return sum(modules.values()), own, modules
+
+
+def main(argv: list) -> int:
+    runs = int(argv[argv.index("--runs") + 1]) if "--runs" in argv else 5
+    check = "--check" in argv
+    with open(BUDGET_FILE) as f:
+        budget = json.load(f)
+
+    failed = False
+    for script in entry_scripts():
+        source = top_level_imports(script)
+        try:
+            samples = [measure(source) for _ in range(runs)]
+        except RuntimeError as error:
+            print("{:<26} FAILED: {}".format(script, error))
+            failed = True
+            continue
+        total = statistics.median(total for total, _, _ in samples)
+        own = statistics.median(own for _, own, _ in samples)
+        limit = budget.get(script)
+        status = ""
+        if limit is not None and own > limit:
+            status = "OVER BUDGET"
+            failed = True
+        print("{:<26}{:>9.1f} ms  app modules {:.1f} ms (budget {} ms) "
+              "{}".format(script, total, own, limit, status))
+        # Show the most expensive modules of the last run
+        heaviest = sorted(
+            samples[-1][2].items(), key=lambda item: item[1], reverse=True
+        )[:5]
+        for name, ms in heaviest:
+            print("    {:<30}{:>9.1f} ms".format(name, ms))
+    return 1 if (check and failed) else 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
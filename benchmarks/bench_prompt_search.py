@@ -0,0 +1,115 @@
+"""Benchmark the built-in prompt search on large catalogs.
+
+Usage:
+    python benchmarks/bench_prompt_search.py [--prompts N] [--check]
+
+A synthetic catalog of N prompts (50,000 by default) is indexed, in which
+a few words are very common, as 'act' or 'you' are in real catalogs:
+'alpha' is in 40% of the prompts and 'beta' in 20%, just below the share
+above which words are no longer indexed. The median time of a search is
+reported for act name prefixes, rare and common prompt words, and
+misspellings, on the catalog and on one a tenth of its size. Searches
+should take the same time whatever the size of the catalog, and wall-clock
+times vary from machine to machine, so with --check the script exits with
+status 1 if a search gets more than MAX_GROWTH times slower on the larger
+catalog. Absolute times are only reported.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.prompt_search import PromptIndex  # noqa: E402
+
+# Queries covering every stage of a search
+QUERIES = [
+    "act w17",
+    "w17",
+    "alpha",
+    "beta",
+    "alpha beta",
+    "alpha w42",
+    "linux terminal",
+    "acct w1234",
+]
+# Maximum ratio of the time of a search on the catalog to its time on a ...
+# ...catalog ten times smaller; a linear scan would be about 10
+MAX_GROWTH = 3.0
+# Number of times each query is run
+RUNS = 200
+
+
+
+def synthetic_catalog(size: int) -> tuple:
+    """Function that generates a catalog of random prompts.
+    Args:
+    - size (int): The number of prompts.
+    Returns:
+    - tuple: (act names, prompts).
+    """
+    rng = random.Random(0)
+    vocabulary = ["w{}".format(i) for i in range(20000)]
+    acts, prompts = [], []
+    for i in range(size):
+        acts.append("Act {} {}".format(rng.choice(vocabulary), i))
+        words = [rng.choice(vocabulary) for _ in range(30)]
+        if rng.random() < 0.4:
+            words.append("alpha")
+        if rng.random() < 0.2:
+            words.append("beta")
+        prompts.append(" ".join(words))
+    return acts, prompts
+
+
+def median_times(size: int) -> dict:
+    """Function that indexes a synthetic catalog and times each query.
+    Args:
+    - size (int): The number of prompts.
+    Returns:
+    - dict: {query: (median milliseconds, number of matches)}.
+    """
+    start = time.perf_counter()
+    index = PromptIndex(*synthetic_catalog(size))
+    print("{:,} prompts indexed in {:.1f} s".format(
+        len(index), time.perf_counter() - start
+    ))
+    times = {}
+    for query in QUERIES:
+        samples = []
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            matches = index.search(query)
+            samples.append((time.perf_counter() - start) * 1000)
+        times[query] = (statistics.median(samples), len(matches))
+    return times
+
+
+def main(argv: list) -> int:
+    size = int(argv[argv.index("--prompts") + 1]) \
+        if "--prompts" in argv else 50000
+    check = "--check" in argv
+
+    small = median_times(size // 10)
+    large = median_times(size)
+    print("    {:<18}{:>11}{:>11}{:>8}".format(
+        "query", "1/10 size", "full size", "growth"
+    ))
+    failed = False
+    for query in QUERIES:
+        growth = large[query][0] / small[query][0]
+        status = ""
+        if growth > MAX_GROWTH:
+            status = "GROWS WITH THE CATALOG"
+            failed = True
+        print("    {:<18}{:>8.3f} ms{:>8.3f} ms{:>7.1f}x {:>5} matches "
+              "{}".format(
+                  query, small[query][0], large[query][0], growth,
+                  large[query][1], status,
+              ))
+    return 1 if (check and failed) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,126 @@
+"""Benchmark the eviction of idle sessions from server memory.
+
+Usage:
+    python benchmarks/bench_sessions.py [--sessions N] [--turns N] [--check]
+
+Browser sessions are simulated the way Streamlit runs them: each session
+owns a SessionState, and every script run wraps it in a new
+SafeSessionState that is dropped when the run ends. Each session
+registers its history with the session registry during one run, then goes
+idle. The script reports how many idle sessions the registry and the
+admin panel still see, what the memory budget trims from them, and the
+memory that evicting them frees. With --check, it exits with status 1 if
+any idle session is missing from the registry or the admin panel, escapes
+its budget, or keeps a history key after eviction.
+"""
+import contextlib
+import gc
+import io
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pympler import asizeof  # noqa: E402
+from streamlit.runtime.state.safe_session_state import (  # noqa: E402
+    SafeSessionState,
+)
+from streamlit.runtime.state.session_state import SessionState  # noqa: E402
+from utils.memory import MemoryProfiler  # noqa: E402
+from utils.session import SessionRegistry, session_state_of  # noqa: E402
+from utils.turns import TurnLog  # noqa: E402
+
+# Session state keys holding the history, as registered by Talk to GPT
+KEYS = ["talk-turns", "persona", "hydrated-talk"]
+
+
+
+def run_script(registry: SessionRegistry, session_id: str,
+               state: SessionState, turns: int):
+    """Function that simulates one script run of a session: the history is
+    loaded into the state through the run's wrapper, and the session is
+    registered the way utils.session.hydrate_session does.
+    """
+    ctx = SimpleNamespace(session_state=SafeSessionState(state))
+    log = TurnLog()
+    for i in range(turns):
+        log.append("user", "Question {} about the code".format(i))
+        log.append("assistant", "Answer {} ".format(i) * 40)
+    # The turns are written to the conversation store as they are added
+    log.unpersisted()
+    ctx.session_state["talk-turns"] = log
+    ctx.session_state["persona"] = "Linux Terminal"
+    ctx.session_state["hydrated-talk"] = True
+    registry.touch(session_id, session_state_of(ctx), KEYS)
+
+
+def main(argv: list) -> int:
+    sessions = int(argv[argv.index("--sessions") + 1]) \
+        if "--sessions" in argv else 200
+    turns = int(argv[argv.index("--turns") + 1]) \
+        if "--turns" in argv else 50
+    check = "--check" in argv
+
+    registry = SessionRegistry()
+    # The session states are owned by their AppSession, kept here
+    states = {"session-{}".format(i): SessionState() for i in range(sessions)}
+    for session_id, state in states.items():
+        run_script(registry, session_id, state, turns)
+    # Every run has ended, so its wrapper is gone
+    gc.collect()
+
+    seen = len(registry.states())
+    # Measure the sessions as the admin panel does
+    profiler = MemoryProfiler()
+    sizes = profiler.sample({
+        session_id: dict(state.filtered_state)
+        for session_id, state in registry.states().items()
+    })
+    held = sum(sum(keys.values()) for keys in sizes.values())
+    # Enforce a budget of half the size of a session on the idle ones
+    budget_mb = held / len(states) / 2 / (1024 * 1024)
+    start = time.perf_counter()
+    # The profiler reports each eviction on the console
+    with contextlib.redirect_stdout(io.StringIO()):
+        over = profiler.check_all(registry.states(), budget_mb)
+    budget_ms = (time.perf_counter() - start) * 1000
+    trimmed_sizes = [
+        asizeof.asizeof(state.filtered_state) for state in states.values()
+    ]
+    trimmed = held - sum(trimmed_sizes)
+    within = sum(
+        1 for size in trimmed_sizes if size <= budget_mb * 1024 * 1024
+    )
+    held -= trimmed
+    start = time.perf_counter()
+    evicted = registry.evict_idle(0)
+    evict_ms = (time.perf_counter() - start) * 1000
+    left = sum(
+        1 for state in states.values() for key in KEYS if key in state
+    )
+    freed = held - sum(
+        asizeof.asizeof(state.filtered_state) for state in states.values()
+    )
+    print("{} idle sessions, {} turns each".format(sessions, turns))
+    print("    seen by the registry    {:>8}".format(seen))
+    print("    measured by the panel   {:>8}".format(len(sizes)))
+    print("    over the budget         {:>8}  in {:.1f} ms, {:.1f} MB "
+          "trimmed".format(over, budget_ms, trimmed / (1024 * 1024)))
+    print("    within the budget       {:>8}".format(within))
+    print("    evicted                 {:>8}  in {:.1f} ms".format(
+        evicted, evict_ms
+    ))
+    print("    history keys left       {:>8}".format(left))
+    print("    memory freed            {:>8.1f} MB of {:.1f} MB".format(
+        freed / (1024 * 1024), held / (1024 * 1024)
+    ))
+    failed = left or any(count != sessions for count in (
+        seen, len(sizes), over, within, evicted
+    ))
+    return 1 if (check and failed) else 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,14 +1,19 @@
 import streamlit as st
+import streamlit.components.v1 as components
 from streamlit_chat import message
-from openai import OpenAI
-import os
-import glob
 from audio_recorder_streamlit import audio_recorder
-from datetime import datetime
-from gtts import gTTS
+import html
 import re
-import pandas as pd
-import requests
+from utils.session import (
+    get_audio_server, get_chat_service, get_core, get_desktop_app,
+    get_prompt_index, get_renderer, get_session_id, get_store,
+    hydrate_session, wait,
+)
+from utils.prompt_search import PROMPT_CATALOG_URL, SEARCH_LIMIT
+from utils.prompts import PrefixCacheStats, assemble_messages
+from utils.router import describe
+from utils.transfer_panel import show_transfer_panel
+from utils.turns import TurnLog
 
 
 
@@ -22,64 +27,142 @@ class ChatGPTBot:
         - api_key (string): The OpenAI API key used to authenticate
         with the OpenAI service.
         """
-        # Instantiate a client object using api_key
+        # Get the async client of the API key from the execution core ...
+        # ...shared by all sessions
         self.api_key = api_key
-        self.client = OpenAI(api_key=self.api_key)
-        # Initialize the message history for chat storing
-        if "message_history" not in st.session_state:
-            st.session_state["message_history"] = []
-
-
-    def respond(self, user_message: str, model: str) -> str:
+        self.core = get_core()
+        self.client = self.core.client(self.api_key)
+        # The chat logic shared with the command line and the HTTP API
+        self.service = get_chat_service()
+        # Open a connection to the API in the background while the user ...
+        # ...types the first message
+        self.core.warm_up(self.api_key)
+        # Initialize the turn log for chat storing
+        if ChatApp.TURNS_KEY not in st.session_state:
+            st.session_state[ChatApp.TURNS_KEY] = TurnLog()
+        self.turns = st.session_state[ChatApp.TURNS_KEY]
+
+
+    def respond(self, user_message: str, model: str,
+                text_or_speak: str = "text") -> dict:
         """Method to send user's message to GPT model and receive API
-        response. This method also documents and updates the message history
+        response. This method also documents and updates the turn log
         between the user and the bot.
         Args:
         - user_message (string): The user's input message.
-        - model (string): The GPT model to use.
+        - model (string): The GPT model to use, or 'Auto'.
+        - text_or_speak (string): Type of communication. Default is 'text'.
         Returns:
-        - str: Bot's response message.
+        - dict: The result of ChatService.reply, with the bot's message
+        as its 'content'.
         """
-        # Assemble a request using user's message and append it to ...
-        # ...message_history
-        request = {"role": "user", "content": user_message}
-        st.session_state["message_history"].append(request)
-
-        # Create a chat completion object using OpenAI API
-        completion = self.client.chat.completions.create(
-            model=model, messages=st.session_state["message_history"]
-        )  # other useful parameters: temperature and max_tokens
+        # Stream a chat completion from the OpenAI API through the chat ...
+        # ...service, which logs both turns. The request is cancelled if ...
+        # ...the user moves on before it finishes
+        result = wait(
+            self.core.submit(
+                self.service.reply(
+                    self.client,
+                    self.turns,
+                    user_message,
+                    model,
+                    persona=st.session_state.get("persona", ""),
+                    modality=text_or_speak,
+                )
+            ),
+            "Waiting for {}".format(model),
+        )
+        # Report the share of the prompt served from the prompt cache
+        report = self.cache_stats().record(result["usage"])
+        if report:
+            st.caption(report)
+        return result
 
-        # Extract bot's message from the API response
-        bot_message = completion.choices[0].message.content
-        # Assemble a response using bot's message and append it to ...
-        # ...message_history
-        response = {"role": "assistant", "content": bot_message}
-        st.session_state["message_history"].append(response)
 
-        return bot_message
+    def compare(self, user_message: str, models: list) -> list:
+        """Method to send user's message, along with the conversation so
+        far, to several GPT models concurrently.
+        Args:
+        - user_message (string): The user's input message.
+        - models (list): The GPT models to compare.
+        Returns:
+        - list: The result of ChatService.ask for each model, in order.
+        """
+        messages = assemble_messages(
+            self.turns,
+            persona=st.session_state.get("persona", ""),
+            user_message=user_message,
+        )
+        # Fan the request out to all models in one parallel round trip
+        return wait(
+            self.core.submit_all([
+                self.service.ask(self.client, messages, model)
+                for model in models
+            ]),
+            "Waiting for {} models".format(len(models)),
+        )
 
 
-    def say(self, bot_message: str):
-        """Method to convert bot's message into speech audio.
+    def adopt(self, user_message: str, result: dict):
+        """Method to continue the conversation with the answer of one of
+        the compared models.
         Args:
-        - bot_message (string): The bot's text message to convert.
+        - user_message (string): The user's input message.
+        - result (dict): The chosen result of ChatGPTBot.compare.
+        """
+        self.turns.append("user", user_message, "text")
+        self.turns.append(
+            "assistant", result["content"], "text",
+            tokens=result.get("completion_tokens"),
+        )
+        self.persist()
+
+
+    def cache_stats(self) -> PrefixCacheStats:
+        """Method to get the prompt cache statistics of the session.
+        Returns:
+        - PrefixCacheStats: The statistics, created on first use.
         """
-        # Convert bot's message from text to speech
-        bot_speech = self.client.audio.speech.create(
-            model="tts-1", voice="fable", input=bot_message
+        return st.session_state.setdefault(
+            ChatApp.CACHE_STATS_KEY, PrefixCacheStats()
         )
-        # Save the speech as a WAV audio file
-        bot_audio_filename = "bot-{}.wav".format(
-            datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+
+
+    def persist(self):
+        """Method to write the turns added to the log since the last turn
+        to the conversation store.
+        """
+        get_store().append_turns(
+            get_session_id(), ChatApp.PAGE, self.turns.unpersisted()
         )
-        bot_speech.stream_to_file(bot_audio_filename)
-        # Read the bot audio file
-        bot_audio_file = open(bot_audio_filename, "rb")
-        bot_audio_bytes = bot_audio_file.read()
-        # Display an audio button on the page that plays the bot audio file
+
+
+    def say(self, bot_message: str):
+        """Method to play the bot's speech on the web page. The speech is
+        streamed to the browser, so that playback starts on the first
+        chunk, only if AUDIO_STREAM_URL configures the audio endpoint.
+        Otherwise, as by default, it is synthesized in full and embedded in
+        the page.
+        Args:
+        - bot_message (string): The bot's text message to speak.
+        """
+        audio_server = get_audio_server()
+        # Display an audio button on the page that plays the bot audio
         st.write("Play the audio below to LISTEN to the bot")
-        st.audio(bot_audio_bytes, format="audio/wav")
+        if audio_server.server is None:
+            st.audio(
+                wait(self.core.submit(
+                    self.service.synthesize(self.client, bot_message)
+                ), "Converting the reply to speech"),
+                format="audio/mp3",
+            )
+            return
+        url = audio_server.register(self.client, bot_message)
+        components.html(
+            '<audio controls autoplay preload="auto" src="{}" '
+            'style="width: 100%"></audio>'.format(html.escape(url)),
+            height=60,
+        )
 
 
     def chat(self, user_message: str, text_or_speak: str,
@@ -88,24 +171,24 @@ class ChatGPTBot:
         Args:
         - user_message (string): The user's input message.
         - text_or_speak (string): Type of communication.
-        - model (string): The GPT model to use. Default is 'gpt-4o-mini'.
+        - model (string): The GPT model to use, or 'Auto' to route the
+        message to the fastest adequate model. Default is 'gpt-4o-mini'.
         """
         if user_message.strip():
-            # Send user message to GPT model and get bot's message
-            bot_message = self.respond(
-                user_message=user_message, model=selected_model
+            # Send user message to GPT model and get bot's message. The ...
+            # ...chat service routes it first if the model is 'Auto'
+            result = self.respond(
+                user_message=user_message,
+                model=selected_model,
+                text_or_speak=text_or_speak,
             )
-            # Save the user message in streamlit session state
-            st.session_state[
-                "user-{}".format(text_or_speak)
-            ].append(user_message)
-            # Save the bot's message in streamlit session state
-            st.session_state[
-                "bot-{}".format(text_or_speak)
-            ].append(bot_message)
+            if result["decision"] is not None:
+                st.caption(describe(result["decision"], result["latency"]))
+            # Persist the new turns in the conversation store
+            self.persist()
 
             # Play the latest bot's message in audio
-            self.say(bot_message)
+            self.say(result["content"])
 
 
     def transcribe_voice(self, audio_bytes: bytes) -> str:
@@ -115,21 +198,41 @@ class ChatGPTBot:
         Returns:
         - str: The transcribed text from the audio input.
         """
-        # Write audio_bytes into a new WAV file
-        filename = "user-{}.wav".format(
-            datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-        )
-        with open(filename, "wb") as f:
-            f.write(audio_bytes)
-
-        # Transcribe audio file to text through OpenAI's whisper model
-        audio_file = open(filename, "rb")
-        transcription = self.client.audio.transcriptions.create(
-            model="whisper-1", file=audio_file
+        # Import the NumPy-based audio helpers on first use to keep ...
+        # ...the page's cold start fast
+        from utils.audio import preprocess_segments
+        from utils.transcription import SEGMENT_SECONDS, transcribe_segments
+        # Trim the silence, downsample to 16 kHz mono and compress the ...
+        # ...recording to cut the upload size. Long recordings are split ...
+        # ...into segments at silence boundaries
+        segments = preprocess_segments(audio_bytes, SEGMENT_SECONDS)
+        # Skip the API call if no voice was detected in the recording
+        if not segments:
+            return ""
+
+        # Transcribe the segments concurrently through OpenAI's whisper ...
+        # ...model, showing the partial transcript as segments finish. ...
+        # ...The elapsed time is updated while waiting, so that a rerun ...
+        # ...or a closed tab stops the script and cancels the requests
+        progress = st.empty()
+        partial = st.empty()
+        transcript = transcribe_segments(
+            self.core,
+            self.client,
+            segments,
+            on_partial=(
+                (lambda text: partial.caption(text))
+                if len(segments) > 1 else None
+            ),
+            on_wait=lambda elapsed: progress.caption(
+                "Transcribing... {:.0f} s".format(elapsed)
+            ),
         )
+        progress.empty()
+        partial.empty()
 
         # Get the transcribed text
-        return transcription.text
+        return transcript
 
 
 
@@ -137,6 +240,15 @@ class ChatApp:
     """Define the class for the Chat Applicaiton
     """
 
+    # Name of the web app in the conversation store
+    PAGE = "talk"
+    # Session state key of the turn log
+    TURNS_KEY = "turns-talk"
+    # Session state key of the prompt cache statistics
+    CACHE_STATS_KEY = "cache-stats-talk"
+    # GPT models available for selection
+    MODELS = ("gpt-4o-mini", "o3-mini", "gpt-4o", "o1", "gpt-4.5-preview")
+
     def __init__(self):
         """Initialize a new instance of the ChatApp class.
         """
@@ -147,40 +259,59 @@ class ChatApp:
             layout="centered",
             initial_sidebar_state="auto",
         )
-        # Remove all previously existing audio files
-        for file in glob.glob("./*.wav"):
-            os.remove(file)
-        # Initialize session state variables for chat storing
-        if "bot-text" not in st.session_state:
-            st.session_state["bot-text"] = []
-        if "user-text" not in st.session_state:
-            st.session_state["user-text"] = []
-        if "bot-speak" not in st.session_state:
-            st.session_state["bot-speak"] = []
-        if "user-speak" not in st.session_state:
-            st.session_state["user-speak"] = []
-        if "prompts" not in st.session_state:
-            try:
-                # Try Load a series of role-based prompts from an online ...
-                # ...CSV file
-                df = pd.read_csv(
-                    "https://raw.githubusercontent.com/f/"
-                    "awesome-chatgpt-prompts/main/prompts.csv"
-                )
-                # Update prompt column
-                df["prompt"] = df["prompt"].apply(
-                    lambda x: self.transform_prompt(x)
-                )
-                # Save the prompts in session state
-                st.session_state["prompts"] = df
-            except:
-                # If prompt loading fails, display an error message on ...
-                # ...the web page
-                st.error(
-                    "Unable to load the built-in prompts. Please check "
-                    "[awesome-chatgpt-prompts](https://github.com/f/awesome-"
-                    "chatgpt-prompts/blob/main/prompts.csv) for more details."
-                )
+        # Restore the most recent turns from the conversation store if ...
+        # ...this session's history is not in memory (new tab, page ...
+        # ...refresh or eviction after being idle)
+        hydrate_session(
+            self.PAGE,
+            [self.TURNS_KEY, "persona", self.CACHE_STATS_KEY],
+            self.load_history,
+        )
+        try:
+            # Load the search index of the built-in prompts, built once ...
+            # ...per process and shared by all sessions
+            self.prompt_index = get_prompt_index(
+                PROMPT_CATALOG_URL, self.transform_prompt
+            )
+        except:
+            self.prompt_index = None
+            # If prompt loading fails, display an error message on the ...
+            # ...web page
+            st.error(
+                "Unable to load the built-in prompts. Please check "
+                "[awesome-chatgpt-prompts](https://github.com/f/awesome-"
+                "chatgpt-prompts/blob/main/prompts.csv) for more details."
+            )
+
+
+    def load_history(self, store, session_id: str, window: int):
+        """Method to rebuild the chat history from the conversation store.
+        Args:
+        - store (ConversationStore): The conversation store.
+        - session_id (string): The ID of the browser session.
+        - window (int): The maximum number of turns to load.
+        """
+        turns = store.load_turns(session_id, self.PAGE, window)
+        # Drop bot replies whose user message fell outside the window
+        while turns and turns[0].role == "assistant":
+            turns.pop(0)
+        st.session_state[self.TURNS_KEY] = TurnLog(turns)
+        st.session_state["persona"] = store.get_meta(
+            session_id, "persona", ""
+        )
+
+
+    def set_persona(self, persona: str):
+        """Method to set the built-in persona the bot acts as. The
+        persona is kept once in session state and sent as the leading
+        system message, instead of a new system message on every rerun.
+        Args:
+        - persona (string): The role selected by the user, or an empty
+        string to drop the persona.
+        """
+        if st.session_state.get("persona", "") != persona:
+            st.session_state["persona"] = persona
+            get_store().set_meta(get_session_id(), "persona", persona)
 
 
     # Transform a prompt to appropriate format
@@ -206,42 +337,92 @@ class ChatApp:
 
     # Display chat history as conversation dialogs
     def output_chat_history(self, text_or_speak):
-        # Check if there is any chat history for the specified ...
-        # ...conversation type (text or speak)
-        if st.session_state["bot-{}".format(text_or_speak)]:
-            # Get the list of historical bot's messages
-            list_bot_messages = st.session_state[
-                "bot-{}".format(text_or_speak)
-            ]
-            # Get the list of historical user's messages
-            list_user_messages = st.session_state[
-                "user-{}".format(text_or_speak)
-            ]
-            # Iterate through the chat history in reverse order, ...
-            # ...displaying dialogs from newest to oldest
-            for i in range(len(list_bot_messages) - 1, -1, -1):
-                # Display the bot's message first
+        # Pair the user's and bot's messages of the specified ...
+        # ...conversation type (text or speak) from the turn log
+        dialogs = st.session_state[self.TURNS_KEY].dialogs(text_or_speak)
+        # Past messages never change, so the bot's markdown is rendered ...
+        # ...to HTML with highlighted code blocks once and shared by all ...
+        # ...sessions
+        renderer = get_renderer()
+        # Iterate through the chat history in reverse order, ...
+        # ...displaying dialogs from newest to oldest
+        for i in range(len(dialogs) - 1, -1, -1):
+            user_turn, bot_turn = dialogs[i]
+            # Display the bot's message first
+            if bot_turn is not None:
                 message(
-                    list_bot_messages[i],
+                    renderer.render(bot_turn.content),
                     is_user=False,
                     avatar_style="bottts-neutral",
                     seed=75,
                     key="bot-{}-{}".format(text_or_speak, i),
+                    allow_html=True,
                 )
-                # Display the user's message right after bot's message
-                message(
-                    list_user_messages[i],
-                    is_user=True,
-                    avatar_style="adventurer-neutral",
-                    seed=124,
-                    key="user-{}-{}".format(text_or_speak, i),
+            # Display the user's message right after bot's message
+            message(
+                user_turn.content,
+                is_user=True,
+                avatar_style="adventurer-neutral",
+                seed=124,
+                key="user-{}-{}".format(text_or_speak, i),
+            )
+
+
+    # Display the answers of several models to the same message
+    def output_comparison(self, bot, user_message, models):
+        if not (user_message.strip() and models):
+            return
+        comparison = st.session_state.get("comparison")
+        # Only fan out again when the message or the models have changed, ...
+        # ...so that choosing an answer does not repeat the requests
+        if comparison is None or (
+            (comparison["message"], comparison["models"])
+            != (user_message, list(models))
+        ):
+            comparison = {
+                "message": user_message,
+                "models": list(models),
+                "results": bot.compare(user_message, list(models)),
+                "chosen": None,
+            }
+            st.session_state["comparison"] = comparison
+
+        # Display one column per model
+        columns = st.columns(len(comparison["results"]))
+        for column, result in zip(columns, comparison["results"]):
+            column.markdown("**{}**".format(result["model"]))
+            if "error" in result:
+                column.error(result["error"])
+                continue
+            column.caption(
+                "{:.2f} s · {} prompt + {} completion tokens".format(
+                    result["latency"],
+                    result["prompt_tokens"],
+                    result["completion_tokens"],
+                )
+            )
+            column.markdown(result["content"])
+            # Button to continue the conversation with this answer
+            if comparison["chosen"] is None and column.button(
+                "Continue with this answer",
+                key="choose-{}".format(result["model"]),
+            ):
+                bot.adopt(user_message, result)
+                comparison["chosen"] = result["model"]
+        if comparison["chosen"] is not None:
+            st.success(
+                "Continuing the conversation with the answer of {}.".format(
+                    comparison["chosen"]
                 )
+            )
 
 
     # Run the Chatbot application
     def run(self):
         # Set the page title
         st.title("Welcome to Talk To GPT")
+        # Let users save or restore the session from the sidebar
+        show_transfer_panel()
         # Display a subheader that briefly describe the chatbot web app
         st.subheader(
             "Emplowering Conversations: A ChatBot You Can Message Or Talk "
@@ -254,7 +435,8 @@ class ChatApp:
         # Get the GPT model selected by the user
         MODEL = col1.selectbox(
             "Select a GPT model",
-            ("gpt-4o-mini", "o3-mini", "gpt-4o", "o1", "gpt-4.5-preview"),
+            ("Auto",) + self.MODELS,
+            index=1,
             help=(
                 "For many basic tasks, the difference between the various GPT "
                 "models is not significant. However, in more complex reasoning "
@@ -262,7 +444,8 @@ class ChatApp:
                 "and GPT-4.5 are much more capable than any of the previous "
                 "models, though they may come at a higher usage cost. Please "
                 "visit https://platform.openai.com/docs/models for more "
-                "information on OpenAI models."
+                "information on OpenAI models. Choose 'Auto' to send each "
+                "request to the fastest model that is adequate for it."
             ),
         )
         # Get the API key from the user
@@ -301,16 +484,23 @@ class ChatApp:
             # Two Expanders for communication with the bot
             # Expander 1: Message to bot
             with st.expander(":memo: MESSAGE BOT"):
-                df_prompts = st.session_state["prompts"]
-                # Get list of roles for prompts
-                prompts = sorted(list(df_prompts["act"]))
+                # Search box narrowing the built-in prompts down to the ...
+                # ...best matches, so that large catalogs stay responsive
+                query = st.text_input(
+                    "Search the built-in prompts",
+                    placeholder="e.g. linux, travel guide, translator",
+                    disabled=self.prompt_index is None,
+                )
                 # Add "You want the bot to act as..." and ...
-                # ..."[Clear conversation history]" to the prompt list
+                # ..."[Clear conversation history]" to the matching prompts
                 prompts = tuple(
                     [
                         "You want the bot to act as...",
                         "[Clear conversation history]"
-                    ] + prompts
+                    ] + (
+                        self.prompt_index.search(query)
+                        if self.prompt_index is not None else []
+                    )
                 )
                 # Dropdown box for built-in prompt selection
                 prompt_act_selected = st.selectbox(
@@ -320,7 +510,9 @@ class ChatApp:
                     help=(
                         "The collection of built-in prompts were imported "
                         "from [awesome-chatgpt-prompts]"
-                        "(https://github.com/f/awesome-chatgpt-prompts)."
+                        "(https://github.com/f/awesome-chatgpt-prompts). "
+                        "Up to {} prompts matching the search are "
+                        "listed.".format(SEARCH_LIMIT)
                     ),
                 )
                 # Set the initial value for text message field based on ...
@@ -331,19 +523,14 @@ class ChatApp:
                     initial_value = (
                         "Ignore all previous instructions before this one."
                     )
+                    # Drop the persona along with the earlier instructions
+                    self.set_persona("")
                 else:
-                    prompt_id = list(
-                        df_prompts[df_prompts.act == prompt_act_selected].index
-                    )[0]
-                    initial_value = df_prompts.loc[prompt_id, "prompt"]
-                    # Add a system message to set the behavior of the ...
-                    # ...bot accordingly
-                    st.session_state["message_history"].append(
-                        {
-                            "role": "system",
-                            "content": f"You are {prompt_act_selected}"
-                        }
+                    initial_value = self.prompt_index.prompt(
+                        prompt_act_selected
                     )
+                    # Set the behavior of the bot accordingly
+                    self.set_persona(prompt_act_selected)
                 # Text message input field with initial value
                 user_message_text = st.text_area(
                     "Send text message",
@@ -354,12 +541,34 @@ class ChatApp:
                     value=initial_value,
                     height=120,
                 )
-                # Send user's text message to the bot
-                bot.chat(
-                    user_message=user_message_text,
-                    text_or_speak="text",
-                    selected_model=MODEL,
+                # Checkbox for comparing the answers of several models
+                compare_mode = st.checkbox(
+                    "Compare models side by side",
+                    help=(
+                        "Send your message to several GPT models at once "
+                        "and continue the conversation with the answer you "
+                        "prefer."
+                    ),
                 )
+                if compare_mode:
+                    # Dropdown box for selecting the models to compare
+                    compared_models = st.multiselect(
+                        "Models to compare",
+                        options=self.MODELS,
+                        default=["gpt-4o-mini", "o3-mini", "gpt-4o"],
+                    )
+                    # Send user's text message to the selected models ...
+                    # ...and display their answers side by side
+                    self.output_comparison(
+                        bot, user_message_text, compared_models
+                    )
+                else:
+                    # Send user's text message to the bot
+                    bot.chat(
+                        user_message=user_message_text,
+                        text_or_speak="text",
+                        selected_model=MODEL,
+                    )
                 # Output chat history
                 st.text("")
                 self.output_chat_history("text")
@@ -410,12 +619,14 @@ class ChatApp:
         # Desktop App for downloading
         st.text("")
         col1, col2 = st.columns([14, 7.3])
-        desktop_binary_file = "assets/ChatGPT-Tkinter-Desktop-App.exe"
-        with open(desktop_binary_file, "rb") as file:
-            # Display a download button for the desktop version of the chatbot
+        # Display a download button for the desktop version of the ...
+        # ...chatbot. The binary is read once per process rather than on ...
+        # ...every rerun
+        desktop_app = get_desktop_app()
+        if desktop_app is not None:
             col2.download_button(
                 label=":computer: Download Desktop Version",
-                data=file,
+                data=desktop_app,
                 file_name="ChatGPT-Tkinter-Desktop-App.exe",
                 mime="application/octet-stream",
                 help=(
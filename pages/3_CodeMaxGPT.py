@@ -1,9 +1,28 @@
 import streamlit as st
 from streamlit_ace import st_ace, KEYBINDINGS, LANGUAGES, THEMES
-from openai import OpenAI
-import math
+import hashlib
+import json
+import time
 from datetime import datetime
 from io import StringIO
+from utils.session import (
+    get_batch_jobs, get_challenge_fetcher, get_coder_service, get_core,
+    get_renderer, get_router, get_session_id, get_store, hydrate_session,
+    wait,
+)
+from utils.challenges import ChallengeFetchError, find_url
+from utils.repo_index import RepoIndexError, build_repo_context, load_index
+from utils.prompts import PrefixCacheStats, assemble_user_message
+from utils.retrieval import RetrievalIndex, format_chunks
+from utils.router import describe
+from utils.transfer_panel import show_transfer_panel
+from utils.turns import TurnLog
+from utils.batch import FINAL_STATUSES, BatchJob, build_batch_requests
+from utils.code_diff import build_code_prompt
+from utils.compaction import (
+    COMPACTION_THRESHOLD, build_seed_message, compaction_report,
+    summarize_turns,
+)
 
 
 
@@ -53,6 +72,17 @@ def TimeDiff(start_time: datetime, end_time: datetime) -> str:
         return "Just now"
 
 
+def content_hash(code: str) -> str:
+    """A function that fingerprints a version of a code file, so that the
+    versions sent on a thread can be persisted without their content.
+    Args:
+    - code (string): The content of the file.
+    Returns:
+    - str: The SHA-1 hex digest of the content.
+    """
+    return hashlib.sha1(code.encode("utf-8")).hexdigest()
+
+
 
 class CoderBot:
     """Define the class for the Coding Assistant Bot
@@ -63,85 +93,324 @@ class CoderBot:
         Args:
         - api_key (string): The OpenAI API key used to authenticate
         with the OpenAI service.
-        - selected_model (string): The GPT model to use. Default is
+        - selected_model (string): The GPT model to use, or 'Auto' to
+        route each prompt to the fastest adequate model. Default is
         'o3-mini'.
         """
-        # Instantiate a client object using api_key
+        # Get the async client of the API key from the execution core ...
+        # ...shared by all sessions
         self.api_key = api_key
-        self.client = OpenAI(api_key=self.api_key)
+        self.core = get_core()
+        self.client = self.core.client(self.api_key)
+        self.selected_model = selected_model
+        # The assistant logic shared with the command line and the HTTP API
+        self.service = get_coder_service()
 
         # Initialize session state variables
-        if "bot_messages" not in st.session_state:
-            st.session_state["bot_messages"] = {}
-        if "user_messages" not in st.session_state:
-            st.session_state["user_messages"] = {}
+        if App.TURNS_KEY not in st.session_state:
+            st.session_state[App.TURNS_KEY] = TurnLog()
+        self.turns = st.session_state[App.TURNS_KEY]
         if "code_language" not in st.session_state:
             st.session_state["code_language"] = ""
-        # Create a new object of Assistant and store it as a session ...
-        # ...state variable
-        if "assistant" not in st.session_state:
-            st.session_state["assistant"] = self.client.beta.assistants.create(
-                name="coding assistant",
-                instructions=(
-                    "You are an AI coding assistant. Your role involves "
-                    "performing a wide range of tasks to help users program "
-                    "more efficiently. These tasks may include generating "
-                    "code, debugging, refactoring, documenting, and addressing "
-                    "other custom requests from users. Please adhere strictly "
-                    "to the user's requirements."
-                ),
-                tools=[{"type": "code_interpreter"}],
-                model=selected_model,
-            )
-        # Create a Thread for new conversation and store it as a session ...
-        # ...state variable
-        if "thread" not in st.session_state:
-            st.session_state["thread"] = self.client.beta.threads.create()
+        self.store = get_store()
+        self.session_id = get_session_id()
+        # Open a connection to the API while the user types the prompt
+        self.core.warm_up(self.api_key)
+        # Only the IDs of the Assistant and the Thread are kept in the ...
+        # ...session, so that any replica can serve the next rerun
+        missing = [
+            key for key in ("assistant", "thread")
+            if key + "_id" not in st.session_state
+        ]
+        # As soon as the API key is entered, resume or create the ...
+        # ...Assistant and the Thread concurrently in the background, ...
+        # ...so that the first prompt only waits for the model
+        if missing and "warm-up" not in st.session_state:
+            st.session_state["warm-up"] = (missing, self.core.submit_all([
+                self.service.resolve(
+                    self.client,
+                    key,
+                    self.store.get_meta(self.session_id, key + "_id"),
+                    self.selected_model,
+                    self.session_id,
+                )
+                for key in missing
+            ]))
+        # Adopt the objects without waiting if they are already resolved
+        if "warm-up" in st.session_state \
+                and st.session_state["warm-up"][1].done():
+            self.ready()
 
 
-    def chat(self, prompt: str):
+    def ready(self):
+        """Method to store the IDs of the Assistant and the Thread
+        resolved by the warm-up as session state variables, waiting for the
+        warm-up to finish if needed.
+        """
+        if "warm-up" not in st.session_state:
+            return
+        keys, future = st.session_state["warm-up"]
+        try:
+            resolved = wait(future, "Preparing the assistant")
+        finally:
+            # Start over on the next rerun if the warm-up failed
+            del st.session_state["warm-up"]
+        for key, (object_id, created) in zip(keys, resolved):
+            st.session_state[key + "_id"] = object_id
+            if created:
+                # Remember the ID so that the session can be resumed later
+                self.store.set_meta(self.session_id, key + "_id", object_id)
+
+
+    def chat(self, prompt: str, action: str = None, files: dict = None):
         """Method to send user's prompt to GPT model and receive API
         response. This method also stores the user and bot messages in
-        corresponding session state variables.
+        the turn log.
         Args:
         - prompt (string): user's input prompt to send to assistant.
+        - action (string): The coding task selected by the user, used to
+        route the prompt when the 'Auto' model is selected.
+        - files (dict): {file name: code} of the code files carried by the
+        prompt, recorded as sent once the prompt is on the thread.
         """
         if prompt.strip():
-            # Document the user's message in a dictionary variable in ...
-            # ...session state with the current datetime as the key
-            st.session_state["user_messages"][datetime.now()] = prompt
-
-            # Add the user message to the thread
-            request = self.client.beta.threads.messages.create(
-                thread_id=st.session_state["thread"].id,
-                role="user",
-                content=prompt,
+            # Wait for the Assistant and the Thread if still resolving
+            self.ready()
+            router = get_router()
+            decision = None
+            model = self.selected_model
+            # Let the router pick the model for the prompt
+            if model == "Auto":
+                decision = router.route(prompt, action)
+                model = decision.model
+            # Document the user's message in the turn log
+            self.turns.append("user", prompt, "text")
+
+            # Start the exchange with the assistant on the execution ...
+            # ...core, and persist the user's message meanwhile
+            exchange = self.core.submit(self.service.exchange(
+                self.client,
+                thread_id=st.session_state["thread_id"],
+                assistant_id=st.session_state["assistant_id"],
+                prompt=prompt,
+                model=model,
+            ))
+            self.store.append_turns(
+                self.session_id, App.PAGE, self.turns.unpersisted()
             )
-            # Start a run in the thread using the current assistant and ...
-            # ...wait for comletion
-            run = self.client.beta.threads.runs.create_and_poll(
-                thread_id=st.session_state["thread"].id,
-                assistant_id=st.session_state["assistant"].id,
+            run, bot_message, latency = wait(
+                exchange, "Waiting for the assistant ({})".format(model)
             )
+            # The prompt is on the thread once the exchange returns, so ...
+            # ...its files are only recorded as sent now; if the exchange ...
+            # ...failed or was cancelled, they are sent in full next time
+            if files:
+                self.mark_sent(files)
             # Check if the run has completed successfully
             if run.status == "completed":
-                # Retrieve the list of messages from the thread
-                messages = self.client.beta.threads.messages.list(
-                    thread_id=st.session_state["thread"].id
+                # Record the latency of the model for future routing ...
+                # ...decisions
+                router.record(model, latency)
+                if decision is not None:
+                    st.caption(describe(decision, latency))
+                # Report the share of the prompt served from the ...
+                # ...prompt cache
+                report = self.cache_stats().record(run.usage)
+                if report:
+                    st.caption(report)
+                # Document the latest bot's message in the turn log, ...
+                # ...along with the number of tokens reported by the API
+                self.turns.append(
+                    "assistant",
+                    bot_message,
+                    "text",
+                    tokens=run.usage.completion_tokens if run.usage else None,
                 )
-                # Extract the latest bot message from the response data
-                bot_message = messages.data[0].content[0].text.value
+                # Compact the thread once the context processed by each ...
+                # ...run grows past the threshold
+                context_tokens = run.usage.prompt_tokens if run.usage else 0
+                if self.compaction_helps(context_tokens) \
+                        and context_tokens > COMPACTION_THRESHOLD:
+                    self.compact_thread(context_tokens)
             else:
-                # If the run did not complete, set bot_message to None and ...
-                # ...print the run status
-                bot_message = None
+                # If the run did not complete, leave the user's message ...
+                # ...unanswered and print the run status
                 print(run.status)
 
             # Print the bot's response to the console
             print(bot_message)
-            # Document the latest bot's messages in a dictionary variable ...
-            # ...in session state with the current datetime as the key
-            st.session_state["bot_messages"][datetime.now()] = bot_message
+            # Persist the new turns in the conversation store
+            self.store.append_turns(
+                self.session_id, App.PAGE, self.turns.unpersisted()
+            )
+
+
+    def embed(self, model: str, texts: list) -> list:
+        """Method to compute the embeddings of texts for retrieval.
+        Args:
+        - model (string): The embedding model.
+        - texts (list): The texts to embed.
+        Returns:
+        - list: The embedding of each text, in order.
+        """
+        response = self.core.run(
+            self.client.embeddings.create(model=model, input=texts)
+        )
+        return [item.embedding for item in response.data]
+
+
+    def compaction_helps(self, context_tokens: int) -> bool:
+        """Method to tell whether compacting the thread would reduce the
+        context, called after every completed run. A thread that was itself
+        compacted is not compacted again if its first run was still over
+        the threshold, as a new thread would be seeded the same way.
+        Args:
+        - context_tokens (int): The prompt tokens of the latest run.
+        Returns:
+        - bool: Whether the thread may be compacted.
+        """
+        # {'thread': ID of the compacted thread, 'first_run': prompt ...
+        # ...tokens of its first run, 'summary': summary it was seeded ...
+        # ...with, 'until': time of the last turn that summary covers}
+        compaction = st.session_state.get("compaction")
+        if compaction is None \
+                or compaction["thread"] != st.session_state["thread_id"]:
+            return True
+        if compaction["first_run"] is None:
+            compaction["first_run"] = context_tokens
+        return compaction["first_run"] <= COMPACTION_THRESHOLD
+
+
+    def compact_thread(self, context_tokens: int):
+        """Method to replace the current thread with a fresh one seeded
+        with a summary of the conversation and the code files sent since
+        the last compaction, so that later runs no longer reprocess the
+        whole history.
+        Args:
+        - context_tokens (int): The prompt tokens of the latest run.
+        """
+        # Summarize the turns added since this thread was seeded, on top ...
+        # ...of the summary it was seeded with, if any, instead of ...
+        # ...summarizing again what that summary covers
+        compaction = st.session_state.get("compaction")
+        previous, since = "", None
+        if compaction is not None \
+                and compaction["thread"] == st.session_state["thread_id"]:
+            previous, since = compaction["summary"], compaction["until"]
+        summary = wait(
+            self.core.submit(summarize_turns(
+                self.client,
+                [
+                    turn for turn in self.turns
+                    if since is None or turn.timestamp > since
+                ],
+                previous,
+            )),
+            "Summarizing the conversation",
+        )
+        # Seed the current version of the files sent on this thread, the ...
+        # ...most recently sent first, within the seed's token budget
+        uploaded = st.session_state.get("files", {})
+        seed, seeded = build_seed_message(summary, {
+            name: uploaded[name]
+            for name in reversed(list(self.sent_files()))
+            if name in uploaded
+        })
+        # Start a new thread seeded with the summary and swap it in
+        st.session_state["thread_id"] = self.core.run(
+            self.client.beta.threads.create(
+                messages=[{"role": "user", "content": seed}]
+            )
+        ).id
+        self.store.set_meta(
+            self.session_id, "thread_id", st.session_state["thread_id"]
+        )
+        # The new thread has seen exactly the files in the seed message
+        self.mark_sent(seeded)
+        st.session_state["compaction"] = {
+            "thread": st.session_state["thread_id"], "first_run": None,
+            "summary": summary, "until": self.turns.last().timestamp,
+        }
+        # Report the context savings on the web page
+        st.info(compaction_report(context_tokens, seed))
+
+
+    def cache_stats(self) -> PrefixCacheStats:
+        """Method to get the prompt cache statistics of the session.
+        Returns:
+        - PrefixCacheStats: The statistics, created on first use.
+        """
+        return st.session_state.setdefault(
+            App.CACHE_STATS_KEY, PrefixCacheStats()
+        )
+
+
+    def sent_files(self) -> dict:
+        """Method to get the latest version of each code file sent on the
+        current thread.
+        Returns:
+        - dict: {file name: code}, reset whenever the thread changes.
+        Use mark_sent() and forget_sent() to change it.
+        """
+        self.ready()
+        thread_id = st.session_state["thread_id"]
+        if st.session_state.get("sent-files-thread") != thread_id:
+            st.session_state["sent-files-thread"] = thread_id
+            st.session_state["sent-files"] = self.load_sent(thread_id)
+        return st.session_state["sent-files"]
+
+
+    def load_sent(self, thread_id: str) -> dict:
+        """Method to rebuild the files sent on a thread from the hashes
+        persisted in the conversation store, e.g. after the session moved
+        to another replica of the app.
+        Args:
+        - thread_id (string): The ID of the current thread.
+        Returns:
+        - dict: {file name: code} of the uploaded files whose current
+        version is the one sent on the thread.
+        """
+        sent = json.loads(
+            self.store.get_meta(self.session_id, "sent_files") or "{}"
+        )
+        if sent.get("thread") != thread_id:
+            return {}
+        return {
+            name: code
+            for name, code in st.session_state.get("files", {}).items()
+            if sent["files"].get(name) == content_hash(code)
+        }
+
+
+    def mark_sent(self, files: dict):
+        """Method to record the versions of code files sent on the current
+        thread, in the session and in the conversation store.
+        Args:
+        - files (dict): {file name: code} of the files sent.
+        """
+        self.sent_files().update(files)
+        self.save_sent()
+
+
+    def forget_sent(self):
+        """Method to record that the files sent on the current thread are
+        to be disregarded, so that they are sent in full again.
+        """
+        self.sent_files().clear()
+        self.save_sent()
+
+
+    def save_sent(self):
+        """Method to persist the hashes of the files sent on the current
+        thread, which is enough to rebuild them from the stored files.
+        """
+        self.store.set_meta(self.session_id, "sent_files", json.dumps({
+            "thread": st.session_state["thread_id"],
+            "files": {
+                name: content_hash(code)
+                for name, code in self.sent_files().items()
+            },
+        }))
 
 
 
@@ -155,6 +424,21 @@ class App:
                   ".py": "python", ".java": "java", ".c": "c_cpp",
                   ".cs": "csharp", ".PHP": "php", ".swift": "swift",
                   ".bas": "vba", ".txt": "plain_text"}
+    # Name of the web app in the conversation store
+    PAGE = "codemax"
+    # Coding tasks that can be run on many files through the Batch API
+    BATCH_ACTIONS = ["Debug Code", "Refactor Code", "Refactor Code to OOP",
+                     "Comment Code", "Review Code"]
+    # Maximum number of batch jobs listed per session
+    MAX_BATCH_JOBS = 20
+    # Session state key of the turn log
+    TURNS_KEY = "turns-codemax"
+    # Session state key of the prompt cache statistics
+    CACHE_STATS_KEY = "cache-stats-codemax"
+    # Session state keys holding the conversation history
+    HISTORY_KEYS = [TURNS_KEY, "files", "assistant_id", "thread_id",
+                    "sent-files", "sent-files-thread", "retrieval-index",
+                    CACHE_STATS_KEY, "warm-up"]
 
     def __init__(self):
         """Initialize a new instance of the App class.
@@ -173,6 +457,10 @@ class App:
         self.LANGUAGES.append("vba")
         # Remove duplicates from the list of languages
         self.LANGUAGES = list(set(self.LANGUAGES))
+        # Restore the most recent turns and the uploaded files from the ...
+        # ...conversation store if they are not in memory (new tab, ...
+        # ...page refresh or eviction after being idle)
+        hydrate_session(self.PAGE, self.HISTORY_KEYS, self.load_history)
         # Initialize session state variables for config data storage
         if "files" not in st.session_state:
             st.session_state["files"] = {}
@@ -182,10 +470,31 @@ class App:
             st.session_state["code_font_size"] = ""
 
 
-    def send_prompt(self, prompt: str):
+    def load_history(self, store, session_id: str, window: int):
+        """Method to rebuild the chat history and uploaded files from the
+        conversation store.
+        Args:
+        - store (ConversationStore): The conversation store.
+        - session_id (string): The ID of the browser session.
+        - window (int): The maximum number of turns to load.
+        """
+        turns = store.load_turns(session_id, self.PAGE, window)
+        # Drop bot replies whose user message fell outside the window
+        while turns and turns[0].role == "assistant":
+            turns.pop(0)
+        st.session_state[self.TURNS_KEY] = TurnLog(turns)
+        st.session_state["files"] = store.load_files(session_id)
+
+
+    def send_prompt(self, prompt: str, retrieve: bool = True,
+                    files: dict = None):
         """Method to send user's prompt to the bot.
         Args:
         - prompt (string): user's input prompt.
+        - retrieve (bool): Whether to attach the excerpts of the uploaded
+        files that are most relevant to the prompt.
+        - files (dict): {file name: code} of the code files carried by the
+        prompt, in full or as a diff.
         """
         # Check if there's any code uploaded
         if st.session_state["files"]:
@@ -195,8 +504,45 @@ class App:
                 # Display the names of the code files uploaded on the web page
                 if file != "Sample Code Provided":
                     st.text("[{} uploaded]".format(file))
+            if retrieve:
+                prompt = self.attach_excerpts(prompt, files or {})
         # The bot sends user's prompt to GPT model for chat processing
-        self.bot.chat(prompt=prompt)
+        self.bot.chat(prompt=prompt, action=self.action, files=files)
+
+
+    def attach_excerpts(self, prompt: str, files: dict) -> str:
+        """Method to attach the top-ranked chunks of the uploaded files to
+        a prompt, so that the prompt stays bounded as more files are
+        uploaded.
+        Args:
+        - prompt (string): user's input prompt.
+        - files (dict): {file name: code} of the code files the prompt
+        already carries.
+        Returns:
+        - str: The prompt preceded by the relevant excerpts, if any.
+        """
+        # Re-chunk only the files that changed since the last prompt
+        index = st.session_state.setdefault(
+            "retrieval-index", RetrievalIndex()
+        )
+        index.update(st.session_state["files"])
+        # Files whose current version is already on the thread or in ...
+        # ...the prompt are visible to the assistant and need no excerpts
+        sent_files = self.bot.sent_files()
+        exclude = {
+            file_name
+            for file_name, code in st.session_state["files"].items()
+            if sent_files.get(file_name) == code
+            or files.get(file_name) == code
+        }
+        chunks = index.search(prompt, exclude, embed=self.bot.embed)
+        if not chunks:
+            return prompt
+        st.caption("Attached relevant excerpts: {}".format(", ".join(
+            "{} (lines {}-{})".format(chunk.file_name, chunk.start, chunk.end)
+            for chunk in chunks
+        )))
+        return assemble_user_message(prompt, format_chunks(chunks))
 
 
     def get_code(self, initial_code: str, initial_lang: str) -> str:
@@ -312,22 +658,20 @@ class App:
         )
         # The 'Send' button appears only when user has uploaded their code
         if code.strip():
-            # Construct the prompt containing the code
-            if not file_name.strip():
-                prompt_code = "Here is the code:  \n```{}  \n{}  \n```" \
-                              .format(
-                                  st.session_state["code_language"], code
-                              )
-            else:
-                # Include code file name in the prompt
-                prompt_code = "Here is the `{}` code:  \n```{}  \n{}  \n```" \
-                              .format(
-                                  file_name,
-                                  st.session_state["code_language"],
-                                  code,
-                              )
-            # Combine the user's text prompt and code prompt together
-            prompt = user_message + "  \n" + prompt_code
+            # The code is tracked on the thread under its file name, or ...
+            # ...as 'Sample Code Provided' if it doesn't have one
+            file_key = file_name.strip() or "Sample Code Provided"
+            # Construct the prompt containing the code, or only the ...
+            # ...changes since the version last sent on the thread
+            prompt_code = build_code_prompt(
+                code=code,
+                language=st.session_state["code_language"],
+                file_name=file_name.strip(),
+                previous=self.bot.sent_files().get(file_key),
+            )
+            # Combine the code prompt and user's text prompt together, ...
+            # ...with the code first as it changes less between prompts
+            prompt = assemble_user_message(user_message, prompt_code)
             # self.col3.text(prompt)
             # Add 3 lines of white space
             self.c1.markdown("#")
@@ -341,13 +685,20 @@ class App:
                     # ...name as the key
                     if "Sample Code Provided" in st.session_state["files"]:
                         del st.session_state["files"]["Sample Code Provided"]
+                        self.bot.store.delete_file(
+                            self.bot.session_id, "Sample Code Provided"
+                        )
                     st.session_state["files"][file_name] = code
                 else:
                     # If the uploaded code doesn't have a file name, use ...
                     # ...'Sample Code Provided' as the key
-                    st.session_state["files"]["Sample Code Provided"] = code
-                # Send the final prompt to the bot
-                self.send_prompt(prompt)
+                    file_name = "Sample Code Provided"
+                    st.session_state["files"][file_name] = code
+                # Persist the uploaded code in the conversation store
+                self.bot.store.save_file(self.bot.session_id, file_name, code)
+                # Send the final prompt to the bot, which remembers the ...
+                # ...version sent on the thread for later diffs
+                self.send_prompt(prompt, files={file_key: code})
 
 
     def upload_code(self, user_message):
@@ -414,6 +765,209 @@ class App:
                 )
 
 
+    def repo_readme_prompt(self, repo_url: str) -> str:
+        """Method to build the prompt for generating the README of a
+        repository, grounded in a local snapshot of the repository.
+        Args:
+        - repo_url (string): The HTTPS URL of the repository.
+        Returns:
+        - str: The prompt.
+        """
+        prompt = (
+            "Generate the GitHub README for the github repo: {}.".format(
+                repo_url
+            )
+        )
+        start = time.time()
+        try:
+            # Only the files changed since the last snapshot are re-indexed
+            with st.spinner("Indexing the repository..."):
+                index, reindexed = load_index(repo_url)
+        except RepoIndexError as error:
+            # Fall back to the URL alone if the repo cannot be read
+            self.col1.warning(
+                "The repository could not be indexed: {}".format(error)
+            )
+            return prompt
+        self.col1.caption(
+            "Indexed {} files at commit {} ({} re-indexed, {:.1f} s)."
+            .format(
+                len(index["files"]), index["sha"][:7], reindexed,
+                time.time() - start,
+            )
+        )
+        return (
+            prompt + " Base it on this snapshot of the repository:  \n"
+            + build_repo_context(index)
+        )
+
+
+    def challenge_problem(self, coding_problem: str) -> str:
+        """Method to ground a coding challenge given by its URL in the
+        statement of the problem, fetched once and shared by all sessions
+        until it expires.
+        Args:
+        - coding_problem (string): The challenge entered by the user.
+        Returns:
+        - str: The challenge followed by the statement, or as entered if
+        it has no URL or the statement cannot be fetched.
+        """
+        url = find_url(coding_problem)
+        if url is None:
+            return coding_problem
+        try:
+            with st.spinner("Fetching the coding challenge..."):
+                challenge, cached = get_challenge_fetcher().fetch(url)
+        except ChallengeFetchError as error:
+            # Fall back to the URL alone if the page cannot be read
+            self.col1.warning(
+                "The coding challenge could not be fetched: {}".format(error)
+            )
+            return coding_problem
+        self.col1.caption("Fetched '{}'{}.".format(
+            challenge.title, " from the cache" if cached else ""
+        ))
+        return (
+            coding_problem + "  \nProblem statement of {}:  \n{}".format(
+                challenge.title, challenge.text
+            )
+        )
+
+
+    def send_batch(self, user_message: str, model: str):
+        """Method to submit the selected coding task for every uploaded
+        file as a Batch API job.
+        Args:
+        - user_message (string): The prompt of the selected coding task.
+        - model (string): The GPT model selected by the user.
+        """
+        # Display a file uploader for adding many files at once
+        uploaded_files = self.col1.file_uploader(
+            "Upload code files for the batch job", accept_multiple_files=True
+        )
+        for uploaded_file in uploaded_files or []:
+            code = uploaded_file.getvalue().decode("utf-8")
+            if st.session_state["files"].get(uploaded_file.name) != code:
+                st.session_state["files"][uploaded_file.name] = code
+                self.bot.store.save_file(
+                    self.bot.session_id, uploaded_file.name, code
+                )
+        files = st.session_state["files"]
+        if not files:
+            return
+        # If the 'Submit batch job' button is clicked
+        if self.col1.button(
+            "Submit batch job for {} file(s)".format(len(files))
+        ):
+            # Batch jobs are not interactive, so 'Auto' is routed by task
+            if model == "Auto":
+                model = get_router().route("", self.action).model
+            requests_jsonl = build_batch_requests(
+                files=files,
+                user_message=user_message,
+                model=model,
+                instructions=self.bot.service.INSTRUCTIONS,
+                build_prompt=lambda file_name, code: build_code_prompt(
+                    code=code,
+                    language=self.get_code_language(
+                        file_name=file_name, default_lang="plain_text"
+                    ),
+                    file_name=file_name,
+                ),
+            )
+            job = BatchJob.submit(
+                self.bot.core, self.bot.client, requests_jsonl,
+                description=self.action,
+            )
+            # Track the job in the background and remember its ID so ...
+            # ...that it can be followed after a page refresh
+            get_batch_jobs().add(self.bot.session_id, job)
+            self.save_batch_ids(self.batch_ids() + [job.batch_id])
+            self.col1.success("Batch job {} submitted.".format(job.batch_id))
+
+
+    def batch_ids(self) -> list:
+        """Method to get the IDs of the batch jobs submitted in this
+        session.
+        Returns:
+        - list: The batch IDs, oldest first.
+        """
+        return json.loads(
+            self.bot.store.get_meta(self.bot.session_id, "batch_ids", "[]")
+        )
+
+
+    def save_batch_ids(self, batch_ids: list):
+        """Method to persist the IDs of the batch jobs of this session,
+        keeping the most recent MAX_BATCH_JOBS.
+        Args:
+        - batch_ids (list): The batch IDs, oldest first.
+        """
+        self.bot.store.set_meta(
+            self.bot.session_id, "batch_ids",
+            json.dumps(batch_ids[-self.MAX_BATCH_JOBS:]),
+        )
+
+
+    def show_batch_jobs(self):
+        """Method to display the status and the results received so far
+        of the batch jobs submitted in this session.
+        """
+        batch_ids = self.batch_ids()
+        if not batch_ids:
+            return
+        registry = get_batch_jobs()
+        st.markdown("**Batch jobs** (refresh the page to update):")
+        # Only this session's jobs are listed. Those dropped from memory ...
+        # ...or submitted before a server restart are tracked again
+        for batch_id, job in registry.jobs(
+            self.bot.session_id, batch_ids[::-1],
+            lambda batch_id: BatchJob(
+                self.bot.core, self.bot.client, batch_id
+            ),
+        ):
+            batch, error, results = job.snapshot()
+            if error:
+                st.error("Batch job {}: {}".format(batch_id, error))
+                continue
+            if batch is None:
+                st.text("Batch job {}: checking status...".format(batch_id))
+                continue
+            counts = batch.request_counts
+            st.text(
+                "Batch job {} ({}): {}, {} of {} requests done, {} "
+                "result(s) received".format(
+                    batch_id,
+                    (batch.metadata or {}).get("description", ""),
+                    batch.status,
+                    counts.completed + counts.failed if counts else 0,
+                    counts.total if counts else "?",
+                    len(results),
+                )
+            )
+            # Display each result in an Expander as it arrives
+            for file_name, (answer, ok) in results.items():
+                with st.expander(label="{} [{}]".format(
+                    file_name, "done" if ok else "failed"
+                )):
+                    st.markdown(answer)
+            # Once the results are downloaded, the job is forgotten
+            if batch.status in FINAL_STATUSES and st.download_button(
+                "Download the results and dismiss the job",
+                data="\n\n".join(
+                    "## {}\n\n{}".format(file_name, answer)
+                    for file_name, (answer, _) in results.items()
+                ),
+                file_name="batch-{}.md".format(batch_id),
+                mime="text/markdown",
+                key="download-{}".format(batch_id),
+            ):
+                registry.drop(self.bot.session_id, batch_id)
+                self.save_batch_ids([
+                    other for other in self.batch_ids() if other != batch_id
+                ])
+
+
     def show_code_uploaded(self):
         """Method to display the uploaded code inside Expanders on the web
         page.
@@ -456,41 +1010,23 @@ class App:
     def output_chat_history(self):
         """Method to display chat history between user and bot.
         """
-        # Check if there are any messages stored in the bot messages ...
-        # ...session state
-        if st.session_state["bot_messages"]:
-            # Convert the bot and user messages into lists of tuples
-            bot_messages_pairs = list(
-                st.session_state["bot_messages"].items()
-            )
-            user_messages_pairs = list(
-                st.session_state["user_messages"].items()
-            )
-
-            # Record the current time
-            current_time = datetime.now()
-            # Loop through the messages in reverse order to display the ...
-            # ...most recent first
-            for i in range(len(bot_messages_pairs) - 1, -1, -1):
-                # Retrieve the time label and content for the bot's ...
-                # ...message based on current index
-                dt_bot = bot_messages_pairs[i][0]
+        # Pair the user's and bot's messages from the turn log
+        dialogs = st.session_state[self.TURNS_KEY].dialogs()
+        # Past messages never change, so their HTML is rendered with ...
+        # ...highlighted code blocks once and shared by all sessions
+        renderer = get_renderer()
+        # Record the current time
+        current_time = datetime.now()
+        # Loop through the messages in reverse order to display the ...
+        # ...most recent first
+        for user_turn, bot_turn in reversed(dialogs):
+            # Display the bot's message, unless the run failed
+            if bot_turn is not None:
                 # Calculate how long ago the bot's message was received
                 time_diff_bot = TimeDiff(
-                    start_time=dt_bot, end_time=current_time
+                    start_time=bot_turn.timestamp, end_time=current_time
                 )
                 time_label_bot = f"<{time_diff_bot} ago>"
-                content_bot = bot_messages_pairs[i][1]
-                # Retrieve the time label and content for the user's ...
-                # ...message based on current index
-                dt_user = user_messages_pairs[i][0]
-                # Calculate how long ago the user's message was sent
-                time_diff_user = TimeDiff(
-                    start_time=dt_user, end_time=current_time
-                )
-                time_label_user = f"<{time_diff_user} ago>"
-                content_user = user_messages_pairs[i][1]
-
                 # Display the bot's message label
                 st.markdown(
                     "<span style='color:#6699FF'><strong>CoderBot </strong>"
@@ -498,18 +1034,28 @@ class App:
                     + ":</span>",
                     unsafe_allow_html=True,
                 )
-                # Display the bot's message content
-                st.markdown(content_bot)
-
-                # Display user's message label
+                # Display the bot's message content, rendered to HTML ...
+                # ...once and then reused from the cache on every rerun
                 st.markdown(
-                    "<span style='color:#6699FF'><strong>You </strong>"
-                    + time_label_user
-                    + ":</span>",
-                    unsafe_allow_html=True,
+                    renderer.render(bot_turn.content), unsafe_allow_html=True
                 )
-                # Display the user's message content
-                st.markdown(content_user)
+
+            # Calculate how long ago the user's message was sent
+            time_diff_user = TimeDiff(
+                start_time=user_turn.timestamp, end_time=current_time
+            )
+            time_label_user = f"<{time_diff_user} ago>"
+            # Display user's message label
+            st.markdown(
+                "<span style='color:#6699FF'><strong>You </strong>"
+                + time_label_user
+                + ":</span>",
+                unsafe_allow_html=True,
+            )
+            # Display the user's message content
+            st.markdown(
+                renderer.render(user_turn.content), unsafe_allow_html=True
+            )
 
 
     def run(self):
@@ -517,6 +1063,8 @@ class App:
         """
         # Set the page title
         st.title("Welcome to CodeMaxGPT")
+        # Let users save or restore the session from the sidebar
+        show_transfer_panel()
         # st.header('Code Big, Even If You Are Junior!')
         # Display a subheader that briefly describes the coding assistant app
         st.subheader(
@@ -529,7 +1077,8 @@ class App:
         # Get the GPT model selected by the user
         MODEL = cl1.selectbox(
             "Select a GPT model",
-            ("o3-mini", "gpt-4o-mini", "gpt-4o", "o1", "gpt-4.5-preview"),
+            ("o3-mini", "gpt-4o-mini", "gpt-4o", "o1", "gpt-4.5-preview",
+             "Auto"),
             help=(
                 "For many basic tasks, the difference between the various GPT "
                 "models is not significant. However, in more complex reasoning "
@@ -537,7 +1086,8 @@ class App:
                 "and GPT-4.5 are much more capable than any of the previous "
                 "models, though they may come at a higher usage cost. Please "
                 "visit https://platform.openai.com/docs/models for more "
-                "information on OpenAI models."
+                "information on OpenAI models. Choose 'Auto' to send each "
+                "request to the fastest model that is adequate for it."
             ),
         )
         # Get the API key from the user
@@ -570,7 +1120,7 @@ class App:
             self.col1, col2, self.col3 = st.columns([1, 0.25, 1])
 
             # Dropdown box for coding task selection
-            action = self.col1.selectbox(
+            action = self.action = self.col1.selectbox(
                 label="How can the bot assist with your code?",
                 options=[
                     "Specify Custom Requirements",
@@ -604,27 +1154,30 @@ class App:
                         "field blank."
                     ),
                 )
-                # Construct the prompt based on the repo URL entry
-                if not repo_url.strip():
-                    prompt = (
-                        "Generate the GitHub README for the entire program."
-                    )
-                else:
-                    prompt = (
-                        "Generate the GitHub README for the "
-                        f"github repo: {repo_url}."
-                    )
                 # 'Generate' button only appears when there's code uploaded ...
                 # ...or when a repo URL is provided
                 if st.session_state["files"] or repo_url.strip():
                     # If 'Generate' button is clicked
                     if self.col1.button("Generate"):
+                        # Construct the prompt based on the repo URL entry
+                        if not repo_url.strip():
+                            prompt = (
+                                "Generate the GitHub README for the entire "
+                                "program."
+                            )
+                        else:
+                            prompt = self.repo_readme_prompt(
+                                repo_url.strip()
+                            )
                         # Send the prompt to the bot
                         self.send_prompt(prompt)
-                        # Get the generated README content
-                        readme = list(
-                            st.session_state["bot_messages"].values()
-                        )[-1]
+                        # Get the generated README content, if the run ...
+                        # ...has completed
+                        last_turn = st.session_state[self.TURNS_KEY].last()
+                        readme = (
+                            last_turn.content
+                            if last_turn.role == "assistant" else ""
+                        )
                         # Display a download button for README file
                         self.col1.download_button(
                             label="Download README for immediate use",
@@ -683,22 +1236,6 @@ class App:
                 lang_selected = _c2.selectbox(
                     "Language Mode", options=coding_langs, index=0
                 )
-                # Construct the prompt based on the selected coding language
-                if "SQL" in lang_selected:
-                    prompt = (
-                        "Solve the problem in {}:  \n".format(lang_selected)
-                        + coding_problem
-                        + "  \nExplain the solution and display it in a "
-                        + "code block."
-                    )
-                else:
-                    prompt = (
-                        "Solve the problem in {}:  \n".format(lang_selected)
-                        + coding_problem
-                        + "  \nExplain the solution and display it in a "
-                        + "code block.  \nAlso, Clarify the time and space "
-                        + "complexity of the solution."
-                    )
                 # 'Send' button only appears if the coding problem is entered
                 if coding_problem.strip():
                     # Add 3 lines of white space
@@ -707,8 +1244,32 @@ class App:
                     _c2.markdown("###")
                     # If the 'Send' button is clicked
                     if _c2.button("Send"):
-                        # Send the prompt to the bot
-                        self.send_prompt(prompt)
+                        # Fetch the statement of a problem given by its URL
+                        problem = self.challenge_problem(coding_problem)
+                        # Construct the prompt based on the selected ...
+                        # ...coding language
+                        if "SQL" in lang_selected:
+                            prompt = (
+                                "Solve the problem in {}:  \n".format(
+                                    lang_selected
+                                )
+                                + problem
+                                + "  \nExplain the solution and display it "
+                                + "in a code block."
+                            )
+                        else:
+                            prompt = (
+                                "Solve the problem in {}:  \n".format(
+                                    lang_selected
+                                )
+                                + problem
+                                + "  \nExplain the solution and display it "
+                                + "in a code block.  \nAlso, Clarify the "
+                                + "time and space complexity of the solution."
+                            )
+                        # Send the prompt to the bot, without excerpts ...
+                        # ...of the unrelated uploaded files
+                        self.send_prompt(prompt, retrieve=False)
 
             # If user selects a coding task other than 'Generate GitHub ...
             # ...README' and 'Suggest a Solution For a Coding Challenge'
@@ -756,20 +1317,43 @@ class App:
                     )
                 if action == "[Delete all previously uploaded files]":
                     st.session_state["files"] = {}
+                    self.bot.store.clear_files(self.bot.session_id)
+                    # Send the full code again after it is disregarded
+                    self.bot.forget_sent()
                     user_message = self.col1.text_area(
                         "Specify your requirements here",
                         value="Please disregard any previously provided code.",
                         height=180,
                     )
 
-                # Choose a method to upload code
-                self.upload_code(user_message)
+                # Checkbox for running the task on all uploaded files ...
+                # ...through the Batch API instead of interactively
+                batch_mode = (
+                    action in self.BATCH_ACTIONS
+                    and self.col1.checkbox(
+                        "Batch mode: run on all uploaded files",
+                        help=(
+                            "Submit the task for every uploaded file as an "
+                            "OpenAI Batch API job. Results arrive within 24 "
+                            "hours at a lower cost than interactive requests."
+                        ),
+                    )
+                )
+                if batch_mode:
+                    # Package the uploaded files into a batch job
+                    self.send_batch(user_message, MODEL)
+                else:
+                    # Choose a method to upload code
+                    self.upload_code(user_message)
 
                 # Display the code uploaded (if any) for view
                 self.show_code_uploaded()
 
             st.text("")
 
+            # Display the status and results of the batch jobs
+            self.show_batch_jobs()
+
             # Output chat history
             self.output_chat_history()
 
@@ -0,0 +1,231 @@
+"""Serve a local mock of the OpenAI Files and Batch APIs.
+
+Usage:
+    python scripts/mock_openai_batch.py [--port PORT] [--seconds S]
+
+Start the app with OPENAI_BASE_URL=http://localhost:PORT/v1 to try the
+CodeMaxGPT batch mode without spending tokens. Every batch job moves from
+'validating' to 'in_progress' and reaches 'completed' after S seconds
+(default 20); each request is answered with a canned reply that echoes
+its custom ID. Only the endpoints used by utils/batch.py are implemented,
+and all state is kept in memory.
+"""
+import email
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# {file ID: (file name, bytes)}
+FILES = {}
+# {batch ID: batch object as a dict}
+BATCHES = {}
+LOCK = threading.Lock()
+# Seconds a mock batch job takes to complete
+COMPLETION_SECONDS = 20.0
+
+
+
+def new_id(prefix: str) -> str:
+    """Function that generates an ID in the style of the OpenAI API.
+    """
+    return "{}_{}".format(prefix, uuid.uuid4().hex[:24])
+
+
+def parse_upload(content_type: str, body: bytes) -> tuple:
+    """Function that extracts the uploaded file from a multipart request.
+    Args:
+    - content_type (string): The Content-Type header of the request.
+    - body (bytes): The request body.
+    Returns:
+    - tuple: (file name, file bytes, purpose).
+    """
+    message = email.message_from_bytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+    )
+    file_name, content, purpose = "upload", b"", ""
+    for part in message.get_payload():
+        name = part.get_param("name", header="content-disposition")
+        if name == "file":
+            file_name = part.get_filename() or file_name
+            content = part.get_payload(decode=True)
+        elif name == "purpose":
+            purpose = part.get_payload(decode=True).decode()
+    return file_name, content, purpose
+
+
+def file_object(file_id: str, name: str, content: bytes,
+                purpose: str) -> dict:
+    """Function that describes a stored file like the Files API does.
+    """
+    return {
+        "id": file_id, "object": "file", "bytes": len(content),
+        "created_at": int(time.time()), "filename": name,
+        "purpose": purpose, "status": "processed",
+    }
+
+
+def run_batch(batch_id: str):
+    """Function that answers every request of a mock batch job and writes
+    its output file once the simulated processing time has elapsed.
+    Args:
+    - batch_id (string): The ID of the batch job.
+    """
+    with LOCK:
+        batch = BATCHES[batch_id]
+        requests = [
+            json.loads(line)
+            for line in FILES[batch["input_file_id"]][1].splitlines()
+            if line.strip()
+        ]
+        batch["request_counts"]["total"] = len(requests)
+        batch["status"] = "in_progress"
+        batch["in_progress_at"] = int(time.time())
+    time.sleep(COMPLETION_SECONDS)
+    lines = []
+    for request in requests:
+        lines.append(json.dumps({
+            "id": new_id("batch_req"),
+            "custom_id": request["custom_id"],
+            "response": {
+                "status_code": 200,
+                "request_id": uuid.uuid4().hex,
+                "body": {
+                    "id": new_id("chatcmpl"),
+                    "object": "chat.completion",
+                    "model": request["body"]["model"],
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {
+                            "role": "assistant",
+                            "content": "Mock answer for **{}**.".format(
+                                request["custom_id"]
+                            ),
+                        },
+                    }],
+                },
+            },
+            "error": None,
+        }))
+    output = ("\n".join(lines) + "\n").encode("utf-8")
+    with LOCK:
+        batch = BATCHES[batch_id]
+        if batch["status"] == "cancelling":
+            batch["status"] = "cancelled"
+            batch["cancelled_at"] = int(time.time())
+            return
+        file_id = new_id("file")
+        FILES[file_id] = ("batch_output.jsonl", output)
+        batch["output_file_id"] = file_id
+        batch["request_counts"]["completed"] = len(requests)
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Define the request handler of the mock API.
+    """
+
+    def send_json(self, status: int, payload: dict):
+        """Method to send a JSON response.
+        """
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def not_found(self):
+        """Method to send the error response of an unknown resource.
+        """
+        self.send_json(404, {"error": {
+            "message": "No such resource: {}".format(self.path),
+            "type": "invalid_request_error",
+        }})
+
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        with LOCK:
+            # GET /v1/files/{id}/content
+            if parts[1:2] == ["files"] and parts[3:] == ["content"]:
+                if parts[2] not in FILES:
+                    return self.not_found()
+                content = FILES[parts[2]][1]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+                return
+            # GET /v1/batches/{id}
+            if parts[1:2] == ["batches"] and len(parts) == 3:
+                if parts[2] not in BATCHES:
+                    return self.not_found()
+                return self.send_json(200, BATCHES[parts[2]])
+        self.not_found()
+
+
+    def do_POST(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        # POST /v1/files
+        if parts[1:] == ["files"]:
+            name, content, purpose = parse_upload(
+                self.headers["Content-Type"], body
+            )
+            file_id = new_id("file")
+            with LOCK:
+                FILES[file_id] = (name, content)
+            return self.send_json(
+                200, file_object(file_id, name, content, purpose)
+            )
+        # POST /v1/batches
+        if parts[1:] == ["batches"]:
+            params = json.loads(body or b"{}")
+            with LOCK:
+                if params.get("input_file_id") not in FILES:
+                    return self.not_found()
+                batch_id = new_id("batch")
+                BATCHES[batch_id] = {
+                    "id": batch_id, "object": "batch",
+                    "endpoint": params["endpoint"],
+                    "input_file_id": params["input_file_id"],
+                    "completion_window": params["completion_window"],
+                    "status": "validating",
+                    "created_at": int(time.time()),
+                    "metadata": params.get("metadata"),
+                    "output_file_id": None, "error_file_id": None,
+                    "request_counts": {"total": 0, "completed": 0,
+                                       "failed": 0},
+                }
+                payload = dict(BATCHES[batch_id])
+            threading.Thread(
+                target=run_batch, args=(batch_id,), daemon=True
+            ).start()
+            return self.send_json(200, payload)
+        # POST /v1/batches/{id}/cancel
+        if parts[1:2] == ["batches"] and parts[3:] == ["cancel"]:
+            with LOCK:
+                if parts[2] not in BATCHES:
+                    return self.not_found()
+                BATCHES[parts[2]]["status"] = "cancelling"
+                return self.send_json(200, BATCHES[parts[2]])
+        self.not_found()
+
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    port = int(argv[argv.index("--port") + 1]) if "--port" in argv else 8765
+    if "--seconds" in argv:
+        COMPLETION_SECONDS = float(argv[argv.index("--seconds") + 1])
+    server = ThreadingHTTPServer(("localhost", port), Handler)
+    print("Mock OpenAI Batch API on http://localhost:{}/v1".format(port))
+    server.serve_forever()
@@ -0,0 +1,53 @@
+"""Transcode the animated cover GIF to an animated PNG (APNG).
+
+Usage:
+    python scripts/transcode_cover.py
+
+Reads static/cover-page.gif and writes static/cover-page.png, keeping
+every frame, its duration and the loop count. Streamlit's static file
+route serves only PNG, JPEG and GIF images as such, and APNG stores each
+frame as the difference from the previous one, which often makes it
+lighter than the GIF. Home.py serves whichever of the two is smaller.
+"""
+import os
+from PIL import Image, ImageSequence
+
+STATIC_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static"
+)
+
+
+
+def transcode(source: str, target: str):
+    """Function that converts an animated GIF into an animated PNG.
+    Args:
+    - source (string): The path of the GIF.
+    - target (string): The path of the APNG to write.
+    """
+    with Image.open(source) as gif:
+        frames = [
+            frame.convert("RGBA") for frame in ImageSequence.Iterator(gif)
+        ]
+        durations = [
+            frame.info.get("duration", 100)
+            for frame in ImageSequence.Iterator(gif)
+        ]
+        frames[0].save(
+            target,
+            format="PNG",
+            save_all=True,
+            append_images=frames[1:],
+            duration=durations,
+            loop=gif.info.get("loop", 0),
+            optimize=True,
+        )
+
+
+
+if __name__ == "__main__":
+    source = os.path.join(STATIC_DIR, "cover-page.gif")
+    target = os.path.join(STATIC_DIR, "cover-page.png")
+    transcode(source, target)
+    print("{}: {:,} bytes -> {}: {:,} bytes".format(
+        source, os.path.getsize(source), target, os.path.getsize(target)
+    ))
@@ -0,0 +1,2 @@
+"""Streamlit-free service layer behind both web apps, also driven by the
+command line (python -m service) and the HTTP API (service/api.py)."""
@@ -0,0 +1,241 @@
+"""Drive the bots of the web apps from the command line or serve them over
+HTTP, without Streamlit.
+
+Usage:
+    python -m service chat [--model M] [--persona P] [--session ID] MESSAGE
+    python -m service code [--model M] [--action A] [--session ID]
+                           [--file PATH]... PROMPT
+    python -m service serve [--host HOST] [--port PORT]
+    python -m service export [--audio] SESSION
+    python -m service import [--session ID] FILE
+
+The chat and code commands read the OpenAI API key from OPENAI_API_KEY,
+stream the reply to standard output and print the session ID to standard
+error; pass it back with --session to continue the conversation, or open
+the web app with ?sid=ID to see it there. A MESSAGE or PROMPT of '-' is
+read from standard input. The model may be 'Auto' to let the router pick
+it. Each --file is attached to the prompt as a code block.
+
+The serve command starts the HTTP API of service/api.py (default
+127.0.0.1:8600), whose POST /v1/chat and POST /v1/code endpoints take the
+same parameters as a JSON body and the API key as a bearer token. Any
+caller may read or write any session, so the API only listens on a
+loopback interface.
+
+The export command writes both web apps' conversations, metadata and
+uploaded files of a session to standard output as JSON Lines, adding the
+audio reference of spoken replies with --audio. The import command reads
+such a FILE ('-' for standard input) into a new session, or into --session,
+and prints its ID; no completion is run, and CodeMaxGPT's thread is
+recreated from the imported turns on first use.
+"""
+import os
+import sys
+import threading
+from openai import OpenAIError
+from service.api import SERVICE_HOST, SERVICE_PORT, start_api
+from service.chat import ChatService
+from service.coder import CoderService
+from service.transfer import TransferError, TransferService
+from utils.async_core import AsyncCore
+from utils.code_diff import build_code_prompt
+from utils.conversation_store import create_store
+from utils.prompts import assemble_user_message
+from utils.router import ModelRouter
+
+
+
+class UsageError(Exception):
+    """Raised when the command line arguments are malformed.
+    """
+
+
+
+def option(argv: list, name: str, default: str = None) -> str:
+    """Function that removes an option and its value from the arguments.
+    Args:
+    - argv (list): The command line arguments, updated in place.
+    - name (string): The option, e.g. '--model'.
+    - default (string): The value if the option is absent.
+    Returns:
+    - str: The value of the option.
+    """
+    if name not in argv:
+        return default
+    index = argv.index(name)
+    if index + 1 == len(argv) or argv[index + 1].startswith("--"):
+        raise UsageError("{} needs a value.".format(name))
+    value = argv[index + 1]
+    del argv[index:index + 2]
+    return value
+
+
+def read_text(argv: list) -> str:
+    """Function that reads the message or prompt left in the arguments.
+    Args:
+    - argv (list): The remaining command line arguments.
+    Returns:
+    - str: The text, read from standard input if it is '-'.
+    """
+    text = " ".join(argv)
+    return sys.stdin.read() if text == "-" else text
+
+
+def print_delta(text: str):
+    """Function that writes a piece of a reply as it arrives.
+    """
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def report(result: dict):
+    """Function that ends the reply and reports its details on standard
+    error, so that standard output only carries the reply.
+    Args:
+    - result (dict): The result of a service's converse coroutine.
+    """
+    sys.stdout.write("\n")
+    usage = result["usage"]
+    print(
+        "session: {} · model: {} · {:.1f} s · {} prompt + {} completion "
+        "tokens".format(
+            result["session_id"], result["model"], result["latency"],
+            usage.prompt_tokens if usage else "?",
+            usage.completion_tokens if usage else "?",
+        ),
+        file=sys.stderr,
+    )
+
+
+def main(argv: list) -> int:
+    """Function that runs a command, printing the usage if the arguments
+    are malformed.
+    Args:
+    - argv (list): The command line arguments after the module name.
+    Returns:
+    - int: The exit status.
+    """
+    try:
+        return run(argv)
+    except UsageError as error:
+        print(error, file=sys.stderr)
+        print(__doc__, file=sys.stderr)
+        return 2
+
+
+def run(argv: list) -> int:
+    """Function that runs a command.
+    Args:
+    - argv (list): The command line arguments after the module name.
+    Returns:
+    - int: The exit status.
+    """
+    if not argv or argv[0] not in ("chat", "code", "serve", "export",
+                                   "import"):
+        print(__doc__, file=sys.stderr)
+        return 2
+    command = argv.pop(0)
+    if command in ("export", "import") and not [
+        arg for arg in argv if not arg.startswith("--")
+    ]:
+        print(__doc__, file=sys.stderr)
+        return 2
+    store = create_store()
+
+    if command == "export":
+        audio = "--audio" in argv
+        if audio:
+            argv.remove("--audio")
+        sys.stdout.writelines(
+            TransferService(store).export(" ".join(argv), audio)
+        )
+        return 0
+    if command == "import":
+        session_id = option(argv, "--session")
+        path = " ".join(argv)
+        try:
+            if path == "-":
+                result = TransferService(store).restore(sys.stdin, session_id)
+            else:
+                with open(path, encoding="utf-8") as f:
+                    result = TransferService(store).restore(f, session_id)
+        except TransferError as error:
+            print(error, file=sys.stderr)
+            return 1
+        print(result["session_id"])
+        print("{} turns, {} files and {} metadata values imported".format(
+            result["turns"], result["files"], result["meta"]
+        ), file=sys.stderr)
+        return 0
+
+    core = AsyncCore()
+    router = ModelRouter()
+    chat = ChatService(core, store, router)
+    coder = CoderService(core, store, router)
+
+    if command == "serve":
+        host = option(argv, "--host", SERVICE_HOST)
+        port = int(option(argv, "--port", str(SERVICE_PORT)))
+        try:
+            start_api(core, chat, coder, TransferService(store), host, port)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 2
+        print("Serving the API on http://{}:{}".format(host, port))
+        # The API runs on the core's thread until interrupted
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return 0
+
+    api_key = os.environ.get("OPENAI_API_KEY", "")
+    if not api_key:
+        print("Please set OPENAI_API_KEY.", file=sys.stderr)
+        return 2
+    client = core.client(api_key)
+    session_id = option(argv, "--session")
+    if command == "chat":
+        model = option(argv, "--model", ChatService.DEFAULT_MODEL)
+        persona = option(argv, "--persona")
+        try:
+            result = core.run(chat.converse(
+                client, session_id, read_text(argv), model, persona,
+                on_delta=print_delta,
+            ))
+        except OpenAIError as error:
+            print(error, file=sys.stderr)
+            return 1
+        report(result)
+        return 0
+
+    model = option(argv, "--model", CoderService.DEFAULT_MODEL)
+    action = option(argv, "--action")
+    code = []
+    while "--file" in argv:
+        path = option(argv, "--file")
+        with open(path, encoding="utf-8") as f:
+            code.append(build_code_prompt(
+                f.read(),
+                os.path.splitext(path)[1].lstrip(".").lower(),
+                os.path.basename(path),
+            ))
+    # Code comes before the request, as in the web app
+    prompt = assemble_user_message(read_text(argv), *code)
+    try:
+        result = core.run(coder.converse(
+            client, session_id, prompt, model, action, on_delta=print_delta,
+        ))
+    except OpenAIError as error:
+        print(error, file=sys.stderr)
+        return 1
+    report(result)
+    if result["content"] is None:
+        print("The run ended with status '{}'.".format(result["status"]),
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
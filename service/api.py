@@ -0,0 +1,338 @@
+import asyncio
+import ipaddress
+import json
+import os
+from itertools import islice
+from openai import OpenAIError
+from service.transfer import TransferError
+from tornado.httpserver import HTTPServer
+from tornado.iostream import StreamClosedError
+from tornado.web import Application, HTTPError, RequestHandler
+
+
+# Port of the HTTP API
+SERVICE_PORT = int(os.environ.get("SERVICE_PORT", "8600"))
+# Interface the HTTP API listens on, which must be a loopback one: ...
+# ...any caller may read or write any session, so the API is only for ...
+# ...programs running on the same machine
+SERVICE_HOST = os.environ.get("SERVICE_HOST", "127.0.0.1")
+# Maximum size of a request body, which may carry code files or an export
+MAX_BODY_BYTES = 8 * 1024 * 1024
+# Number of export lines read from the store between two flushes
+EXPORT_CHUNK_LINES = 200
+
+
+
+def usage_fields(usage) -> dict:
+    """Function that turns the usage reported by the API into JSON fields.
+    Args:
+    - usage: The 'usage' of a completion or run, or None.
+    Returns:
+    - dict: {'prompt_tokens', 'completion_tokens'}, None if not reported.
+    """
+    return {
+        "prompt_tokens": usage.prompt_tokens if usage else None,
+        "completion_tokens": usage.completion_tokens if usage else None,
+    }
+
+
+
+class ServiceHandler(RequestHandler):
+    """Define the base class of the API's request handlers. Requests carry
+    the user's OpenAI API key as a bearer token and a JSON body; replies
+    are streamed as newline-delimited JSON unless 'stream' is false.
+    """
+
+    def initialize(self, core, chat, coder, transfer):
+        """Method to receive the shared objects of the application.
+        Args:
+        - core (AsyncCore): The execution core whose loop serves requests.
+        - chat (ChatService): The chat logic of Talk to GPT.
+        - coder (CoderService): The coding assistant of CodeMaxGPT.
+        - transfer (TransferService): The export and import of sessions.
+        """
+        self.core = core
+        self.chat = chat
+        self.coder = coder
+        self.transfer = transfer
+        # The request being served, if any
+        self.task = None
+
+
+    def client(self):
+        """Method to get the async client of the API key of the request.
+        Returns:
+        - AsyncOpenAI: The client.
+        """
+        scheme, _, api_key = self.request.headers.get(
+            "Authorization", ""
+        ).partition(" ")
+        if scheme.lower() != "bearer" or not api_key.strip():
+            raise HTTPError(401, "An OpenAI API key is required as a "
+                                 "bearer token.")
+        return self.core.client(api_key.strip())
+
+
+    def body(self, *required: str) -> dict:
+        """Method to parse the JSON body of the request.
+        Args:
+        - required (string): The fields that must be present.
+        Returns:
+        - dict: The parameters of the request.
+        """
+        try:
+            params = json.loads(self.request.body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "The body must be a JSON object.")
+        if not isinstance(params, dict):
+            raise HTTPError(400, "The body must be a JSON object.")
+        missing = [name for name in required if not params.get(name)]
+        if missing:
+            raise HTTPError(400, "Missing fields: {}".format(
+                ", ".join(missing)
+            ))
+        return params
+
+
+    def send_event(self, event: dict):
+        """Method to stream one line of newline-delimited JSON.
+        Args:
+        - event (dict): The event to send.
+        """
+        self.write(json.dumps(event) + "\n")
+        self.flush()
+
+
+    async def serve(self, stream: bool, request):
+        """Coroutine that runs a request of a service and sends its result,
+        relaying the reply as it is generated if streaming.
+        Args:
+        - stream (bool): Whether to stream the reply.
+        - request (function): Called with the on_delta callback to get the
+        coroutine of the request.
+        """
+        if stream:
+            self.set_header("Content-Type", "application/x-ndjson")
+            self.set_header("Cache-Control", "no-store")
+        on_delta = (
+            (lambda text: self.send_event({"delta": text}))
+            if stream else None
+        )
+        # Keep the task, so that it is cancelled if the client goes away
+        self.task = asyncio.ensure_future(
+            self.core.limited(request(on_delta), "openai")
+        )
+        try:
+            result = await self.task
+        except OpenAIError as error:
+            if not stream:
+                raise HTTPError(502, str(error))
+            return self.send_event({"error": str(error)})
+        except (asyncio.CancelledError, StreamClosedError):
+            # The client went away before the reply was complete
+            return
+        decision = result.pop("decision")
+        result.update(usage_fields(result.pop("usage")))
+        result["routed"] = decision is not None
+        if stream:
+            result["done"] = True
+            return self.send_event(result)
+        self.write(result)
+
+
+    def on_connection_close(self):
+        """Method called when the client disconnects. The request being
+        served is abandoned, so the service records it as cancelled.
+        """
+        if self.task is not None:
+            self.task.cancel()
+
+
+    def write_error(self, status_code: int, **kwargs):
+        """Method to report errors as JSON.
+        """
+        error = kwargs.get("exc_info", (None, None))[1]
+        self.finish({"error": getattr(error, "log_message", None)
+                     or self._reason})
+
+
+
+class HealthHandler(ServiceHandler):
+    """Define the handler that reports that the API is up.
+    """
+
+    def get(self):
+        self.write({"status": "ok"})
+
+
+
+class ChatHandler(ServiceHandler):
+    """Define the handler of POST /v1/chat, which answers a message in a
+    Talk to GPT conversation. The body is {'message', 'model',
+    'persona', 'session_id', 'stream'}; all but 'message' are optional.
+    """
+
+    async def post(self):
+        params = self.body("message")
+        client = self.client()
+        await self.serve(
+            params.get("stream", True),
+            lambda on_delta: self.chat.converse(
+                client,
+                params.get("session_id"),
+                params["message"],
+                params.get("model") or self.chat.DEFAULT_MODEL,
+                params.get("persona"),
+                on_delta=on_delta,
+            ),
+        )
+
+
+
+class CodeHandler(ServiceHandler):
+    """Define the handler of POST /v1/code, which answers a prompt on the
+    CodeMaxGPT thread of a session. The body is {'prompt', 'model',
+    'action', 'session_id', 'stream'}; all but 'prompt' are optional.
+    """
+
+    async def post(self):
+        params = self.body("prompt")
+        client = self.client()
+        await self.serve(
+            params.get("stream", True),
+            lambda on_delta: self.coder.converse(
+                client,
+                params.get("session_id"),
+                params["prompt"],
+                params.get("model") or self.coder.DEFAULT_MODEL,
+                params.get("action"),
+                on_delta=on_delta,
+            ),
+        )
+
+
+
+class ExportHandler(ServiceHandler):
+    """Define the handler of GET /v1/sessions/{session_id}/export, which
+    streams a session as JSON Lines, with the audio reference of spoken
+    replies if the 'audio' query parameter is 1.
+    """
+
+    async def get(self, session_id: str):
+        # The bearer token only selects an OpenAI key and does not own ...
+        # ...sessions; any local caller may export any session
+        self.client()
+        self.set_header("Content-Type", "application/x-ndjson")
+        self.set_header("Content-Disposition",
+                        "attachment; filename=session-{}.jsonl".format(
+                            session_id[:8]
+                        ))
+        lines = self.transfer.export(
+            session_id, self.get_query_argument("audio", "") == "1"
+        )
+        loop = asyncio.get_running_loop()
+        while True:
+            # Read the store off the event loop, a chunk at a time
+            chunk = await loop.run_in_executor(
+                None, lambda: list(islice(lines, EXPORT_CHUNK_LINES))
+            )
+            if not chunk:
+                break
+            self.write("".join(chunk))
+            try:
+                await self.flush()
+            except StreamClosedError:
+                # The client went away before the export was complete
+                return
+
+
+
+class ImportHandler(ServiceHandler):
+    """Define the handler of POST /v1/sessions/import, which imports a
+    session from a JSON Lines body into a new session, or into the one
+    given by the 'session_id' query parameter, without running any
+    completion. The reply is {'session_id', 'turns', 'files', 'meta'}.
+    """
+
+    async def post(self):
+        self.client()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                None, self.transfer.restore, self.request.body.splitlines(),
+                self.get_query_argument("session_id", None),
+            )
+        except TransferError as error:
+            raise HTTPError(400, str(error))
+        self.write(result)
+
+
+
+def make_app(core, chat, coder, transfer) -> Application:
+    """Function that builds the web application of the API.
+    Args:
+    - core (AsyncCore): The execution core whose loop serves requests.
+    - chat (ChatService): The chat logic of Talk to GPT.
+    - coder (CoderService): The coding assistant of CodeMaxGPT.
+    - transfer (TransferService): The export and import of sessions.
+    Returns:
+    - tornado.web.Application: The application.
+    """
+    shared = {"core": core, "chat": chat, "coder": coder,
+              "transfer": transfer}
+    return Application([
+        (r"/healthz", HealthHandler, shared),
+        (r"/v1/chat", ChatHandler, shared),
+        (r"/v1/code", CodeHandler, shared),
+        (r"/v1/sessions/([0-9A-Za-z_-]+)/export", ExportHandler, shared),
+        (r"/v1/sessions/import", ImportHandler, shared),
+    ])
+
+
+def is_loopback(host: str) -> bool:
+    """Function that tells whether an interface is only reachable from the
+    same machine.
+    Args:
+    - host (string): The host name or IP address.
+    Returns:
+    - bool: Whether the interface is a loopback one.
+    """
+    if host.lower() == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def start_api(core, chat, coder, transfer, host: str = SERVICE_HOST,
+              port: int = SERVICE_PORT) -> HTTPServer:
+    """Function that starts serving the API on the event loop of the
+    execution core, so that requests run concurrently with each other and
+    share the core's API clients and concurrency limits. The API does not
+    tie sessions to callers, so a ValueError is raised unless the
+    interface is a loopback one.
+    Args:
+    - core (AsyncCore): The execution core.
+    - chat (ChatService): The chat logic of Talk to GPT.
+    - coder (CoderService): The coding assistant of CodeMaxGPT.
+    - transfer (TransferService): The export and import of sessions.
+    - host (string): The interface to listen on.
+    - port (int): The port to listen on.
+    Returns:
+    - tornado.httpserver.HTTPServer: The running server.
+    """
+    if not is_loopback(host):
+        raise ValueError(
+            "The API serves every session to any caller, so it only "
+            "listens on a loopback interface, not '{}'.".format(host)
+        )
+
+    async def listen():
+        server = HTTPServer(
+            make_app(core, chat, coder, transfer),
+            max_body_size=MAX_BODY_BYTES,
+        )
+        server.listen(port, host)
+        return server
+
+    return core.run(listen(), limit=None)
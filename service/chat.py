@@ -0,0 +1,223 @@
+import asyncio
+import os
+import time
+import uuid
+from openai import AsyncOpenAI, OpenAIError
+from utils.prompts import assemble_messages
+from utils.turns import TurnLog, count_tokens
+
+
+# Number of most recent turns loaded for a headless request, the same ...
+# ...window the web pages load
+HISTORY_WINDOW = int(os.environ.get("CONVERSATION_WINDOW", "50"))
+
+
+
+class ChatService:
+    """Define the class for the chat logic of Talk to GPT, independent of
+    Streamlit: routing a message to a model, streaming the completion,
+    logging the turns and converting replies to speech. The web page, the
+    command line and the HTTP API are thin clients of it.
+    """
+
+    # Name of the web app in the conversation store
+    PAGE = "talk"
+    # Model used when none is selected
+    DEFAULT_MODEL = "gpt-4o-mini"
+
+    def __init__(self, core, store, router):
+        """Initialize a new instance of the ChatService class.
+        Args:
+        - core (AsyncCore): The execution core the requests run on.
+        - store (ConversationStore): Where conversations are persisted.
+        - router (ModelRouter): The router behind the 'Auto' model.
+        """
+        self.core = core
+        self.store = store
+        self.router = router
+
+
+    async def complete(self, client: AsyncOpenAI, messages: list,
+                       model: str, on_delta=None) -> tuple:
+        """Coroutine that streams a chat completion. If it is cancelled,
+        the stream is closed so that the model stops generating, and the
+        tokens spent so far are recorded.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - messages (list): The 'messages' parameter of the request.
+        - model (string): The GPT model to use.
+        - on_delta (function): Called with each piece of the reply as it
+        arrives, or None.
+        Returns:
+        - tuple: (bot's message, usage reported by the API or None).
+        """
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+        )  # other useful parameters: temperature and max_tokens
+        parts = []
+        usage = None
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    if on_delta is not None:
+                        on_delta(chunk.choices[0].delta.content)
+                # The usage arrives in the last chunk, without choices
+                if chunk.usage:
+                    usage = chunk.usage
+        except asyncio.CancelledError:
+            # Closing the connection stops the generation upstream
+            await stream.close()
+            self.core.record_cancelled(
+                sum(count_tokens(message["content"]) for message in messages),
+                count_tokens("".join(parts)),
+            )
+            raise
+        return "".join(parts), usage
+
+
+    async def reply(self, client: AsyncOpenAI, turns: TurnLog,
+                    message: str, model: str = DEFAULT_MODEL,
+                    persona: str = "", modality: str = "text",
+                    on_delta=None) -> dict:
+        """Coroutine that answers a user's message in a conversation and
+        adds both turns to its log once the reply is complete, so that a
+        failed or cancelled request leaves the log as it was.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - turns (TurnLog): The conversation so far.
+        - message (string): The user's message.
+        - model (string): The GPT model to use, or 'Auto' to route the
+        message to the fastest adequate model.
+        - persona (string): The built-in persona selected, if any.
+        - modality (string): Type of communication ('text' or 'speak').
+        - on_delta (function): Called with each piece of the reply as it
+        arrives, or None.
+        Returns:
+        - dict: The 'content' of the reply, the 'model' used, the routing
+        'decision' (None unless the model was 'Auto'), the 'latency' in
+        seconds and the 'usage' reported by the API.
+        """
+        decision = None
+        # Let the router pick the model for the message
+        if model == "Auto":
+            decision = self.router.route(message)
+            model = decision.model
+        # The persona and earlier turns come first, so that consecutive ...
+        # ...requests share a prefix the provider's prompt cache can reuse
+        start = time.perf_counter()
+        content, usage = await self.complete(
+            client,
+            assemble_messages(turns, persona=persona, user_message=message),
+            model, on_delta,
+        )
+        latency = time.perf_counter() - start
+        # Record the latency of the model for future routing decisions
+        self.router.record(model, latency)
+        # Log the message only now that it has a reply
+        turns.append("user", message, modality)
+        # Log the reply along with the number of tokens reported by the API
+        turns.append(
+            "assistant", content, modality,
+            tokens=usage.completion_tokens if usage else None,
+        )
+        return {"content": content, "model": model, "decision": decision,
+                "latency": latency, "usage": usage}
+
+
+    async def converse(self, client: AsyncOpenAI, session_id: str,
+                       message: str, model: str = DEFAULT_MODEL,
+                       persona: str = None, on_delta=None) -> dict:
+        """Coroutine that answers a message in a conversation persisted in
+        the conversation store, for headless clients. The conversation is
+        the same one the web page shows for the session.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - session_id (string): The ID of the conversation, or None to
+        start a new one.
+        - message (string): The user's message.
+        - model (string): The GPT model to use, or 'Auto'.
+        - persona (string): The built-in persona, or None to keep the one
+        persisted for the session.
+        - on_delta (function): Called with each piece of the reply as it
+        arrives, or None.
+        Returns:
+        - dict: The result of ChatService.reply, with the 'session_id'.
+        """
+        session_id = session_id or uuid.uuid4().hex
+        # Read the store off the event loop, as its calls block
+        loop = asyncio.get_running_loop()
+        turns = TurnLog(await loop.run_in_executor(
+            None, self.store.load_turns, session_id, self.PAGE,
+            HISTORY_WINDOW,
+        ))
+        if persona is None:
+            persona = await loop.run_in_executor(
+                None, self.store.get_meta, session_id, "persona", ""
+            )
+        else:
+            await loop.run_in_executor(
+                None, self.store.set_meta, session_id, "persona", persona
+            )
+        try:
+            result = await self.reply(
+                client, turns, message, model, persona, on_delta=on_delta
+            )
+        finally:
+            # Persist what was logged, including an unanswered message
+            await loop.run_in_executor(
+                None, self.store.append_turns, session_id, self.PAGE,
+                turns.unpersisted(),
+            )
+        result["session_id"] = session_id
+        return result
+
+
+    async def ask(self, client: AsyncOpenAI, messages: list,
+                  model: str) -> dict:
+        """Coroutine that sends a conversation to a GPT model without
+        recording the response in a turn log, e.g. to compare models.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - messages (list): The 'messages' parameter of the request.
+        - model (string): The GPT model to use.
+        Returns:
+        - dict: The model's 'content' (or 'error'), its 'latency' in
+        seconds and the 'prompt_tokens' and 'completion_tokens' used.
+        """
+        start = time.perf_counter()
+        try:
+            content, usage = await self.complete(client, messages, model)
+        except OpenAIError as error:
+            # Report the failure in the model's column instead of ...
+            # ...failing the whole comparison
+            return {"model": model, "error": str(error),
+                    "latency": time.perf_counter() - start}
+        latency = time.perf_counter() - start
+        # Record the latency for future routing decisions
+        self.router.record(model, latency)
+        return {
+            "model": model,
+            "content": content,
+            "latency": latency,
+            "prompt_tokens": usage.prompt_tokens if usage else None,
+            "completion_tokens": usage.completion_tokens if usage else None,
+        }
+
+
+    @staticmethod
+    async def synthesize(client: AsyncOpenAI, text: str) -> bytes:
+        """Coroutine that converts a message into speech audio.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - text (string): The text message to convert.
+        Returns:
+        - bytes: The speech as MP3 audio.
+        """
+        speech = await client.audio.speech.create(
+            model="tts-1", voice="fable", input=text
+        )
+        return speech.content
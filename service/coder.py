@@ -0,0 +1,427 @@
+import asyncio
+import logging
+import time
+import uuid
+from openai import AsyncOpenAI, AsyncStream, OpenAIError
+from service.chat import HISTORY_WINDOW
+from service.transfer import SEED_META
+from utils.turns import TurnLog
+
+
+# Events that end an Assistants run
+RUN_END_EVENTS = ("thread.run.completed", "thread.run.failed",
+                  "thread.run.cancelled", "thread.run.expired",
+                  "thread.run.incomplete", "thread.run.requires_action")
+# Maximum number of messages a thread can be created with
+THREAD_CREATE_MESSAGES = 32
+# Logger of the service, which runs for the web app and the CLI alike
+LOGGER = logging.getLogger(__name__)
+
+
+
+class CoderService:
+    """Define the class for the coding assistant logic of CodeMaxGPT,
+    independent of Streamlit: resuming or creating the Assistant and the
+    Thread of a session and running the assistant on a prompt. The web
+    page, the command line and the HTTP API are thin clients of it.
+    """
+
+    # Name of the web app in the conversation store
+    PAGE = "codemax"
+    # Model used when none is selected
+    DEFAULT_MODEL = "o3-mini"
+    # Instructions that define the behavior of the coding assistant
+    INSTRUCTIONS = (
+        "You are an AI coding assistant. Your role involves "
+        "performing a wide range of tasks to help users program "
+        "more efficiently. These tasks may include generating "
+        "code, debugging, refactoring, documenting, and addressing "
+        "other custom requests from users. Please adhere strictly "
+        "to the user's requirements."
+    )
+
+    def __init__(self, core, store, router):
+        """Initialize a new instance of the CoderService class.
+        Args:
+        - core (AsyncCore): The execution core the requests run on.
+        - store (ConversationStore): Where conversations are persisted.
+        - router (ModelRouter): The router behind the 'Auto' model.
+        """
+        self.core = core
+        self.store = store
+        self.router = router
+
+
+    async def resolve(self, client: AsyncOpenAI, key: str, object_id: str,
+                      model: str = DEFAULT_MODEL,
+                      session_id: str = None) -> tuple:
+        """Coroutine that resumes an Assistants API object whose ID has
+        been persisted in the conversation store, or creates a new one.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - key (string): The kind of object, either 'assistant' or 'thread'.
+        - object_id (string): The persisted ID, or None.
+        - model (string): The model of a new Assistant.
+        - session_id (string): The ID of the conversation, whose turns
+        seed a new Thread if the session was imported.
+        Returns:
+        - tuple: (ID of the Assistant or Thread, True if it was created).
+        """
+        api_object = await self.resume(client, key, object_id)
+        if api_object is not None:
+            return api_object.id, False
+        if key == "thread" and session_id is not None:
+            return (await self.seed(client, session_id)).id, True
+        return (await self.create(client, key, model)).id, True
+
+
+    @staticmethod
+    async def resume(client: AsyncOpenAI, key: str, object_id: str):
+        """Coroutine that restores an Assistants API object whose ID has
+        been persisted in the conversation store.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - key (string): The kind of object, either 'assistant' or 'thread'.
+        - object_id (string): The persisted ID, or None.
+        Returns:
+        - The Assistant or Thread, or None if it cannot be resumed.
+        """
+        if not object_id:
+            return None
+        retrieve = (
+            client.beta.assistants.retrieve if key == "assistant"
+            else client.beta.threads.retrieve
+        )
+        try:
+            return await retrieve(object_id)
+        except OpenAIError:
+            # The object was deleted or belongs to another API key, so a ...
+            # ...new one will be created instead
+            return None
+
+
+    async def create(self, client: AsyncOpenAI, key: str,
+                     model: str = DEFAULT_MODEL):
+        """Coroutine that creates a new Assistants API object.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - key (string): The kind of object, either 'assistant' or 'thread'.
+        - model (string): The model of a new Assistant, or 'Auto'.
+        Returns:
+        - The new Assistant or Thread.
+        """
+        if key == "thread":
+            return await client.beta.threads.create()
+        return await client.beta.assistants.create(
+            name="coding assistant",
+            instructions=self.INSTRUCTIONS,
+            tools=[{"type": "code_interpreter"}],
+            model=self.DEFAULT_MODEL if model == "Auto" else model,
+        )
+
+
+    async def seed(self, client: AsyncOpenAI, session_id: str):
+        """Coroutine that creates the Thread of a session. If the session
+        was imported, the Thread is seeded with its most recent turns, so
+        that the assistant resumes the conversation without running it
+        again.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - session_id (string): The ID of the conversation.
+        Returns:
+        - The new Thread.
+        """
+        # Read the store off the event loop, as its calls block
+        loop = asyncio.get_running_loop()
+        pending = await loop.run_in_executor(
+            None, self.store.get_meta, session_id, SEED_META
+        )
+        if pending != "pending":
+            return await self.create(client, "thread")
+        turns = await loop.run_in_executor(
+            None, self.store.load_turns, session_id, self.PAGE,
+            HISTORY_WINDOW,
+        )
+        messages = [
+            {"role": turn.role, "content": turn.content} for turn in turns
+            if turn.role in ("user", "assistant") and turn.content
+        ]
+        thread = await client.beta.threads.create(
+            messages=messages[:THREAD_CREATE_MESSAGES]
+        )
+        # Messages beyond what a thread can be created with are added in ...
+        # ...order
+        for message in messages[THREAD_CREATE_MESSAGES:]:
+            await client.beta.threads.messages.create(
+                thread_id=thread.id, **message
+            )
+        await loop.run_in_executor(
+            None, self.store.set_meta, session_id, SEED_META, ""
+        )
+        return thread
+
+
+    async def prepare(self, client: AsyncOpenAI, session_id: str,
+                      model: str = DEFAULT_MODEL) -> tuple:
+        """Coroutine that resumes or creates the Assistant and the Thread
+        of a session concurrently, persisting the IDs of new ones.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - session_id (string): The ID of the conversation.
+        - model (string): The model of a new Assistant.
+        Returns:
+        - tuple: (Assistant ID, Thread ID).
+        """
+        # Read the store off the event loop, as its calls block
+        loop = asyncio.get_running_loop()
+        keys = ("assistant", "thread")
+        persisted = [
+            await loop.run_in_executor(
+                None, self.store.get_meta, session_id, key + "_id"
+            )
+            for key in keys
+        ]
+        resolved = await asyncio.gather(*[
+            self.resolve(client, key, object_id, model, session_id)
+            for key, object_id in zip(keys, persisted)
+        ])
+        for key, (object_id, created) in zip(keys, resolved):
+            if created:
+                # Remember the ID so that the session can be resumed later
+                await loop.run_in_executor(
+                    None, self.store.set_meta, session_id, key + "_id",
+                    object_id,
+                )
+        return tuple(object_id for object_id, _ in resolved)
+
+
+    async def exchange(self, client: AsyncOpenAI, thread_id: str,
+                       assistant_id: str, prompt: str, model: str,
+                       on_delta=None) -> tuple:
+        """Coroutine that adds the user's message to the thread, runs the
+        assistant on it and fetches the reply.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - thread_id (string): The ID of the thread.
+        - assistant_id (string): The ID of the assistant.
+        - prompt (string): user's input prompt.
+        - model (string): The GPT model of the run.
+        - on_delta (function): Called with each piece of the reply as it
+        arrives, in which case the run is streamed, or None to wait for
+        the whole reply.
+        Returns:
+        - tuple: (run, bot's message or None if the run did not complete,
+        latency of the run in seconds).
+        """
+        # A run cancelled on this thread must end before messages can ...
+        # ...be added again
+        await self.core.settled(thread_id)
+        # Add the user message to the thread
+        await client.beta.threads.messages.create(
+            thread_id=thread_id, role="user", content=prompt
+        )
+        # Start a run in the thread using the current assistant and the ...
+        # ...selected model, and wait for completion
+        start = time.perf_counter()
+        if on_delta is not None:
+            run, bot_message = await self.stream_run(
+                client, thread_id, assistant_id, model, on_delta
+            )
+            return run, bot_message, time.perf_counter() - start
+        # The creation is shielded, so that a run created upstream while ...
+        # ...the user moves on is still known and can be stopped
+        created = asyncio.ensure_future(client.beta.threads.runs.create(
+            thread_id=thread_id, assistant_id=assistant_id, model=model
+        ))
+        try:
+            run = await asyncio.shield(created)
+            run = await client.beta.threads.runs.poll(
+                run.id, thread_id=thread_id
+            )
+        except asyncio.CancelledError:
+            # The user moved on, so stop the run upstream as well
+            self.core.cleanup(
+                thread_id, self.cancel_created(client, thread_id, created)
+            )
+            raise
+        latency = time.perf_counter() - start
+        if run.status != "completed":
+            return run, None, latency
+        # Retrieve the latest message of the thread, which is the reply
+        messages = await client.beta.threads.messages.list(
+            thread_id=thread_id, limit=1
+        )
+        return run, messages.data[0].content[0].text.value, latency
+
+
+    async def stream_run(self, client: AsyncOpenAI, thread_id: str,
+                         assistant_id: str, model: str, on_delta) -> tuple:
+        """Coroutine that runs the assistant on a thread and relays the
+        reply as it is generated.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - thread_id (string): The ID of the thread.
+        - assistant_id (string): The ID of the assistant.
+        - model (string): The GPT model of the run.
+        - on_delta (function): Called with each piece of the reply.
+        Returns:
+        - tuple: (run, bot's message or None if the run did not complete).
+        """
+        created = asyncio.ensure_future(client.beta.threads.runs.create(
+            thread_id=thread_id, assistant_id=assistant_id, model=model,
+            stream=True,
+        ))
+        try:
+            stream = await asyncio.shield(created)
+        except asyncio.CancelledError:
+            # The run may be created upstream all the same, so stop it
+            self.core.cleanup(
+                thread_id, self.cancel_created(client, thread_id, created)
+            )
+            raise
+        run = None
+        parts = []
+        try:
+            async for event in stream:
+                if event.event == "thread.run.created":
+                    run = event.data
+                elif event.event == "thread.message.delta":
+                    for content in event.data.delta.content or []:
+                        if content.type == "text" and content.text \
+                                and content.text.value:
+                            parts.append(content.text.value)
+                            on_delta(content.text.value)
+                elif event.event in RUN_END_EVENTS:
+                    run = event.data
+        except asyncio.CancelledError:
+            await stream.close()
+            # The user moved on, so stop the run upstream as well
+            if run is not None:
+                self.core.cleanup(
+                    thread_id, self.cancel_run(client, thread_id, run.id)
+                )
+            raise
+        if run is None or run.status != "completed":
+            return run, None
+        return run, "".join(parts)
+
+
+    async def cancel_created(self, client: AsyncOpenAI, thread_id: str,
+                             created):
+        """Coroutine that cancels a run whose creation was interrupted,
+        once the request creating it returns.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - thread_id (string): The ID of the thread.
+        - created (asyncio.Future): The request creating the run, which
+        returns the run, or its event stream if the run is streamed.
+        """
+        try:
+            started = await created
+        except OpenAIError:
+            # The run was not created
+            return
+        if not isinstance(started, AsyncStream):
+            await self.cancel_run(client, thread_id, started.id)
+            return
+        # The run is announced by the first event of its stream
+        run_id = None
+        try:
+            async for event in started:
+                if event.event == "thread.run.created":
+                    run_id = event.data.id
+                    break
+        except OpenAIError:
+            pass
+        finally:
+            await started.close()
+        if run_id is not None:
+            await self.cancel_run(client, thread_id, run_id)
+
+
+    async def cancel_run(self, client: AsyncOpenAI, thread_id: str,
+                         run_id: str):
+        """Coroutine that cancels a run and records the tokens it spent
+        once it has stopped.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - thread_id (string): The ID of the thread.
+        - run_id (string): The ID of the run.
+        """
+        try:
+            await client.beta.threads.runs.cancel(
+                run_id, thread_id=thread_id
+            )
+            # Usage is only reported once the run has stopped
+            run = await client.beta.threads.runs.poll(
+                run_id, thread_id=thread_id
+            )
+        except OpenAIError as error:
+            # The run may have finished in the meantime
+            LOGGER.info("Run %s could not be cancelled: %s", run_id, error)
+            return
+        self.core.record_cancelled(
+            run.usage.prompt_tokens if run.usage else 0,
+            run.usage.completion_tokens if run.usage else 0,
+        )
+
+
+    async def converse(self, client: AsyncOpenAI, session_id: str,
+                       prompt: str, model: str = DEFAULT_MODEL,
+                       action: str = None, on_delta=None) -> dict:
+        """Coroutine that answers a prompt on the Thread of a session, for
+        headless clients. The turns are persisted like those of the web
+        page, which shows the same conversation for the session.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - session_id (string): The ID of the conversation, or None to
+        start a new one.
+        - prompt (string): The user's prompt, including any code.
+        - model (string): The GPT model to use, or 'Auto'.
+        - action (string): The coding task, e.g. 'Debug Code', used to
+        route the prompt when the model is 'Auto'.
+        - on_delta (function): Called with each piece of the reply as it
+        arrives, or None.
+        Returns:
+        - dict: The 'content' of the reply (None if the run did not
+        complete), the run's 'status', the 'model' used, the routing
+        'decision', the 'latency' in seconds, the 'usage' and the
+        'session_id'.
+        """
+        session_id = session_id or uuid.uuid4().hex
+        decision = None
+        # Let the router pick the model for the prompt
+        if model == "Auto":
+            decision = self.router.route(prompt, action)
+            model = decision.model
+        assistant_id, thread_id = await self.prepare(
+            client, session_id, model
+        )
+        turns = TurnLog()
+        turns.append("user", prompt, "text")
+        try:
+            run, content, latency = await self.exchange(
+                client, thread_id, assistant_id, prompt, model, on_delta
+            )
+            if content is not None:
+                # Record the latency for future routing decisions
+                self.router.record(model, latency)
+                turns.append(
+                    "assistant", content, "text",
+                    tokens=run.usage.completion_tokens if run.usage else None,
+                )
+        finally:
+            # Persist what was logged, including an unanswered prompt
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.store.append_turns, session_id, self.PAGE,
+                turns.unpersisted(),
+            )
+        return {
+            "content": content,
+            "status": run.status if run is not None else None,
+            "model": model,
+            "decision": decision,
+            "latency": latency,
+            "usage": run.usage if run is not None else None,
+            "session_id": session_id,
+        }
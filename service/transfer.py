@@ -0,0 +1,250 @@
+import hashlib
+import json
+import tempfile
+import uuid
+from datetime import datetime
+from utils.turns import Turn
+
+
+# Version of the export format, bumped on incompatible changes
+EXPORT_VERSION = 1
+# Web apps whose conversations are exported, in the order of the file
+PAGES = ("talk", "codemax")
+# Metadata bound to Assistants API objects or batch jobs of the exporting ...
+# ...API key, which are not restored; the thread is recreated instead
+THREAD_META = ("thread_id", "sent_files", "batch_ids")
+# Metadata value marking that the thread of an imported session is to be ...
+# ...recreated from its turns
+SEED_META = "thread_seed"
+# Fields required in each type of record
+RECORD_FIELDS = {
+    "session": ("version",),
+    "meta": ("key", "value"),
+    "blob": ("sha1", "content"),
+    "file": ("name", "sha1"),
+    "turn": ("page", "role", "content", "timestamp"),
+}
+# Number of turns read or written at a time
+BATCH_SIZE = 500
+# Text-to-speech settings of the bot's spoken replies, exported as their ...
+# ...audio reference; the speech itself is never stored
+SPEECH = {"model": "tts-1", "voice": "fable", "format": "mp3"}
+
+
+
+class TransferError(ValueError):
+    """Raised when an export file cannot be imported.
+    """
+
+
+
+def parse_records(lines):
+    """Function that reads the records of an export.
+    Args:
+    - lines (iterable): The lines of the export, as strings or bytes.
+    Yields:
+    - dict: The records, each checked to carry the fields of its type,
+    with the timestamps of turns parsed.
+    """
+    for number, text in enumerate(lines, 1):
+        if isinstance(text, bytes):
+            text = text.decode("utf-8")
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+            missing = [
+                name for name in RECORD_FIELDS.get(record["type"], ())
+                if name not in record
+            ]
+            if record["type"] == "turn" and not missing:
+                record["timestamp"] = datetime.fromisoformat(
+                    record["timestamp"]
+                )
+        except (ValueError, TypeError, KeyError) as error:
+            raise TransferError(
+                "Line {} is not a record.".format(number)
+            ) from error
+        if missing:
+            raise TransferError("Line {} lacks {}.".format(
+                number, ", ".join(missing)
+            ))
+        yield record
+
+
+
+class TransferService:
+    """Define the class for exporting sessions to JSON Lines and importing
+    them back, independent of Streamlit. An export is a stream of records,
+    one per line: a header, the metadata, the uploaded files (each content
+    once, by hash), then the turns of every web app. Both directions work
+    record by record, so sessions of any length fit in constant memory.
+    Importing never runs a completion: the turns are written to the
+    conversation store, and CodeMaxGPT's thread is recreated from them on
+    first use.
+    """
+
+    def __init__(self, store):
+        """Initialize a new instance of the TransferService class.
+        Args:
+        - store (ConversationStore): Where conversations are persisted.
+        """
+        self.store = store
+
+
+    def export(self, session_id: str, audio: bool = False):
+        """Method to export a session as JSON Lines.
+        Args:
+        - session_id (string): The ID of the session.
+        - audio (bool): Whether to add the audio reference of the bot's
+        spoken replies, from which the speech can be synthesized again.
+        Yields:
+        - str: The records, each a JSON object ending with a newline.
+        """
+        def line(record: dict) -> str:
+            return json.dumps(record, ensure_ascii=False) + "\n"
+
+        yield line({
+            "type": "session",
+            "version": EXPORT_VERSION,
+            "session_id": session_id,
+            "exported_at": datetime.now().isoformat(),
+            "pages": list(PAGES),
+        })
+        for key, value in sorted(self.store.load_meta(session_id).items()):
+            yield line({"type": "meta", "key": key, "value": value})
+        # Each content is written once, however many files share it
+        written = set()
+        for name, content in self.store.load_files(session_id).items():
+            sha1 = hashlib.sha1(content.encode("utf-8")).hexdigest()
+            if sha1 not in written:
+                written.add(sha1)
+                yield line({"type": "blob", "sha1": sha1, "content": content})
+            yield line({"type": "file", "name": name, "sha1": sha1})
+        for page in PAGES:
+            for turn in self.store.iter_turns(session_id, page, BATCH_SIZE):
+                record = {
+                    "type": "turn",
+                    "page": page,
+                    "role": turn.role,
+                    "content": turn.content,
+                    "modality": turn.modality,
+                    "timestamp": turn.timestamp.isoformat(),
+                    "tokens": turn.tokens,
+                }
+                if audio and turn.role == "assistant" \
+                        and turn.modality == "speak":
+                    record["audio"] = SPEECH
+                yield line(record)
+
+
+    def restore(self, lines, session_id: str = None) -> dict:
+        """Method to import a session exported as JSON Lines. The turns
+        are added to those of the session, if any. The whole export is
+        checked before anything is written, so that a bad line leaves the
+        session untouched; the records are spooled to a temporary file in
+        the meantime, keeping memory bounded.
+        Args:
+        - lines (iterable): The lines of the export, as strings or bytes.
+        - session_id (string): The ID of the session to import into, or
+        None to create a new one.
+        Returns:
+        - dict: The 'session_id' and the number of 'turns', 'files' and
+        'meta' values imported.
+        """
+        with tempfile.TemporaryFile("w+", encoding="utf-8") as spool:
+            self.validate(lines, spool)
+            spool.seek(0)
+            return self.write(spool, session_id or uuid.uuid4().hex)
+
+
+    def validate(self, lines, spool):
+        """Method to check every record of an export, copying the lines to
+        a spool file.
+        Args:
+        - lines (iterable): The lines of the export, as strings or bytes.
+        - spool (file): Where the lines of the records are written.
+        """
+        def spooled():
+            for text in lines:
+                if isinstance(text, bytes):
+                    text = text.decode("utf-8")
+                spool.write(text.rstrip("\n") + "\n")
+                yield text
+
+        records = parse_records(spooled())
+        header = next(records, {})
+        if header.get("type") != "session" \
+                or header["version"] != EXPORT_VERSION:
+            raise TransferError(
+                "This is not a session export of version {}.".format(
+                    EXPORT_VERSION
+                )
+            )
+        # SHA-1 of the contents read so far
+        blobs = set()
+        for record in records:
+            if record["type"] == "blob":
+                blobs.add(record["sha1"])
+            elif record["type"] == "file" and record["sha1"] not in blobs:
+                raise TransferError(
+                    "The file {} has no content in the export.".format(
+                        record["name"]
+                    )
+                )
+
+
+    def write(self, spool, session_id: str) -> dict:
+        """Method to write the records of a validated export to the store.
+        Args:
+        - spool (file): The lines of the export.
+        - session_id (string): The ID of the session to import into.
+        Returns:
+        - dict: The 'session_id' and the number of 'turns', 'files' and
+        'meta' values imported.
+        """
+        counts = {"turns": 0, "files": 0, "meta": 0}
+        # {SHA-1: content} of the files read so far
+        blobs = {}
+        # {page: turns not written yet}
+        pending = {page: [] for page in PAGES}
+        # The thread of the export belongs to another API key or may have ...
+        # ...moved on, so a new one is seeded with the turns on first use
+        self.store.set_meta(session_id, "thread_id", "")
+        self.store.set_meta(session_id, SEED_META, "pending")
+        records = parse_records(spool)
+        # Skip the header, checked already
+        next(records)
+        for record in records:
+            kind = record["type"]
+            if kind == "meta" and record["key"] not in THREAD_META \
+                    and record["key"] != SEED_META:
+                self.store.set_meta(
+                    session_id, record["key"], record["value"]
+                )
+                counts["meta"] += 1
+            elif kind == "blob":
+                blobs[record["sha1"]] = record["content"]
+            elif kind == "file":
+                self.store.save_file(
+                    session_id, record["name"], blobs[record["sha1"]]
+                )
+                counts["files"] += 1
+            elif kind == "turn" and record["page"] in pending:
+                batch = pending[record["page"]]
+                batch.append(Turn(
+                    record["role"], record["content"],
+                    record.get("modality", ""),
+                    record["timestamp"],
+                    record.get("tokens"),
+                ))
+                counts["turns"] += 1
+                # Write the turns in batches, keeping memory bounded
+                if len(batch) >= BATCH_SIZE:
+                    self.store.append_turns(session_id, record["page"], batch)
+                    pending[record["page"]] = []
+        for page, batch in pending.items():
+            if batch:
+                self.store.append_turns(session_id, page, batch)
+        counts["session_id"] = session_id
+        return counts
@@ -0,0 +1 @@
+"""Shared helpers used by the Streamlit web applications in pages/."""
@@ -0,0 +1,189 @@
+import hmac
+import os
+from collections import Counter
+from datetime import datetime
+import streamlit as st
+from streamlit.runtime import Runtime
+from utils.memory import SESSION_MEMORY_BUDGET_MB
+from utils.session import (
+    get_core, get_profiler, get_registry, get_renderer,
+)
+
+
+# Secret that opens the admin panel when passed as the 'admin' URL ...
+# ...parameter of the home page, or empty to disable the panel
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Number of session state keys listed per session
+TOP_KEYS = 5
+
+
+
+def is_admin() -> bool:
+    """Function that tells whether the page was opened by an administrator,
+    i.e. with ?admin=ADMIN_TOKEN in its URL.
+    """
+    given = st.experimental_get_query_params().get("admin", [""])[0]
+    # Compare in constant time so the token cannot be guessed by timing
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(given, ADMIN_TOKEN)
+
+
+def megabytes(size: int) -> float:
+    """Function that converts a size in bytes to megabytes.
+    """
+    return round(size / (1024 * 1024), 2)
+
+
+def runtime_caches() -> Counter:
+    """Function that measures the memory held by Streamlit itself: its
+    caches, the session states, uploaded files and media files.
+    Returns:
+    - Counter: {category: size in bytes}.
+    """
+    runtime = Runtime.instance()
+    stats = runtime.stats_mgr.get_stats()
+    # The media file storage is not registered with the stats manager, ...
+    # ...and is only reachable through a private attribute, so it is ...
+    # ...skipped where Streamlit does not expose it
+    storage = getattr(runtime.media_file_mgr, "_storage", None)
+    if hasattr(storage, "get_stats"):
+        stats += storage.get_stats()
+    sizes = Counter()
+    for stat in stats:
+        sizes[stat.category_name] += stat.byte_length
+    return sizes
+
+
+def show_memory_panel():
+    """Function that displays the memory accounting and profiling panel:
+    the process RSS and its growth, the size of each live session and of
+    its largest keys, Streamlit's own caches, and the top allocators
+    traced by tracemalloc.
+    """
+    # Import pandas on first use to keep the home page's cold start fast
+    import pandas as pd
+
+    profiler = get_profiler()
+    st.header(":bar_chart: Memory")
+    # Measure every live session and record a sample of the history
+    states = get_registry().states()
+    sizes = profiler.sample({
+        session_id: dict(state.filtered_state)
+        for session_id, state in states.items()
+    })
+    history = list(profiler.history)
+    _, rss, total, count = history[-1]
+    previous_rss = history[-2][1] if len(history) > 1 else rss
+
+    # Display the headline figures
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric(
+        "Process RSS", "{} MB".format(megabytes(rss)),
+        "{:+} MB".format(megabytes(rss - previous_rss)),
+        delta_color="inverse",
+    )
+    col2.metric("Live sessions", count)
+    col3.metric("Session state", "{} MB".format(megabytes(total)))
+    col4.metric(
+        "Budget per session",
+        "{} MB".format(SESSION_MEMORY_BUDGET_MB)
+        if SESSION_MEMORY_BUDGET_MB else "None",
+    )
+    evictions = profiler.evictions
+    cancelled = get_core().cancelled
+    st.caption(
+        "Budget evictions: {} sessions, {} turns, {} caches. Requests "
+        "cancelled after the user moved on: {} ({:,} prompt and {:,} "
+        "completion tokens).".format(
+            evictions["sessions"], evictions["turns"], evictions["caches"],
+            cancelled["requests"], cancelled["prompt_tokens"],
+            cancelled["completion_tokens"],
+        )
+    )
+
+    # Display the growth of the process over the samples taken so far
+    st.subheader("Growth over time")
+    if len(history) > 1:
+        growth = pd.DataFrame(
+            [
+                (datetime.fromtimestamp(sampled_at), megabytes(sampled_rss),
+                 megabytes(sampled_total))
+                for sampled_at, sampled_rss, sampled_total, _ in history
+            ],
+            columns=["Time", "Process RSS (MB)", "Session state (MB)"],
+        ).set_index("Time")
+        st.line_chart(growth)
+    else:
+        st.caption("Rerun the panel to take more samples.")
+
+    # Display the size of each session and of its largest keys
+    st.subheader("Sessions")
+    if sizes:
+        st.dataframe(pd.DataFrame(
+            [
+                {
+                    "Session": session_id[:8],
+                    "Total (MB)": megabytes(sum(keys.values())),
+                    "Largest keys": ", ".join(
+                        "{} ({} MB)".format(key, megabytes(size))
+                        for key, size in list(keys.items())[:TOP_KEYS]
+                    ),
+                }
+                for session_id, keys in sorted(
+                    sizes.items(), key=lambda item: -sum(item[1].values())
+                )
+            ]
+        ), use_container_width=True)
+        # Display every key of one session
+        session_id = st.selectbox(
+            "Session details", list(sizes),
+            format_func=lambda session_id: session_id[:8],
+        )
+        st.bar_chart(pd.Series(
+            {key: megabytes(size) for key, size in sizes[session_id].items()},
+            name="MB",
+        ))
+    else:
+        st.caption("No live sessions.")
+
+    # Display the memory held by Streamlit itself
+    st.subheader("Streamlit caches")
+    st.dataframe(pd.DataFrame(
+        [
+            {"Category": category, "Size (MB)": megabytes(size)}
+            for category, size in runtime_caches().most_common()
+        ]
+    ), use_container_width=True)
+    # Report the cache of rendered chat messages shared by the pages
+    rendered = get_renderer().stats()
+    st.caption(
+        "Rendered messages: {} cached ({} MB), {} hits, {} misses.".format(
+            rendered["messages"], megabytes(rendered["size"]),
+            rendered["hits"], rendered["misses"],
+        )
+    )
+
+    # Display the top allocators while tracing is on
+    st.subheader("Top allocators")
+    if st.checkbox("Trace allocations (slows the server down)",
+                   value=profiler.tracing()):
+        profiler.start_tracing()
+        top, grown = profiler.top_allocators()
+        columns = ["Location", "Size (MB)", "Growth (MB)", "Blocks"]
+        st.caption("Held since tracing started:")
+        st.dataframe(pd.DataFrame(
+            [
+                (location, megabytes(size), megabytes(diff), blocks)
+                for location, size, diff, blocks in top
+            ],
+            columns=columns,
+        ), use_container_width=True)
+        st.caption("Grown since the previous rerun of the panel:")
+        st.dataframe(pd.DataFrame(
+            [
+                (location, megabytes(size), megabytes(diff), blocks)
+                for location, size, diff, blocks in grown
+            ],
+            columns=columns,
+        ), use_container_width=True)
+    elif profiler.tracing():
+        profiler.stop_tracing()
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAIError
+
+
+# Maximum number of requests of each kind in flight across all sessions
+LIMITS = {
+    "openai": int(os.environ.get("OPENAI_CONCURRENCY", "32")),
+    "transcription": int(os.environ.get("TRANSCRIPTION_WORKERS", "8")),
+}
+# Maximum number of API clients kept open, one per API key
+MAX_CLIENTS = 64
+# Seconds an idle connection to the API is kept open, so that a ...
+# ...connection opened by the warm-up is still there for the first request
+KEEPALIVE_SECONDS = float(os.environ.get("OPENAI_KEEPALIVE_SECONDS", "120"))
+# Lightweight request used to open a connection to the API
+WARM_UP_MODEL = "gpt-4o-mini"
+# Logger of the core, which runs for the Streamlit server and the CLI alike
+LOGGER = logging.getLogger(__name__)
+
+
+
+class AsyncCore:
+    """Define the class for the execution core shared by both bots. An
+    asyncio event loop runs in a background thread and Streamlit's script
+    threads hand it coroutines of the AsyncOpenAI client, so that
+    independent API calls run concurrently instead of one after another.
+    """
+
+    def __init__(self):
+        """Initialize a new instance of the AsyncCore class and start its
+        event loop.
+        """
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="async-core", daemon=True
+        )
+        self.thread.start()
+        self.lock = threading.Lock()
+        # {API key: AsyncOpenAI}, least recently used first
+        self.clients = OrderedDict()
+        # {API key: time of the last warm-up}
+        self.warmed = {}
+        # {limit name: asyncio.Semaphore}, only used on the loop's thread
+        self.semaphores = {}
+        # {key: cleanup task}, only used on the loop's thread
+        self.cleanups = {}
+        # Requests cancelled because the user moved on, and the tokens ...
+        # ...they had used: {'requests', 'prompt_tokens', ...
+        # ...'completion_tokens'}
+        self.cancelled = Counter()
+
+
+    def client(self, api_key: str) -> AsyncOpenAI:
+        """Method to get the async client of an API key, reusing its
+        connection pool across reruns and sessions.
+        Args:
+        - api_key (string): The OpenAI API key.
+        Returns:
+        - AsyncOpenAI: The client.
+        """
+        with self.lock:
+            if api_key in self.clients:
+                self.clients.move_to_end(api_key)
+                return self.clients[api_key]
+            client = self.clients[api_key] = AsyncOpenAI(
+                api_key=api_key,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=1000,
+                        max_keepalive_connections=100,
+                        keepalive_expiry=KEEPALIVE_SECONDS,
+                    ),
+                ),
+            )
+            if len(self.clients) > MAX_CLIENTS:
+                stale_key, stale = self.clients.popitem(last=False)
+                self.warmed.pop(stale_key, None)
+                # Close the connections of the stale client on the loop
+                self.submit(stale.close(), limit=None)
+            return client
+
+
+    def warm_up(self, api_key: str):
+        """Method to open a connection to the API in the background as
+        soon as an API key is entered, so that the first request does not
+        pay for the TLS handshake. The connection is reopened at most
+        every KEEPALIVE_SECONDS / 2, on the reruns that follow.
+        Args:
+        - api_key (string): The OpenAI API key.
+        """
+        client = self.client(api_key)
+        with self.lock:
+            now = time.monotonic()
+            if now - self.warmed.get(api_key, -KEEPALIVE_SECONDS) \
+                    < KEEPALIVE_SECONDS / 2:
+                return
+            self.warmed[api_key] = now
+        self.submit(self.open_connection(client), limit=None)
+
+
+    @staticmethod
+    async def open_connection(client: AsyncOpenAI):
+        """Coroutine that sends a lightweight request to leave an open
+        connection in the client's pool.
+        Args:
+        - client (AsyncOpenAI): The client to warm up.
+        """
+        try:
+            await client.models.retrieve(WARM_UP_MODEL)
+        except OpenAIError:
+            # An invalid key is reported by the user's first request
+            pass
+
+
+    async def limited(self, coro, limit: str):
+        """Method to await a coroutine once its concurrency limit allows.
+        Args:
+        - coro (coroutine): The work to run.
+        - limit (string): A key of LIMITS, or None for no limit.
+        """
+        if limit is None:
+            return await coro
+        if limit not in self.semaphores:
+            self.semaphores[limit] = asyncio.Semaphore(LIMITS[limit])
+        async with self.semaphores[limit]:
+            return await coro
+
+
+    def submit(self, coro, limit: str = "openai"):
+        """Method to schedule a coroutine on the event loop without
+        waiting for it.
+        Args:
+        - coro (coroutine): The work to run.
+        - limit (string): The concurrency limit that applies, a key of
+        LIMITS, or None for no limit.
+        Returns:
+        - concurrent.futures.Future: The result of the coroutine.
+        Cancelling the future cancels the coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.limited(coro, limit), self.loop
+        )
+
+
+    def submit_all(self, coros: list, limit: str = "openai",
+                   return_exceptions: bool = False):
+        """Method to schedule independent coroutines to run concurrently,
+        as a single future.
+        Args:
+        - coros (list): The coroutines.
+        - limit (string): The concurrency limit that applies to each.
+        - return_exceptions (bool): Whether to return the exceptions of
+        failed coroutines in place of their results, instead of failing
+        with the first one.
+        Returns:
+        - concurrent.futures.Future: The list of results, in the order of
+        the coroutines. Cancelling the future cancels all of them.
+        """
+        async def gather():
+            return await asyncio.gather(
+                *[self.limited(coro, limit) for coro in coros],
+                return_exceptions=return_exceptions,
+            )
+
+        return self.submit(gather(), limit=None)
+
+
+    def run(self, coro, limit: str = "openai"):
+        """Method to run a coroutine on the event loop and wait for its
+        result from a script thread.
+        Args:
+        - coro (coroutine): The work to run.
+        - limit (string): The concurrency limit that applies.
+        Returns:
+        - The result of the coroutine. Its exception is raised instead if
+        it failed.
+        """
+        return self.run_all([coro], limit)[0]
+
+
+    def run_all(self, coros: list, limit: str = "openai",
+                return_exceptions: bool = False) -> list:
+        """Method to run independent coroutines concurrently and wait for
+        all of their results.
+        Args:
+        - coros (list): The coroutines.
+        - limit (string): The concurrency limit that applies to each.
+        - return_exceptions (bool): Whether to return the exceptions of
+        failed coroutines in place of their results, instead of raising
+        the first one.
+        Returns:
+        - list: The results, in the order of the coroutines.
+        """
+        future = self.submit_all(coros, limit, return_exceptions)
+        try:
+            return future.result()
+        except BaseException:
+            # Do not leave requests running that nobody will read
+            future.cancel()
+            raise
+
+
+    def cleanup(self, key: str, coro):
+        """Method to start a cleanup task, such as cancelling an upstream
+        run, from a coroutine on the loop. Work on the same key can wait
+        for it with settled().
+        Args:
+        - key (string): What the cleanup is about, e.g. a thread ID.
+        - coro (coroutine): The cleanup work.
+        """
+        self.cleanups[key] = asyncio.ensure_future(coro)
+
+
+    async def settled(self, key: str):
+        """Coroutine that waits for the cleanup of a key to finish, if
+        any is in progress.
+        Args:
+        - key (string): What the cleanup is about.
+        """
+        task = self.cleanups.pop(key, None)
+        if task is not None:
+            await asyncio.wait([task])
+
+
+    def record_cancelled(self, prompt_tokens: int, completion_tokens: int):
+        """Method to account for a request cancelled because the user
+        moved on.
+        Args:
+        - prompt_tokens (int): The prompt tokens used, or an estimate.
+        - completion_tokens (int): The completion tokens generated before
+        the request was stopped, or an estimate.
+        """
+        with self.lock:
+            self.cancelled["requests"] += 1
+            self.cancelled["prompt_tokens"] += prompt_tokens or 0
+            self.cancelled["completion_tokens"] += completion_tokens or 0
+        # Report the wasted spend to the host application's logging
+        LOGGER.info(
+            "Cancelled a request after %s prompt and %s completion tokens",
+            prompt_tokens, completion_tokens,
+        )
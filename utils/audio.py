@@ -0,0 +1,218 @@
+import io
+import os
+import wave
+import numpy as np
+
+
+# Sample rate expected by the Whisper model
+WHISPER_SAMPLE_RATE = 16000
+# Length of the frames used for voice activity detection
+FRAME_MS = 20
+# Frames louder than the noise floor by this many decibels count as voice
+VAD_MARGIN_DB = 12.0
+# Quietest level that can count as voice, in dBFS
+VAD_MIN_DB = -55.0
+# Silence kept before and after the detected voice
+PADDING_MS = 250
+# Format of the audio uploaded to Whisper: 'flac', 'ogg' or 'wav'
+UPLOAD_FORMAT = os.environ.get("AUDIO_UPLOAD_FORMAT", "flac")
+
+
+
+def decode_wav(wav_bytes: bytes) -> tuple:
+    """Function that decodes PCM WAV data into mono samples.
+    Args:
+    - wav_bytes (bytes): The WAV file data.
+    Returns:
+    - tuple: (float32 samples scaled to [-1, 1], sample rate).
+    """
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+    # Convert the raw frames to floats according to the sample width
+    if width == 1:
+        samples = (np.frombuffer(frames, np.uint8).astype(np.float32)
+                   - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, "<i2").astype(np.float32) / 2 ** 15
+    elif width == 4:
+        samples = np.frombuffer(frames, "<i4").astype(np.float32) / 2 ** 31
+    else:
+        raise wave.Error("unsupported sample width: {}".format(width))
+    # Mix all channels down to mono
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def frame_energy(samples, rate: int) -> np.ndarray:
+    """Function that measures the loudness of consecutive frames.
+    Args:
+    - samples (ndarray): Mono samples.
+    - rate (int): The sample rate.
+    Returns:
+    - ndarray: The RMS level of each frame, in dBFS.
+    """
+    frame_len = max(1, rate * FRAME_MS // 1000)
+    n_frames = len(samples) // frame_len
+    frames = samples[: n_frames * frame_len].reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def voice_mask(energy_db) -> np.ndarray:
+    """Function that detects which frames contain voice, using an energy
+    threshold relative to the noise floor of the recording.
+    Args:
+    - energy_db (ndarray): The level of each frame, in dBFS.
+    Returns:
+    - ndarray: A boolean flag for each frame.
+    """
+    if not len(energy_db):
+        return np.zeros(0, bool)
+    # Estimate the noise floor from the quietest tenth of the frames
+    noise_floor = np.percentile(energy_db, 10)
+    threshold = max(noise_floor + VAD_MARGIN_DB, VAD_MIN_DB)
+    return energy_db > threshold
+
+
+def trim_silence(samples, rate: int):
+    """Function that removes leading and trailing silence.
+    Args:
+    - samples (ndarray): Mono samples.
+    - rate (int): The sample rate.
+    Returns:
+    - ndarray: The samples between the first and the last voiced frame
+    (plus padding), or an empty array if no voice was detected.
+    """
+    voiced = np.flatnonzero(voice_mask(frame_energy(samples, rate)))
+    if not len(voiced):
+        return samples[:0]
+    frame_len = max(1, rate * FRAME_MS // 1000)
+    padding = rate * PADDING_MS // 1000
+    start = max(0, voiced[0] * frame_len - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame_len + padding)
+    return samples[start:end]
+
+
+def resample(samples, rate: int, target_rate: int = WHISPER_SAMPLE_RATE):
+    """Function that changes the sample rate of a recording, low-pass
+    filtering it first when downsampling to avoid aliasing.
+    Args:
+    - samples (ndarray): Mono samples.
+    - rate (int): The current sample rate.
+    - target_rate (int): The new sample rate.
+    Returns:
+    - ndarray: The resampled samples.
+    """
+    if rate == target_rate or not len(samples):
+        return samples
+    if target_rate < rate:
+        # Windowed-sinc low-pass filter at the new Nyquist frequency
+        cutoff = 0.5 * target_rate / rate
+        taps = np.arange(63) - 31
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(63)
+        samples = np.convolve(samples, kernel / kernel.sum(), mode="same")
+    # Interpolate the filtered signal at the new sample times
+    n_out = int(round(len(samples) * target_rate / rate))
+    positions = np.arange(n_out) * (rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(
+        np.float32
+    )
+
+
+def encode(samples, rate: int, fmt: str = UPLOAD_FORMAT) -> tuple:
+    """Function that encodes mono samples as an audio file. FLAC and Ogg
+    Vorbis require the 'soundfile' package listed in requirements.txt;
+    WAV is used when it is not installed.
+    Args:
+    - samples (ndarray): Mono samples.
+    - rate (int): The sample rate.
+    - fmt (string): 'flac', 'ogg' or 'wav'.
+    Returns:
+    - tuple: (file name, encoded bytes).
+    """
+    buffer = io.BytesIO()
+    if fmt in ("flac", "ogg"):
+        try:
+            import soundfile
+        except ImportError:
+            fmt = "wav"
+        else:
+            soundfile.write(buffer, samples, rate, format=fmt.upper())
+            return "speech.{}".format(fmt), buffer.getvalue()
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2")
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return "speech.wav", buffer.getvalue()
+
+
+def split_on_silence(samples, rate: int, max_seconds: float = 30.0,
+                     overlap_ms: int = 300) -> list:
+    """Function that splits a long recording into segments no longer than
+    max_seconds, cutting at the quietest frame in the second half of each
+    segment so that words are rarely split. Neighbouring segments share
+    overlap_ms of audio so that a word cut in half is heard in full by at
+    least one of them.
+    Args:
+    - samples (ndarray): Mono samples.
+    - rate (int): The sample rate.
+    - max_seconds (float): The maximum length of a segment.
+    - overlap_ms (int): The audio shared by neighbouring segments.
+    Returns:
+    - list: The segments' samples, in order.
+    """
+    frame_len = max(1, rate * FRAME_MS // 1000)
+    max_frames = max(2, int(max_seconds * 1000 // FRAME_MS))
+    overlap = rate * overlap_ms // 1000
+    energy = frame_energy(samples, rate)
+    segments = []
+    start_frame = 0
+    while len(energy) - start_frame > max_frames:
+        # Cut at the quietest frame of the second half of the window
+        window = energy[start_frame + max_frames // 2:
+                        start_frame + max_frames]
+        cut_frame = start_frame + max_frames // 2 + int(np.argmin(window))
+        segments.append(
+            samples[max(0, start_frame * frame_len - overlap):
+                    cut_frame * frame_len + overlap]
+        )
+        start_frame = cut_frame
+    segments.append(samples[max(0, start_frame * frame_len - overlap):])
+    return segments
+
+
+def preprocess_segments(wav_bytes: bytes, max_seconds: float = 30.0,
+                        fmt: str = UPLOAD_FORMAT) -> list:
+    """Function that prepares a recording for upload to Whisper: silence
+    is trimmed, the audio is downsampled to 16 kHz mono, split into
+    segments at silence boundaries so that they can be transcribed in
+    parallel, and each segment is encoded in a compact format. Recordings
+    that cannot be decoded are passed through unchanged.
+    Args:
+    - wav_bytes (bytes): The WAV data returned by the audio recorder.
+    - max_seconds (float): The maximum length of a segment.
+    - fmt (string): 'flac', 'ogg' or 'wav'.
+    Returns:
+    - list: (file name, audio bytes) for each segment, empty if the
+    recording contains no voice.
+    """
+    try:
+        samples, rate = decode_wav(wav_bytes)
+    except (wave.Error, EOFError, ValueError):
+        return [("speech.wav", wav_bytes)]
+    samples = trim_silence(samples, rate)
+    if not len(samples):
+        return []
+    samples = resample(samples, rate)
+    return [
+        encode(segment, WHISPER_SAMPLE_RATE, fmt)
+        for segment in split_on_silence(
+            samples, WHISPER_SAMPLE_RATE, max_seconds
+        )
+    ]
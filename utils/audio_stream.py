@@ -0,0 +1,324 @@
+import asyncio
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+import httpx
+from openai import AsyncOpenAI, OpenAIError
+from tornado.httpserver import HTTPServer
+from tornado.iostream import StreamClosedError
+from tornado.web import Application, HTTPError, RequestHandler
+
+
+# Address of the endpoint as seen by the browser, e.g. the path that the ...
+# ...reverse proxy in front of the app forwards to AUDIO_STREAM_PORT, or ...
+# ...empty to embed the audio in the page instead
+AUDIO_STREAM_URL = os.environ.get("AUDIO_STREAM_URL", "")
+# Port of the audio streaming endpoint
+AUDIO_STREAM_PORT = int(os.environ.get("AUDIO_STREAM_PORT", "8503"))
+# Interface the endpoint listens on, the proxy's side by default
+AUDIO_STREAM_HOST = os.environ.get("AUDIO_STREAM_HOST", "127.0.0.1")
+# Compressed format of the speech, one of FORMATS
+AUDIO_STREAM_FORMAT = os.environ.get("AUDIO_STREAM_FORMAT", "mp3")
+# Memory budget of the synthesized speech kept for replays, in megabytes
+AUDIO_CACHE_MB = float(os.environ.get("AUDIO_CACHE_MB", "64"))
+# {speech format: MIME type} of the formats browsers play while streaming
+FORMATS = {"mp3": "audio/mpeg", "opus": "audio/ogg", "aac": "audio/aac"}
+# Seconds a link to a speech stays valid
+TOKEN_TTL_SECONDS = 300
+# Seconds a client may take to send the headers of its request
+HEADER_TIMEOUT_SECONDS = 10
+# Single byte range of a Range header, e.g. 'bytes=0-1023' or 'bytes=-500'
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Logger of the endpoint, which runs on the shared execution core
+LOGGER = logging.getLogger(__name__)
+
+
+
+class Speech:
+    """Define the class for the speech of one link, synthesized once and
+    kept for the lifetime of the link, so that replays and range requests
+    are served from memory instead of paying for the speech again.
+    """
+
+    def __init__(self, client: AsyncOpenAI, text: str, model: str,
+                 voice: str):
+        """Initialize a new instance of the Speech class.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - text (string): The text to convert to speech.
+        - model (string): The text-to-speech model.
+        - voice (string): The voice of the speech.
+        """
+        self.client = client
+        self.text = text
+        self.model = model
+        self.voice = voice
+        self.expiry = time.monotonic() + TOKEN_TTL_SECONDS
+        # Chunks of audio received so far, and their total size
+        self.chunks = []
+        self.size = 0
+        # The synthesis, started by the first request for the link
+        self.task = None
+        # The error that stopped the synthesis, if any
+        self.error = None
+        self.done = False
+        # Woken up whenever a chunk arrives or the synthesis ends
+        self.changed = asyncio.Condition()
+
+
+    async def wait(self, received: int):
+        """Coroutine that waits for more audio than already received, or
+        for the end of the synthesis.
+        Args:
+        - received (int): The number of chunks already received.
+        """
+        async with self.changed:
+            await self.changed.wait_for(
+                lambda: self.done or len(self.chunks) > received
+            )
+
+
+    async def notify(self):
+        """Coroutine that wakes up the requests waiting for audio.
+        """
+        async with self.changed:
+            self.changed.notify_all()
+
+
+
+class SpeechHandler(RequestHandler):
+    """Define the handler of GET /speech/{token}.{format}. While the speech
+    is being synthesized, its chunks are relayed as they arrive so that
+    playback starts on the first one; afterwards, the cached audio is
+    served whole or by byte range.
+    """
+
+    def initialize(self, server):
+        """Method to receive the endpoint.
+        Args:
+        - server (AudioStreamServer): The endpoint holding the links.
+        """
+        self.server = server
+
+
+    async def get(self, token: str):
+        speech = self.server.speech(token)
+        if speech is None:
+            raise HTTPError(404)
+        self.server.synthesize(speech)
+        self.set_header("Content-Type", FORMATS[AUDIO_STREAM_FORMAT])
+        self.set_header(
+            "Cache-Control", "private, max-age={}".format(TOKEN_TTL_SECONDS)
+        )
+        try:
+            if speech.done or "Range" in self.request.headers:
+                await self.send_cached(speech)
+            else:
+                await self.relay(speech)
+        except StreamClosedError:
+            # The browser closed the connection, e.g. the user moved on
+            pass
+
+
+    async def relay(self, speech: Speech):
+        """Coroutine that sends the chunks of a speech as they are
+        synthesized, using chunked transfer encoding.
+        Args:
+        - speech (Speech): The speech of the link.
+        """
+        sent = 0
+        while True:
+            await speech.wait(sent)
+            if speech.error is not None and not sent:
+                raise HTTPError(502)
+            for chunk in speech.chunks[sent:]:
+                self.write(chunk)
+                sent += 1
+            # Wait for the browser to keep up, so that a slow listener ...
+            # ...does not pile up chunks in the connection's buffer
+            await self.flush()
+            if speech.done and sent == len(speech.chunks):
+                break
+        if speech.error is not None:
+            # The upstream stream broke off, so the response is left ...
+            # ...incomplete for the browser to notice
+            self.request.connection.close()
+
+
+    async def send_cached(self, speech: Speech):
+        """Coroutine that sends a complete speech, or the byte range asked
+        for by the browser to seek in it.
+        Args:
+        - speech (Speech): The speech of the link.
+        """
+        while not speech.done:
+            await speech.wait(len(speech.chunks))
+        if speech.error is not None:
+            raise HTTPError(502)
+        data = b"".join(speech.chunks)
+        self.set_header("Accept-Ranges", "bytes")
+        match = BYTE_RANGE.match(self.request.headers.get("Range", ""))
+        if match is None or match.groups() == ("", ""):
+            self.write(data)
+            return
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), len(data) - 1) if last else len(data) - 1
+        else:
+            # A suffix range, i.e. the last bytes of the audio
+            start = max(len(data) - int(last), 0)
+            end = len(data) - 1
+        if start > end:
+            # Not raised as an HTTPError, which would clear the header
+            self.set_status(416)
+            self.set_header("Content-Range", "bytes */{}".format(len(data)))
+            return
+        self.set_status(206)
+        self.set_header("Content-Range", "bytes {}-{}/{}".format(
+            start, end, len(data)
+        ))
+        self.write(data[start:end + 1])
+
+
+
+class AudioStreamServer:
+    """Define the class for the optional HTTP endpoint that streams the
+    bot's speech to the browser, served by Tornado on the event loop of the
+    execution core. The page only embeds an <audio> tag pointing at a link
+    with a short-lived token. Unless AUDIO_STREAM_URL tells how the
+    browser reaches the endpoint, it stays disabled and the speech is
+    embedded in the page instead. No URL is derived by default, as
+    Streamlit 1.20 cannot serve the endpoint on its own port and the
+    browser may not reach another one.
+    """
+
+    def __init__(self, core):
+        """Initialize a new instance of the AudioStreamServer class.
+        Args:
+        - core (AsyncCore): The execution core whose loop serves requests.
+        """
+        self.core = core
+        self.lock = threading.Lock()
+        # {token: Speech}, oldest first
+        self.tokens = {}
+        self.budget = int(AUDIO_CACHE_MB * 1024 * 1024)
+        self.server = None
+
+
+    def start(self) -> bool:
+        """Method to start listening for requests, unless disabled.
+        Returns:
+        - bool: Whether the endpoint is available.
+        """
+        if not AUDIO_STREAM_URL or AUDIO_STREAM_FORMAT not in FORMATS:
+            return False
+
+        async def listen():
+            server = HTTPServer(
+                Application([
+                    (r"/speech/([0-9A-Za-z_-]+)\.[a-z0-9]+", SpeechHandler,
+                     {"server": self}),
+                ]),
+                idle_connection_timeout=HEADER_TIMEOUT_SECONDS,
+            )
+            server.listen(AUDIO_STREAM_PORT, AUDIO_STREAM_HOST)
+            return server
+
+        try:
+            self.server = self.core.run(listen(), limit=None)
+        except OSError as error:
+            # E.g. the port is taken, in which case the page falls back ...
+            # ...to embedding the audio
+            LOGGER.warning("Audio streaming is unavailable: %s", error)
+            return False
+        return True
+
+
+    def register(self, client: AsyncOpenAI, text: str, model: str = "tts-1",
+                 voice: str = "fable") -> str:
+        """Method to create a link that streams the speech of a text.
+        Args:
+        - client (AsyncOpenAI): The client of the user's API key.
+        - text (string): The text to convert to speech.
+        - model (string): The text-to-speech model.
+        - voice (string): The voice of the speech.
+        Returns:
+        - str: The URL of the speech, valid for TOKEN_TTL_SECONDS.
+        """
+        token = secrets.token_urlsafe(24)
+        now = time.monotonic()
+        with self.lock:
+            # Drop the expired links, then the oldest ones until the ...
+            # ...cached speech fits in its budget
+            cached = 0
+            for key, speech in list(self.tokens.items()):
+                if speech.expiry < now:
+                    del self.tokens[key]
+                else:
+                    cached += speech.size
+            for key in list(self.tokens):
+                if cached <= self.budget:
+                    break
+                cached -= self.tokens.pop(key).size
+            self.tokens[token] = Speech(client, text, model, voice)
+        return "{}/speech/{}.{}".format(
+            AUDIO_STREAM_URL.rstrip("/"), token, AUDIO_STREAM_FORMAT
+        )
+
+
+    def speech(self, token: str) -> Speech:
+        """Method to look up the speech of a link.
+        Args:
+        - token (string): The token of the link.
+        Returns:
+        - Speech: The speech, or None if the link is unknown or expired.
+        """
+        with self.lock:
+            speech = self.tokens.get(token)
+            if speech is not None and speech.expiry < time.monotonic():
+                del self.tokens[token]
+                return None
+            return speech
+
+
+    def synthesize(self, speech: Speech):
+        """Method to start synthesizing a speech, unless already started.
+        It runs apart from the requests, so that a slow or departed
+        listener neither holds a slot of the API concurrency limit nor
+        stops the speech from being cached.
+        Args:
+        - speech (Speech): The speech of the link.
+        """
+        if speech.task is None:
+            speech.task = asyncio.ensure_future(
+                self.core.limited(self.receive(speech), "openai")
+            )
+
+
+    async def receive(self, speech: Speech):
+        """Coroutine that reads the chunks of the text-to-speech response
+        into the speech as they arrive.
+        Args:
+        - speech (Speech): The speech of the link.
+        """
+        try:
+            async with speech.client.audio.speech.with_streaming_response\
+                    .create(
+                        model=speech.model, voice=speech.voice,
+                        input=speech.text,
+                        response_format=AUDIO_STREAM_FORMAT,
+                    ) as response:
+                async for chunk in response.iter_bytes():
+                    speech.chunks.append(chunk)
+                    speech.size += len(chunk)
+                    await speech.notify()
+        except (OpenAIError, httpx.HTTPError) as error:
+            LOGGER.warning("Speech synthesis failed: %s", error)
+            speech.error = error
+        finally:
+            speech.done = True
+            await speech.notify()
@@ -0,0 +1,275 @@
+import asyncio
+import io
+import json
+import os
+import threading
+import time
+
+
+# Seconds between two status checks of a batch job
+POLL_SECONDS = float(os.environ.get("BATCH_POLL_SECONDS", "30"))
+# Statuses after which a batch job no longer changes
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Seconds a job is kept in memory after its session last displayed it; ...
+# ...it is tracked again, and its results downloaded again, if the ...
+# ...session displays it later
+BATCH_RESULT_TTL_SECONDS = int(
+    os.environ.get("BATCH_RESULT_TTL_SECONDS", "3600")
+)
+
+
+
+def build_batch_requests(files: dict, user_message: str, model: str,
+                         instructions: str, build_prompt) -> str:
+    """Function that packages one chat completion request per uploaded
+    file into the JSONL input of a Batch API job.
+    Args:
+    - files (dict): {file name: code} of the uploaded code files.
+    - user_message (string): The prompt of the selected coding task.
+    - model (string): The GPT model to use.
+    - instructions (string): The system instructions of the assistant.
+    - build_prompt (function): Called as build_prompt(file name, code) to
+    build the code part of each prompt.
+    Returns:
+    - str: The JSONL content, with each file name as its custom ID.
+    """
+    return "".join(
+        json.dumps({
+            "custom_id": file_name,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": instructions},
+                    {
+                        "role": "user",
+                        "content": (
+                            user_message + "  \n"
+                            + build_prompt(file_name, code)
+                        ),
+                    },
+                ],
+            },
+        }) + "\n"
+        for file_name, code in files.items()
+    )
+
+
+def parse_result_line(line: str) -> tuple:
+    """Function that extracts the answer from a line of a batch output or
+    error file.
+    Args:
+    - line (string): A JSON line of the file.
+    Returns:
+    - tuple: (custom ID, answer or error message, True if successful).
+    """
+    record = json.loads(line)
+    response = record.get("response") or {}
+    body = response.get("body") or {}
+    if record.get("error") or response.get("status_code") != 200:
+        error = record.get("error") or body.get("error") or {}
+        return record["custom_id"], error.get("message", str(error)), False
+    return (
+        record["custom_id"], body["choices"][0]["message"]["content"], True
+    )
+
+
+
+class BatchJob:
+    """Define the class that tracks a Batch API job as a task of the async
+    execution core and collects its results as they are downloaded.
+    """
+
+    def __init__(self, core, client, batch_id: str):
+        """Initialize a new instance of the BatchJob class and start
+        tracking the job.
+        Args:
+        - core (AsyncCore): The execution core that runs the tracking task.
+        - client (AsyncOpenAI): The OpenAI client used to call the API.
+        - batch_id (string): The ID of the batch job.
+        """
+        self.client = client
+        self.batch_id = batch_id
+        self.lock = threading.Lock()
+        self.batch = None
+        self.error = None
+        # {custom ID: (answer or error message, True if successful)}
+        self.results = {}
+        # Tracking mostly sleeps, so it is not subject to any limit
+        self.task = core.submit(self.track(), limit=None)
+
+
+    @classmethod
+    def submit(cls, core, client, requests_jsonl: str,
+               description: str = ""):
+        """Method to upload the input file of a batch job and create it.
+        Args:
+        - core (AsyncCore): The execution core that runs the requests.
+        - client (AsyncOpenAI): The OpenAI client used to call the API.
+        - requests_jsonl (string): The JSONL input of the job.
+        - description (string): A label stored in the job's metadata.
+        Returns:
+        - BatchJob: The tracked job.
+        """
+        batch = core.run(cls.create(client, requests_jsonl, description))
+        return cls(core, client, batch.id)
+
+
+    @staticmethod
+    async def create(client, requests_jsonl: str, description: str):
+        """Coroutine that uploads the input file and creates the job.
+        Returns:
+        - Batch: The new batch job.
+        """
+        input_file = await client.files.create(
+            file=("batch.jsonl", io.BytesIO(requests_jsonl.encode("utf-8"))),
+            purpose="batch",
+        )
+        return await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"description": description or "CodeMaxGPT batch"},
+        )
+
+
+    async def track(self):
+        """Coroutine that polls the job until it ends and downloads its
+        results.
+        """
+        try:
+            while True:
+                batch = await self.client.batches.retrieve(self.batch_id)
+                with self.lock:
+                    self.batch = batch
+                if batch.status in FINAL_STATUSES:
+                    break
+                await asyncio.sleep(POLL_SECONDS)
+            # Failed requests are reported in a separate error file. ...
+            # ...Expired and cancelled jobs may still have partial results
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    await self.download(file_id)
+        except Exception as error:
+            # Surface any failure on the web page, since nothing else ...
+            # ...observes this task
+            with self.lock:
+                self.error = str(error)
+
+
+    async def download(self, file_id: str):
+        """Coroutine that streams a result file line by line, making each
+        result available as soon as it has been read.
+        Args:
+        - file_id (string): The ID of the output or error file.
+        """
+        async with self.client.files.with_streaming_response.content(
+            file_id
+        ) as response:
+            async for line in response.iter_lines():
+                if line.strip():
+                    custom_id, answer, ok = parse_result_line(line)
+                    with self.lock:
+                        self.results[custom_id] = (answer, ok)
+
+
+    def snapshot(self) -> tuple:
+        """Method to read the state of the job from the web page.
+        Returns:
+        - tuple: (latest batch object or None, error message or None,
+        copy of the results).
+        """
+        with self.lock:
+            return self.batch, self.error, dict(self.results)
+
+
+
+class BatchRegistry:
+    """Define the class for the batch jobs tracked in the background,
+    kept per session so that a session only ever sees its own jobs, and
+    dropped from memory once their session stops displaying them.
+    """
+
+    def __init__(self, ttl_seconds: int = BATCH_RESULT_TTL_SECONDS):
+        """Initialize a new instance of the BatchRegistry class.
+        Args:
+        - ttl_seconds (int): Seconds a job is kept after its session last
+        displayed it.
+        """
+        self.ttl = ttl_seconds
+        self.lock = threading.Lock()
+        # {session ID: {batch ID: [BatchJob, time last displayed]}}
+        self.sessions = {}
+
+
+    def add(self, session_id: str, job: BatchJob):
+        """Method to start keeping a job of a session.
+        Args:
+        - session_id (string): The ID of the session.
+        - job (BatchJob): The tracked job.
+        """
+        with self.lock:
+            self.sessions.setdefault(session_id, {})[job.batch_id] = [
+                job, time.monotonic()
+            ]
+
+
+    def jobs(self, session_id: str, batch_ids: list, track) -> list:
+        """Method to get the jobs of a session, tracking again those that
+        were dropped from memory or submitted before a server restart.
+        Jobs kept for too long are dropped at the same time.
+        Args:
+        - session_id (string): The ID of the session.
+        - batch_ids (list): The IDs of the session's jobs, as persisted in
+        the conversation store.
+        - track (function): Called as track(batch ID) to start tracking a
+        job, returning its BatchJob.
+        Returns:
+        - list: (batch ID, BatchJob) tuples, in the order of batch_ids.
+        """
+        self.prune()
+        now = time.monotonic()
+        found = []
+        with self.lock:
+            kept = self.sessions.setdefault(session_id, {})
+            for batch_id in batch_ids:
+                if batch_id not in kept:
+                    kept[batch_id] = [track(batch_id), now]
+                kept[batch_id][1] = now
+                found.append((batch_id, kept[batch_id][0]))
+        return found
+
+
+    def drop(self, session_id: str, batch_id: str):
+        """Method to forget a job of a session and stop tracking it.
+        Args:
+        - session_id (string): The ID of the session.
+        - batch_id (string): The ID of the job.
+        """
+        with self.lock:
+            kept = self.sessions.get(session_id, {})
+            entry = kept.pop(batch_id, None)
+            if not kept:
+                self.sessions.pop(session_id, None)
+        if entry is not None:
+            entry[0].task.cancel()
+
+
+    def prune(self):
+        """Method to drop the jobs that their session has not displayed for
+        longer than the TTL, along with their results.
+        """
+        now = time.monotonic()
+        stale = []
+        with self.lock:
+            for session_id, kept in list(self.sessions.items()):
+                for batch_id, (job, displayed) in list(kept.items()):
+                    if now - displayed > self.ttl:
+                        stale.append(job)
+                        del kept[batch_id]
+                if not kept:
+                    del self.sessions[session_id]
+        # Unfinished jobs are tracked again when displayed again
+        for job in stale:
+            job.task.cancel()
@@ -0,0 +1,387 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+
+# How long a fetched problem statement is reused, in seconds
+CHALLENGE_TTL_SECONDS = int(os.environ.get("CHALLENGE_TTL_SECONDS", "86400"))
+# GraphQL endpoint that serves the statements of LeetCode problems
+LEETCODE_GRAPHQL_URL = os.environ.get(
+    "LEETCODE_GRAPHQL_URL", "https://leetcode.com/graphql"
+)
+# Hosts whose pages may be fetched, or '*' for any host. Subdomains of a ...
+# ...listed host are allowed too
+CHALLENGE_HOSTS = [
+    host.strip().lower() for host in os.environ.get(
+        "CHALLENGE_HOSTS",
+        "leetcode.com,leetcode.cn,hackerrank.com,codewars.com,"
+        "codeforces.com,projecteuler.net,exercism.org,geeksforgeeks.org",
+    ).split(",") if host.strip()
+]
+# Timeout of a fetch, in seconds
+FETCH_TIMEOUT = float(os.environ.get("CHALLENGE_FETCH_TIMEOUT", "10"))
+# Maximum number of characters of a statement added to a prompt
+MAX_STATEMENT_CHARS = 8000
+# Responses larger than this are cut off, in bytes
+MAX_RESPONSE_BYTES = 2 * 1024 * 1024
+# Number of statements kept in the cache
+MAX_ENTRIES = 256
+# First web address in a text
+URL_PATTERN = re.compile(r"https?://[^\s<>\"']+")
+# LeetCode problem pages, capturing the problem's slug
+LEETCODE_PATH = re.compile(r"^/problems/([a-z0-9-]+)")
+# Elements whose text is not part of a page's content
+SKIPPED_TAGS = {"script", "style", "noscript", "svg", "head", "nav",
+                "header", "footer", "form", "button", "iframe", "template"}
+# Elements that start a new line of text
+BLOCK_TAGS = {"p", "div", "br", "li", "pre", "tr", "table", "section",
+              "article", "blockquote", "ul", "ol", "dl", "dt", "dd",
+              "h1", "h2", "h3", "h4", "h5", "h6"}
+# Query of the title and statement of a LeetCode problem
+LEETCODE_QUERY = (
+    "query questionContent($titleSlug: String!) { question(titleSlug: "
+    "$titleSlug) { title content isPaidOnly } }"
+)
+
+
+# A problem statement: its title, plain text and the address it came from
+Challenge = namedtuple("Challenge", ["title", "text", "url"])
+
+
+
+class ChallengeFetchError(Exception):
+    """Raised when the statement of a coding challenge cannot be fetched.
+    """
+
+
+
+class TextExtractor(HTMLParser):
+    """Define the class for reducing an HTML page or fragment to plain
+    text: scripts, styles and page chrome are dropped, blocks become
+    lines, list items become bullets, superscripts become powers, and the
+    whitespace of <pre> blocks is kept.
+    """
+
+    def __init__(self):
+        """Initialize a new instance of the TextExtractor class.
+        """
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.title = ""
+        # Depth of the skipped and <pre> elements being read
+        self.skipped = 0
+        self.preformatted = 0
+        self.in_title = False
+
+
+    def handle_starttag(self, tag: str, attrs: list):
+        if tag == "title":
+            self.in_title = True
+        elif tag in SKIPPED_TAGS:
+            self.skipped += 1
+        elif self.skipped:
+            return
+        elif tag == "pre":
+            self.preformatted += 1
+            self.parts.append("\n")
+        elif tag == "li":
+            self.parts.append("\n- ")
+        elif tag == "sup":
+            self.parts.append("^")
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+
+    def handle_endtag(self, tag: str):
+        if tag == "title":
+            self.in_title = False
+        elif tag in SKIPPED_TAGS:
+            self.skipped = max(self.skipped - 1, 0)
+        elif self.skipped:
+            return
+        elif tag == "pre":
+            self.preformatted = max(self.preformatted - 1, 0)
+            self.parts.append("\n")
+        elif tag in BLOCK_TAGS and tag != "li":
+            self.parts.append("\n")
+
+
+    def handle_data(self, data: str):
+        if self.in_title:
+            self.title += data
+        elif self.skipped:
+            return
+        elif self.preformatted:
+            self.parts.append(data)
+        else:
+            self.parts.append(re.sub(r"\s+", " ", data))
+
+
+    def text(self) -> str:
+        """Method to get the text read so far.
+        Returns:
+        - str: The text, without blank runs of more than one line.
+        """
+        lines = [line.rstrip() for line in "".join(self.parts).split("\n")]
+        return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+
+def html_to_text(markup: str) -> tuple:
+    """Function that extracts the title and the plain text of HTML.
+    Args:
+    - markup (string): The HTML page or fragment.
+    Returns:
+    - tuple: (title, text).
+    """
+    extractor = TextExtractor()
+    extractor.feed(markup)
+    extractor.close()
+    return " ".join(extractor.title.split()), extractor.text()
+
+
+def find_url(text: str) -> str:
+    """Function that finds the web address of a challenge in a text.
+    Args:
+    - text (string): What the user entered.
+    Returns:
+    - str: The first address, or None if there is none.
+    """
+    match = URL_PATTERN.search(text)
+    return match.group(0).rstrip(".,;:!?)") if match else None
+
+
+def is_allowed(host: str) -> bool:
+    """Function that tells whether pages of a host may be fetched.
+    Args:
+    - host (string): The host name of the address.
+    Returns:
+    - bool: True if the host or a parent domain is in CHALLENGE_HOSTS.
+    """
+    host = host.lower()
+    return "*" in CHALLENGE_HOSTS or any(
+        host == allowed or host.endswith("." + allowed)
+        for allowed in CHALLENGE_HOSTS
+    )
+
+
+def leetcode_slug(url: str) -> str:
+    """Function that reads the slug of a LeetCode problem from its address.
+    Args:
+    - url (string): The address, e.g.
+    'https://leetcode.com/problems/number-of-enclaves/description/'.
+    Returns:
+    - str: The slug, e.g. 'number-of-enclaves', or None if the address is
+    not a leetcode.com problem.
+    """
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    if host != "leetcode.com" and not host.endswith(".leetcode.com"):
+        return None
+    match = LEETCODE_PATH.match(parts.path)
+    return match.group(1) if match else None
+
+
+def read_limited(response) -> str:
+    """Function that reads the body of a streamed response, cut off at
+    MAX_RESPONSE_BYTES.
+    Args:
+    - response (httpx.Response): The response.
+    Returns:
+    - str: The decoded body.
+    """
+    body = bytearray()
+    for chunk in response.iter_bytes():
+        body += chunk
+        if len(body) >= MAX_RESPONSE_BYTES:
+            break
+    return bytes(body[:MAX_RESPONSE_BYTES]).decode(
+        response.encoding or "utf-8", errors="replace"
+    )
+
+
+
+class ChallengeFetcher:
+    """Define the class for fetching the statements of coding challenges
+    and caching them by address for CHALLENGE_TTL_SECONDS. LeetCode
+    problems are read from its GraphQL endpoint, other pages are reduced to
+    plain text. Concurrent requests for the same address share one fetch.
+    """
+
+    def __init__(self, ttl: float = CHALLENGE_TTL_SECONDS,
+                 graphql_url: str = LEETCODE_GRAPHQL_URL):
+        """Initialize a new instance of the ChallengeFetcher class.
+        Args:
+        - ttl (float): How long a statement is reused, in seconds.
+        - graphql_url (string): The GraphQL endpoint of LeetCode.
+        """
+        self.ttl = ttl
+        self.graphql_url = graphql_url
+        self.lock = threading.Lock()
+        # {cache key: (expiry time, Challenge)}, least recently used first
+        self.cache = OrderedDict()
+        # {cache key: threading.Event set when its fetch ends}
+        self.pending = {}
+        # The HTTP client, created on first use
+        self.http = None
+
+
+    def client(self):
+        """Method to get the HTTP client, whose connections are reused
+        across fetches.
+        Returns:
+        - httpx.Client: The client.
+        """
+        if self.http is None:
+            # Imported on first use to keep the page's cold start light
+            import httpx
+
+            self.http = httpx.Client(
+                timeout=FETCH_TIMEOUT,
+                follow_redirects=True,
+                headers={"User-Agent": "Mozilla/5.0 (CodeMaxGPT)"},
+                # Redirects are checked too
+                event_hooks={"request": [self.check_host]},
+            )
+        return self.http
+
+
+    def check_host(self, request):
+        """Method to refuse requests to hosts that are not allowed, called
+        by the HTTP client before each request. The GraphQL endpoint is
+        always allowed.
+        Args:
+        - request (httpx.Request): The request.
+        """
+        host = request.url.host
+        if str(request.url) != self.graphql_url and not is_allowed(host):
+            raise ChallengeFetchError(
+                "Fetching pages from {} is not allowed on this server."
+                .format(host)
+            )
+
+
+    @staticmethod
+    def cache_key(url: str) -> str:
+        """Method to get the cache key of an address, so that the variants
+        of an address a user may paste share one entry.
+        Args:
+        - url (string): The address.
+        Returns:
+        - str: The key.
+        """
+        slug = leetcode_slug(url)
+        if slug:
+            return "leetcode:" + slug
+        parts = urlsplit(url)
+        return "{}://{}{}{}".format(
+            parts.scheme, (parts.hostname or "").lower(),
+            parts.path.rstrip("/") or "/",
+            "?" + parts.query if parts.query else "",
+        )
+
+
+    def fetch(self, url: str) -> tuple:
+        """Method to get the statement of a coding challenge, from the cache
+        when it has been fetched within the TTL.
+        Args:
+        - url (string): The address of the challenge.
+        Returns:
+        - tuple: (Challenge, True if it came from the cache).
+        """
+        key = self.cache_key(url)
+        while True:
+            with self.lock:
+                entry = self.cache.get(key)
+                if entry is not None and entry[0] > time.time():
+                    self.cache.move_to_end(key)
+                    return entry[1], True
+                event = self.pending.get(key)
+                if event is None:
+                    # This request fetches, the others wait for it
+                    event = self.pending[key] = threading.Event()
+                    break
+            # Wait for the fetch in progress, then read the cache again, ...
+            # ...or fetch if it failed
+            event.wait(FETCH_TIMEOUT * 2)
+        try:
+            challenge = self.download(url)
+            with self.lock:
+                self.cache[key] = (time.time() + self.ttl, challenge)
+                self.cache.move_to_end(key)
+                while len(self.cache) > MAX_ENTRIES:
+                    self.cache.popitem(last=False)
+            return challenge, False
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+            event.set()
+
+
+    def download(self, url: str) -> Challenge:
+        """Method to fetch the statement of a coding challenge.
+        Args:
+        - url (string): The address of the challenge.
+        Returns:
+        - Challenge: The statement.
+        """
+        import httpx
+
+        slug = leetcode_slug(url)
+        try:
+            if slug:
+                return self.download_leetcode(url, slug)
+            with self.client().stream("GET", url) as response:
+                response.raise_for_status()
+                title, text = html_to_text(read_limited(response))
+        except httpx.HTTPStatusError as error:
+            raise ChallengeFetchError("{} answered with HTTP {}.".format(
+                error.request.url.host, error.response.status_code
+            )) from error
+        except httpx.HTTPError as error:
+            raise ChallengeFetchError(str(error)) from error
+        if not text:
+            raise ChallengeFetchError("The page has no text.")
+        return Challenge(title, text[:MAX_STATEMENT_CHARS], url)
+
+
+    def download_leetcode(self, url: str, slug: str) -> Challenge:
+        """Method to fetch the statement of a LeetCode problem from the
+        GraphQL endpoint, as its pages are rendered in the browser.
+        Args:
+        - url (string): The address of the problem.
+        - slug (string): The slug of the problem.
+        Returns:
+        - Challenge: The statement.
+        """
+        response = self.client().post(
+            self.graphql_url,
+            json={"query": LEETCODE_QUERY, "variables": {"titleSlug": slug}},
+            headers={"Referer": "https://leetcode.com/problems/{}/".format(
+                slug
+            )},
+        )
+        response.raise_for_status()
+        try:
+            question = (response.json().get("data") or {}).get("question")
+        except (ValueError, AttributeError) as error:
+            raise ChallengeFetchError(
+                "Unexpected response from LeetCode."
+            ) from error
+        if not question:
+            raise ChallengeFetchError(
+                "LeetCode has no problem '{}'.".format(slug)
+            )
+        if not question.get("content"):
+            raise ChallengeFetchError(
+                "'{}' is a premium problem.".format(question.get("title"))
+                if question.get("isPaidOnly")
+                else "LeetCode returned no statement for '{}'.".format(slug)
+            )
+        _, text = html_to_text(question["content"])
+        return Challenge(question.get("title") or slug,
+                         text[:MAX_STATEMENT_CHARS], url)
@@ -0,0 +1,47 @@
+import difflib
+
+
+
+def build_code_prompt(code: str, language: str, file_name: str = "",
+                      previous: str = None) -> str:
+    """Function that builds the part of a prompt carrying the user's code.
+    If a previous version of the same file was already sent on the thread,
+    only a unified diff against that version is included, unless the diff
+    would be larger than the file itself.
+    Args:
+    - code (string): The current code.
+    - language (string): The code language of the editor.
+    - file_name (string): The name of the file, empty if not applicable.
+    - previous (string): The version of the file last sent on the thread,
+    or None if the file has not been sent yet.
+    Returns:
+    - str: The code prompt.
+    """
+    label = "`{}` code".format(file_name) if file_name else "code"
+    if previous is not None:
+        # Tell the assistant there is nothing new to read
+        if previous == code:
+            return "The {} is unchanged since the last version I sent.".format(
+                label
+            )
+        # Compute the changes against the version last sent
+        diff = "\n".join(
+            difflib.unified_diff(
+                previous.splitlines(),
+                code.splitlines(),
+                fromfile="a/" + (file_name or "code"),
+                tofile="b/" + (file_name or "code"),
+                lineterm="",
+            )
+        )
+        # Only send the diff when it is smaller than the full file
+        if len(diff) < len(code):
+            return (
+                "Here are my changes to the {} since the last version I "
+                "sent, as a unified diff:  \n```diff  \n{}  \n```".format(
+                    label, diff
+                )
+            )
+    return "Here is the {}:  \n```{}  \n{}  \n```".format(
+        label, language, code
+    )
@@ -0,0 +1,109 @@
+import os
+from utils.turns import count_tokens
+
+
+# Number of prompt tokens processed by a run above which the thread is ...
+# ...compacted
+COMPACTION_THRESHOLD = int(os.environ.get("COMPACTION_THRESHOLD", "24000"))
+# Maximum number of tokens of the seed message of a compacted thread, ...
+# ...kept well below the threshold so that the next runs do not compact ...
+# ...again right away
+SEED_BUDGET_TOKENS = COMPACTION_THRESHOLD // 2
+# GPT model used to summarize the earlier turns of a thread
+COMPACTION_MODEL = os.environ.get("COMPACTION_MODEL", "gpt-4o-mini")
+# Maximum number of characters of each turn passed to the summarizer
+MAX_TURN_CHARS = 4000
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the following conversation between a programmer and an AI "
+    "coding assistant so that the assistant can continue it without the "
+    "original messages. Keep every requirement, decision, open question "
+    "and the latest state of the code being discussed. Do not repeat full "
+    "source files; they will be provided separately."
+)
+
+
+
+async def summarize_turns(client, turns, previous: str = "",
+                          model: str = COMPACTION_MODEL) -> str:
+    """Coroutine that summarizes the earlier turns of a conversation. When
+    the conversation was compacted before, only the turns added since are
+    summarized, on top of the previous summary.
+    Args:
+    - client (AsyncOpenAI): The OpenAI client used to call the API.
+    - turns (iterable): The Turn objects to summarize.
+    - previous (string): The summary of the turns before them, if any.
+    - model (string): The GPT model used for the summary.
+    Returns:
+    - str: The summary of the conversation.
+    """
+    # Lay out the conversation as a transcript, clipping long messages ...
+    # ...such as pasted source files
+    transcript = "\n\n".join(
+        "{}: {}".format(turn.role.upper(), turn.content[:MAX_TURN_CHARS])
+        for turn in turns if turn.content
+    )
+    if previous:
+        # The summary stands for the turns it replaced
+        transcript = "SUMMARY OF THE EARLIER CONVERSATION: {}\n\n{}".format(
+            previous, transcript
+        )
+    completion = await client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": transcript},
+        ],
+    )
+    return completion.choices[0].message.content
+
+
+def build_seed_message(summary: str, files: dict,
+                       budget: int = SEED_BUDGET_TOKENS) -> tuple:
+    """Function that builds the first message of a compacted thread from
+    the summary of the earlier turns and the relevant code files, adding
+    files while the message stays within its token budget.
+    Args:
+    - summary (string): The summary of the earlier turns.
+    - files (dict): {file name: code} of the relevant code files, most
+    relevant first.
+    - budget (int): The maximum number of tokens of the message.
+    Returns:
+    - tuple: (content of the seed message, {file name: code} of the files
+    it contains).
+    """
+    parts = [
+        "Here is a summary of our conversation so far:  \n" + summary
+    ]
+    tokens = count_tokens(parts[0])
+    seeded = {}
+    for file_name, code in files.items():
+        part = "Here is the current `{}` code:  \n```  \n{}  \n```".format(
+            file_name, code
+        )
+        # Files left out are sent again when a prompt needs them
+        part_tokens = count_tokens(part)
+        if tokens + part_tokens > budget:
+            continue
+        parts.append(part)
+        tokens += part_tokens
+        seeded[file_name] = code
+    return "  \n\n".join(parts), seeded
+
+
+def compaction_report(tokens_before: int, seed: str) -> str:
+    """Function that describes the context saved by a compaction.
+    Args:
+    - tokens_before (int): The prompt tokens of the last run on the old
+    thread.
+    - seed (string): The seed message of the new thread.
+    Returns:
+    - str: A message reporting the context savings.
+    """
+    tokens_after = count_tokens(seed)
+    saving = 1 - tokens_after / tokens_before if tokens_before else 0
+    return (
+        "The conversation was compacted to keep responses fast: the context "
+        "sent with each request shrank from about {:,} to {:,} tokens "
+        "({:.0%} smaller).".format(tokens_before, tokens_after, saving)
+    )
@@ -0,0 +1,498 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from utils.turns import Turn
+
+
+
+class ConversationStore:
+    """Define the base class for pluggable conversation stores. A store
+    persists the turns, uploaded files and small metadata values (such as
+    Assistants thread IDs) of every session so that history survives page
+    refreshes and can be evicted from server memory at any time.
+    """
+
+    def append_turns(self, session_id: str, page: str, turns: list):
+        """Method to persist new turns of a conversation.
+        Args:
+        - session_id (string): The ID of the browser session.
+        - page (string): The web app the turns belong to.
+        - turns (list): The new Turn objects, oldest first.
+        """
+        raise NotImplementedError
+
+
+    def load_turns(self, session_id: str, page: str, limit: int) -> list:
+        """Method to load the most recent turns of a conversation.
+        Args:
+        - session_id (string): The ID of the browser session.
+        - page (string): The web app the turns belong to.
+        - limit (int): The maximum number of turns to load, none if it is
+        0 or less.
+        Returns:
+        - list: Turn objects, oldest first.
+        """
+        raise NotImplementedError
+
+
+    def iter_turns(self, session_id: str, page: str,
+                   batch_size: int = 500):
+        """Method to iterate over all the turns of a conversation, reading
+        them in batches so that long conversations are never held in
+        memory at once.
+        Args:
+        - session_id (string): The ID of the browser session.
+        - page (string): The web app the turns belong to.
+        - batch_size (int): The number of turns read at a time.
+        Yields:
+        - Turn: The turns, oldest first.
+        """
+        raise NotImplementedError
+
+
+    def save_file(self, session_id: str, name: str, content: str):
+        """Method to persist an uploaded code file.
+        Args:
+        - session_id (string): The ID of the browser session.
+        - name (string): The name of the file.
+        - content (string): The content of the file.
+        """
+        raise NotImplementedError
+
+
+    def delete_file(self, session_id: str, name: str):
+        """Method to delete a persisted code file.
+        Args:
+        - session_id (string): The ID of the browser session.
+        - name (string): The name of the file.
+        """
+        raise NotImplementedError
+
+
+    def clear_files(self, session_id: str):
+        """Method to delete all persisted code files of a session.
+        Args:
+        - session_id (string): The ID of the browser session.
+        """
+        raise NotImplementedError
+
+
+    def load_files(self, session_id: str) -> dict:
+        """Method to load the persisted code files of a session.
+        Args:
+        - session_id (string): The ID of the browser session.
+        Returns:
+        - dict: {file name: file content}, in upload order.
+        """
+        raise NotImplementedError
+
+
+    def set_meta(self, session_id: str, key: str, value: str):
+        """Method to persist a metadata value of a session.
+        Args:
+        - session_id (string): The ID of the browser session.
+        - key (string): The name of the metadata value.
+        - value (string): The metadata value.
+        """
+        raise NotImplementedError
+
+
+    def get_meta(self, session_id: str, key: str, default=None):
+        """Method to load a metadata value of a session.
+        Args:
+        - session_id (string): The ID of the browser session.
+        - key (string): The name of the metadata value.
+        - default: The value returned if the key has not been stored.
+        """
+        raise NotImplementedError
+
+
+    def load_meta(self, session_id: str) -> dict:
+        """Method to load all the metadata values of a session.
+        Args:
+        - session_id (string): The ID of the browser session.
+        Returns:
+        - dict: {key: value}.
+        """
+        raise NotImplementedError
+
+
+    def touch(self, session_id: str):
+        """Method to record that a session is in use, for stores whose
+        sessions expire. Does nothing by default.
+        Args:
+        - session_id (string): The ID of the browser session.
+        """
+
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Define the SQLite-backed conversation store. This is the default
+    store and keeps all sessions in a single database file.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS turns ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " session_id TEXT NOT NULL,"
+        " page TEXT NOT NULL,"
+        " role TEXT NOT NULL,"
+        " content TEXT,"
+        " modality TEXT NOT NULL DEFAULT '',"
+        " created_at TEXT NOT NULL,"
+        " tokens INTEGER);"
+        "CREATE INDEX IF NOT EXISTS turns_by_session"
+        " ON turns (session_id, page, id);"
+        "CREATE TABLE IF NOT EXISTS files ("
+        " session_id TEXT NOT NULL,"
+        " name TEXT NOT NULL,"
+        " content TEXT NOT NULL,"
+        " updated_at TEXT NOT NULL,"
+        " PRIMARY KEY (session_id, name));"
+        "CREATE TABLE IF NOT EXISTS meta ("
+        " session_id TEXT NOT NULL,"
+        " key TEXT NOT NULL,"
+        " value TEXT,"
+        " PRIMARY KEY (session_id, key));"
+    )
+
+    def __init__(self, path: str = None):
+        """Initialize a new instance of the SQLiteConversationStore class.
+        Args:
+        - path (string): The path of the database file. Defaults to the
+        CONVERSATION_DB_PATH environment variable or 'conversations.db'.
+        """
+        self.path = path or os.environ.get(
+            "CONVERSATION_DB_PATH", "conversations.db"
+        )
+        # The connection is shared by all Streamlit script threads, so ...
+        # ...every access is serialized through a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn:
+            # Let readers proceed while a turn is being written
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(self.SCHEMA)
+            # Add the token count column to databases created before it ...
+            # ...was introduced
+            columns = [
+                row[1]
+                for row in self.conn.execute("PRAGMA table_info(turns)")
+            ]
+            if "tokens" not in columns:
+                self.conn.execute(
+                    "ALTER TABLE turns ADD COLUMN tokens INTEGER"
+                )
+
+
+    def append_turns(self, session_id: str, page: str, turns: list):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO turns (session_id, page, role, content, "
+                "modality, created_at, tokens) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (session_id, page, turn.role, turn.content,
+                     turn.modality, turn.timestamp.isoformat(), turn.tokens)
+                    for turn in turns
+                ],
+            )
+
+
+    def load_turns(self, session_id: str, page: str, limit: int) -> list:
+        # A negative LIMIT would mean no limit in SQLite
+        if limit <= 0:
+            return []
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT role, content, modality, created_at, tokens "
+                "FROM turns "
+                "WHERE session_id = ? AND page = ? ORDER BY id DESC LIMIT ?",
+                (session_id, page, limit),
+            ).fetchall()
+        # Return the window in chronological order
+        return [
+            Turn(role, content, modality,
+                 datetime.fromisoformat(created_at), tokens)
+            for role, content, modality, created_at, tokens in reversed(rows)
+        ]
+
+
+    def iter_turns(self, session_id: str, page: str,
+                   batch_size: int = 500):
+        last_id = 0
+        while True:
+            # Page through the turns by ID, which stays fast however ...
+            # ...far into the conversation the batch is
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT id, role, content, modality, created_at, tokens "
+                    "FROM turns WHERE session_id = ? AND page = ? AND id > ? "
+                    "ORDER BY id LIMIT ?",
+                    (session_id, page, last_id, batch_size),
+                ).fetchall()
+            for _, role, content, modality, created_at, tokens in rows:
+                yield Turn(role, content, modality,
+                           datetime.fromisoformat(created_at), tokens)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+
+    def save_file(self, session_id: str, name: str, content: str):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files "
+                "(session_id, name, content, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, name, content, datetime.now().isoformat()),
+            )
+
+
+    def delete_file(self, session_id: str, name: str):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM files WHERE session_id = ? AND name = ?",
+                (session_id, name),
+            )
+
+
+    def clear_files(self, session_id: str):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM files WHERE session_id = ?", (session_id,)
+            )
+
+
+    def load_files(self, session_id: str) -> dict:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name, content FROM files WHERE session_id = ? "
+                "ORDER BY updated_at",
+                (session_id,),
+            ).fetchall()
+        return dict(rows)
+
+
+    def set_meta(self, session_id: str, key: str, value: str):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (session_id, key, value) "
+                "VALUES (?, ?, ?)",
+                (session_id, key, value),
+            )
+
+
+    def get_meta(self, session_id: str, key: str, default=None):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE session_id = ? AND key = ?",
+                (session_id, key),
+            ).fetchone()
+        return row[0] if row else default
+
+
+    def load_meta(self, session_id: str) -> dict:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, value FROM meta WHERE session_id = ?",
+                (session_id,),
+            ).fetchall()
+        return dict(rows)
+
+
+
+# Redis script that refreshes the expiry of every key of a session, listed ...
+# ...in the set KEYS[1], and of the set itself to ARGV[1] seconds
+TOUCH_SCRIPT = """
+for _, key in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    redis.call('EXPIRE', key, ARGV[1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+"""
+
+
+
+class RedisConversationStore(ConversationStore):
+    """Define the conversation store backed by Redis or any server that
+    speaks its protocol (such as Valkey or KeyDB). Unlike the SQLite
+    store, it can be shared by several replicas of the app, so that any
+    replica can serve any session. Requires the optional 'redis' package.
+    """
+
+    def __init__(self, url: str = None, ttl_seconds: int = None):
+        """Initialize a new instance of the RedisConversationStore class.
+        Args:
+        - url (string): The URL of the server. Defaults to the
+        CONVERSATION_REDIS_URL environment variable or a local server.
+        - ttl_seconds (int): Seconds after the last write or hydration at
+        which a session's data expires, all of its keys at once. Defaults to CONVERSATION_TTL_SECONDS or
+        30 days.
+        """
+        # Imported here so that the package is only needed by this store
+        import redis
+
+        self.client = redis.Redis.from_url(
+            url or os.environ.get(
+                "CONVERSATION_REDIS_URL", "redis://localhost:6379/0"
+            ),
+            decode_responses=True,
+        )
+        self.ttl_seconds = ttl_seconds or int(
+            os.environ.get("CONVERSATION_TTL_SECONDS", str(30 * 24 * 3600))
+        )
+        self.touch_script = self.client.register_script(TOUCH_SCRIPT)
+
+
+    def key(self, session_id: str, *parts: str) -> str:
+        """Method to build the key of a session's data structure, e.g.
+        'conversation:{session ID}:turns:{page}'.
+        Args:
+        - session_id (string): The ID of the browser session.
+        - parts (string): The kind of data and, for turns, the page.
+        Returns:
+        - str: The key.
+        """
+        return ":".join(("conversation", session_id) + parts)
+
+
+    def write(self, session_id: str, key: str, command, *args):
+        """Method to run a write command and refresh the expiry of every
+        key of the session in the same round trip, so that its turns,
+        files and metadata expire together.
+        Args:
+        - session_id (string): The ID of the browser session.
+        - key (string): The key written to.
+        - command (string): The name of the pipeline method to call.
+        - args: The arguments of the command after the key.
+        """
+        pipeline = self.client.pipeline()
+        getattr(pipeline, command)(key, *args)
+        # Remember the key among the session's keys
+        pipeline.sadd(self.key(session_id, "keys"), key)
+        self.refresh(session_id, pipeline)
+        pipeline.execute()
+
+
+    def refresh(self, session_id: str, client):
+        """Method to refresh the expiry of every key of a session.
+        Args:
+        - session_id (string): The ID of the browser session.
+        - client (redis.Redis): The client or pipeline to run it on.
+        """
+        # Sessions nobody comes back to expire instead of piling up
+        self.touch_script(
+            keys=[self.key(session_id, "keys")], args=[self.ttl_seconds],
+            client=client,
+        )
+
+
+    def touch(self, session_id: str):
+        self.refresh(session_id, self.client)
+
+
+    def append_turns(self, session_id: str, page: str, turns: list):
+        if turns:
+            self.write(
+                session_id,
+                self.key(session_id, "turns", page),
+                "rpush",
+                *[
+                    json.dumps([turn.role, turn.content, turn.modality,
+                                turn.timestamp.isoformat(), turn.tokens])
+                    for turn in turns
+                ],
+            )
+
+
+    def load_turns(self, session_id: str, page: str, limit: int) -> list:
+        # A start index of -0 would be 0 and load the whole list
+        if limit <= 0:
+            return []
+        rows = self.client.lrange(
+            self.key(session_id, "turns", page), -limit, -1
+        )
+        return [
+            Turn(role, content, modality,
+                 datetime.fromisoformat(created_at), tokens)
+            for role, content, modality, created_at, tokens
+            in map(json.loads, rows)
+        ]
+
+
+    def iter_turns(self, session_id: str, page: str,
+                   batch_size: int = 500):
+        key = self.key(session_id, "turns", page)
+        start = 0
+        while True:
+            rows = self.client.lrange(key, start, start + batch_size - 1)
+            for role, content, modality, created_at, tokens in map(
+                json.loads, rows
+            ):
+                yield Turn(role, content, modality,
+                           datetime.fromisoformat(created_at), tokens)
+            if len(rows) < batch_size:
+                return
+            start += batch_size
+
+
+    def save_file(self, session_id: str, name: str, content: str):
+        self.write(
+            session_id, self.key(session_id, "files"), "hset", name,
+            json.dumps([datetime.now().isoformat(), content]),
+        )
+
+
+    def delete_file(self, session_id: str, name: str):
+        self.write(session_id, self.key(session_id, "files"), "hdel", name)
+
+
+    def clear_files(self, session_id: str):
+        self.write(session_id, self.key(session_id, "files"), "delete")
+
+
+    def load_files(self, session_id: str) -> dict:
+        # Each file is stored as [updated_at, content]
+        files = {
+            name: json.loads(value)
+            for name, value in self.client.hgetall(
+                self.key(session_id, "files")
+            ).items()
+        }
+        # Return the files in upload order, like the SQLite store
+        return {
+            name: content
+            for name, (_, content) in sorted(
+                files.items(), key=lambda item: item[1][0]
+            )
+        }
+
+
+    def set_meta(self, session_id: str, key: str, value: str):
+        self.write(
+            session_id, self.key(session_id, "meta"), "hset", key, value
+        )
+
+
+    def get_meta(self, session_id: str, key: str, default=None):
+        value = self.client.hget(self.key(session_id, "meta"), key)
+        return default if value is None else value
+
+
+    def load_meta(self, session_id: str) -> dict:
+        return self.client.hgetall(self.key(session_id, "meta"))
+
+
+
+# Dictionary mapping the CONVERSATION_STORE setting to store classes ...
+# ...{backend name: store class}
+STORES = {"sqlite": SQLiteConversationStore, "redis": RedisConversationStore}
+
+
+def create_store() -> ConversationStore:
+    """Function that creates the conversation store selected by the
+    CONVERSATION_STORE environment variable, SQLite by default.
+    Returns:
+    - ConversationStore: The store.
+    """
+    return STORES[os.environ.get("CONVERSATION_STORE", "sqlite")]()
@@ -0,0 +1,152 @@
+import hashlib
+import html
+import os
+import threading
+from collections import OrderedDict
+
+
+# Memory budget of the rendered messages kept for reruns, in megabytes
+RENDER_CACHE_MB = float(os.environ.get("RENDER_CACHE_MB", "32"))
+# Pygments style of the highlighted code blocks, chosen to suit the dark ...
+# ...theme of the apps
+CODE_STYLE = os.environ.get("CODE_STYLE", "monokai")
+# Code blocks longer than this are shown without highlighting, as ...
+# ...lexing them would hold up the rerun
+MAX_HIGHLIGHT_CHARS = 200000
+
+
+
+def content_key(text: str) -> str:
+    """Function that computes the cache key of a message.
+    Args:
+    - text (string): The markdown of the message.
+    Returns:
+    - str: The SHA-1 hex digest of the message.
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+
+class MarkdownRenderer:
+    """Define the class for rendering chat messages from markdown to HTML
+    on the server, with code blocks highlighted by Pygments, and caching
+    the HTML by content hash. Past messages never change, so each one is
+    rendered once per process, and a rerun sends exactly the same HTML as
+    the previous one, which Streamlit's message cache can then skip.
+    """
+
+    def __init__(self, budget_mb: float = RENDER_CACHE_MB,
+                 style: str = CODE_STYLE):
+        """Initialize a new instance of the MarkdownRenderer class.
+        Args:
+        - budget_mb (float): The memory budget of the cache, in megabytes.
+        - style (string): The Pygments style of code blocks.
+        """
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.style = style
+        self.lock = threading.Lock()
+        # {content hash: HTML}, least recently used first
+        self.cache = OrderedDict()
+        # Total length of the cached HTML, in characters
+        self.size = 0
+        # Number of messages found in and missing from the cache
+        self.hits = 0
+        self.misses = 0
+        # The markdown parser and the code formatter, created on first use
+        self.parser = None
+        self.formatter = None
+
+
+    def render(self, text: str) -> str:
+        """Method to get the HTML of a message, rendering it on a miss.
+        Args:
+        - text (string): The markdown of the message.
+        Returns:
+        - str: The HTML, on a single line so that Streamlit's markdown
+        parser passes it through as one raw HTML block.
+        """
+        key = content_key(text)
+        with self.lock:
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            self.misses += 1
+        # Render outside the lock, so that sessions do not wait for each ...
+        # ...other; a message rendered twice at once is cached once
+        rendered = self.to_html(text)
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = rendered
+                self.size += len(rendered)
+            while self.size > self.budget and len(self.cache) > 1:
+                _, stale = self.cache.popitem(last=False)
+                self.size -= len(stale)
+        return rendered
+
+
+    def to_html(self, text: str) -> str:
+        """Method to render markdown to HTML.
+        Args:
+        - text (string): The markdown.
+        Returns:
+        - str: The HTML on a single line.
+        """
+        if self.parser is None:
+            # Imported on first use to keep the pages' cold start fast
+            from markdown_it import MarkdownIt
+            from pygments.formatters import HtmlFormatter
+
+            # Raw HTML in messages is escaped rather than rendered
+            self.parser = MarkdownIt(
+                "commonmark", {"html": False, "highlight": self.highlight}
+            ).enable(["table", "strikethrough"])
+            self.formatter = HtmlFormatter(
+                style=self.style, noclasses=True, nowrap=True
+            )
+        rendered = self.parser.render(text)
+        # Line breaks are only significant inside code blocks, where the ...
+        # ...character reference keeps them; elsewhere it is whitespace
+        return "<div>{}</div>".format(
+            rendered.rstrip("\n").replace("\n", "&#10;")
+        )
+
+
+    def highlight(self, code: str, lang: str, attrs: str) -> str:
+        """Method to highlight a fenced code block, called by the markdown
+        parser.
+        Args:
+        - code (string): The code.
+        - lang (string): The language of the fence, e.g. 'python'.
+        - attrs (string): The other attributes of the fence.
+        Returns:
+        - str: The <pre> block of the code.
+        """
+        from pygments import highlight
+        from pygments.lexers import get_lexer_by_name
+        from pygments.util import ClassNotFound
+
+        body = html.escape(code)
+        # Blocks without a known language are shown as plain text
+        if lang and len(code) <= MAX_HIGHLIGHT_CHARS:
+            try:
+                body = highlight(
+                    code, get_lexer_by_name(lang), self.formatter
+                )
+            except ClassNotFound:
+                pass
+        return (
+            "<pre style=\"background-color: {}; padding: 0.8em; "
+            "border-radius: 0.5em; overflow-x: auto\"><code>{}</code></pre>"
+        ).format(self.formatter.style.background_color, body)
+
+
+    def stats(self) -> dict:
+        """Method to report the use of the cache.
+        Returns:
+        - dict: The number of 'messages' cached, their 'size' in
+        characters, and the cache 'hits' and 'misses'.
+        """
+        with self.lock:
+            return {"messages": len(self.cache), "size": self.size,
+                    "hits": self.hits, "misses": self.misses}
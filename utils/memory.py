@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from utils.turns import TurnLog
+
+
+# Memory budget of a session in megabytes, or 0 for no budget
+SESSION_MEMORY_BUDGET_MB = float(
+    os.environ.get("SESSION_MEMORY_BUDGET_MB", "0")
+)
+# Seconds between two budget checks of the same session, as measuring a ...
+# ...session walks all of its objects
+MEMORY_CHECK_SECONDS = int(os.environ.get("MEMORY_CHECK_SECONDS", "60"))
+# Number of memory samples kept for the growth history
+HISTORY_SAMPLES = 240
+# Number of stack frames recorded per allocation while tracing
+TRACE_FRAMES = 1
+# Number of turns always kept in memory when a session is over budget
+MIN_TURNS = 10
+# Session state keys holding caches that the pages rebuild on demand, ...
+# ...which are evicted before any turn
+DISPOSABLE_KEYS = ["retrieval-index", "comparison"]
+
+
+
+def state_sizes(state) -> dict:
+    """Function that measures the deep size of each key of a session's
+    state. Objects shared between keys are counted under each of them.
+    Args:
+    - state (dict): The session state, as {key: value}.
+    Returns:
+    - dict: {key: size in bytes}, largest first.
+    """
+    # Imported on first use, as only the budget checks and the admin ...
+    # ...panel measure sessions
+    from pympler import asizeof
+
+    sizes = {key: asizeof.asizeof(value) for key, value in state.items()}
+    return dict(sorted(sizes.items(), key=lambda item: -item[1]))
+
+
+def process_rss() -> int:
+    """Function that reads the resident set size of the server process.
+    Returns:
+    - int: The current RSS in bytes, or the peak RSS where the current one
+    is not available, or 0 if neither is.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        # Not available on Windows
+        import resource
+    except ImportError:
+        return 0
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def enforce_budget(state, budget: int) -> dict:
+    """Function that brings a session under its memory budget, dropping
+    the caches the pages can rebuild first, then the oldest half of the
+    persisted turns of its turn logs until it fits or only MIN_TURNS are
+    left in each log.
+    Args:
+    - state: The session state object.
+    - budget (int): The budget in bytes.
+    Returns:
+    - dict: {key: number of turns dropped, or None for a dropped cache},
+    empty if the session was within its budget.
+    """
+    evicted = {}
+    # Streamlit's session state exposes its user keys as 'filtered_state'
+    values = dict(getattr(state, "filtered_state", state))
+    if sum(state_sizes(values).values()) <= budget:
+        return evicted
+    for key in DISPOSABLE_KEYS:
+        if key in values:
+            del state[key]
+            del values[key]
+            evicted[key] = None
+    while sum(state_sizes(values).values()) > budget:
+        dropped = 0
+        for key, value in values.items():
+            if isinstance(value, TurnLog) and len(value) > MIN_TURNS:
+                count = value.trim((len(value) - MIN_TURNS + 1) // 2)
+                evicted[key] = evicted.get(key, 0) + count
+                dropped += count
+        # Nothing more can be dropped
+        if not dropped:
+            break
+    return evicted
+
+
+
+class MemoryProfiler:
+    """Define the class that accounts for the memory of the server
+    process: per-session sizes for the admin panel, the growth of the
+    process over time, the top allocators traced by tracemalloc, and the
+    per-session budget.
+    """
+
+    def __init__(self):
+        """Initialize a new instance of the MemoryProfiler class.
+        """
+        self.lock = threading.Lock()
+        # (time, RSS, total size of the sessions, number of sessions), ...
+        # ...oldest first
+        self.history = deque(maxlen=HISTORY_SAMPLES)
+        # {session ID: time of the last budget check}
+        self.checked = {}
+        # Snapshot of the previous allocator report, to compute growth
+        self.snapshot = None
+        # Evictions triggered by the budget: {'sessions', 'turns', ...
+        # ...'caches'}
+        self.evictions = {"sessions": 0, "turns": 0, "caches": 0}
+
+
+    def check(self, session_id: str, state,
+              budget_mb: float = SESSION_MEMORY_BUDGET_MB) -> dict:
+        """Method to enforce the memory budget of a session, at most every
+        MEMORY_CHECK_SECONDS.
+        Args:
+        - session_id (string): The ID of the browser session.
+        - state: The session state object.
+        - budget_mb (float): The budget in megabytes, or 0 for none.
+        Returns:
+        - dict: {key: number of turns dropped, or None for a dropped
+        cache}.
+        """
+        if not budget_mb:
+            return {}
+        now = time.monotonic()
+        with self.lock:
+            if now - self.checked.get(session_id, -MEMORY_CHECK_SECONDS) \
+                    < MEMORY_CHECK_SECONDS:
+                return {}
+            self.checked[session_id] = now
+        evicted = enforce_budget(state, int(budget_mb * 1024 * 1024))
+        if evicted:
+            with self.lock:
+                self.evictions["sessions"] += 1
+                for count in evicted.values():
+                    if count is None:
+                        self.evictions["caches"] += 1
+                    else:
+                        self.evictions["turns"] += count
+            # Report the eviction on the console
+            print("Session {} is over its memory budget, evicted {}".format(
+                session_id, evicted
+            ))
+        return evicted
+
+
+    def check_all(self, sessions: dict,
+                  budget_mb: float = SESSION_MEMORY_BUDGET_MB) -> int:
+        """Method to enforce the memory budget of several sessions, such as
+        the idle ones, which no script run checks.
+        Args:
+        - sessions (dict): {session ID: session state object}.
+        - budget_mb (float): The budget in megabytes, or 0 for none.
+        Returns:
+        - int: The number of sessions that were over their budget.
+        """
+        if not budget_mb:
+            return 0
+        return sum(
+            1 for session_id, state in sessions.items()
+            if self.check(session_id, state, budget_mb)
+        )
+
+
+    def sample(self, sessions: dict) -> dict:
+        """Method to measure every session and record a sample of the
+        growth history.
+        Args:
+        - sessions (dict): {session ID: session state as a dict}.
+        Returns:
+        - dict: {session ID: {key: size in bytes}}.
+        """
+        sizes = {
+            session_id: state_sizes(state)
+            for session_id, state in sessions.items()
+        }
+        with self.lock:
+            self.history.append((
+                time.time(),
+                process_rss(),
+                sum(sum(keys.values()) for keys in sizes.values()),
+                len(sizes),
+            ))
+            # Forget the sessions that are gone
+            for session_id in list(self.checked):
+                if session_id not in sessions:
+                    del self.checked[session_id]
+        return sizes
+
+
+    @staticmethod
+    def tracing() -> bool:
+        """Method to tell whether allocations are being traced.
+        """
+        return tracemalloc.is_tracing()
+
+
+    def start_tracing(self):
+        """Method to start tracing allocations. Tracing slows the server
+        down, so it only runs while an admin is looking at allocators.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            self.snapshot = None
+
+
+    def stop_tracing(self):
+        """Method to stop tracing allocations and free the traces.
+        """
+        tracemalloc.stop()
+        self.snapshot = None
+
+
+    def top_allocators(self, limit: int = 15) -> tuple:
+        """Method to report the source lines holding the most memory
+        allocated since tracing started, and their growth since the
+        previous report.
+        Args:
+        - limit (int): The number of lines to report.
+        Returns:
+        - tuple: (top lines, top growing lines), each a list of
+        (location, size in bytes, size change in bytes, count) tuples.
+        """
+        if not tracemalloc.is_tracing():
+            return [], []
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        top = [
+            (str(stat.traceback), stat.size, 0, stat.count)
+            for stat in snapshot.statistics("lineno")[:limit]
+        ]
+        growth = []
+        if self.snapshot is not None:
+            growth = [
+                (str(stat.traceback), stat.size, stat.size_diff, stat.count)
+                for stat in snapshot.compare_to(self.snapshot, "lineno")
+                if stat.size_diff > 0
+            ][:limit]
+        self.snapshot = snapshot
+        return top, growth
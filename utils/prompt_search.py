@@ -0,0 +1,265 @@
+import bisect
+import heapq
+import os
+import re
+from array import array
+from collections import Counter
+from operator import itemgetter
+
+
+# CSV file of built-in prompts with 'act' and 'prompt' columns
+PROMPT_CATALOG_URL = os.environ.get(
+    "PROMPT_CATALOG_URL",
+    "https://raw.githubusercontent.com/f/awesome-chatgpt-prompts/main/"
+    "prompts.csv",
+)
+# Maximum number of matches offered for a search
+SEARCH_LIMIT = int(os.environ.get("PROMPT_SEARCH_LIMIT", "50"))
+# Minimum share of trigrams an act name must have in common with a ...
+# ...misspelled query to match it
+MIN_SIMILARITY = 0.3
+# Trigrams shared by more act names than this are too common to tell ...
+# ...matches apart, and are skipped so that a fuzzy search costs the same ...
+# ...on catalogs of any size
+MAX_POSTINGS = 1000
+# Number of act names sharing the most trigrams with a query that are ...
+# ...ranked by similarity, per match wanted
+SIMILAR_CANDIDATES = 4
+# Words found in more than this share of the prompts, such as 'act' or ...
+# ...'you', narrow a search too little to be worth indexing
+STOP_SHARE = 0.5
+# Runs of characters that separate words
+SEPARATORS = re.compile(r"[^0-9a-z]+")
+
+
+
+def normalize(text: str) -> str:
+    """Function that reduces a text to lowercase words separated by single
+    spaces, so that punctuation and case do not affect matching.
+    Args:
+    - text (string): The text.
+    Returns:
+    - str: The normalized text.
+    """
+    return SEPARATORS.sub(" ", str(text).lower()).strip()
+
+
+def trigrams(text: str) -> set:
+    """Function that splits a normalized text into overlapping sequences
+    of three characters, padded so that the first and last letters count.
+    Args:
+    - text (string): The normalized text.
+    Returns:
+    - set: The trigrams.
+    """
+    padded = " {} ".format(text)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)} if text \
+        else set()
+
+
+class PromptIndex:
+    """Define the class for a search index over a catalog of built-in
+    prompts, built once so that each search only touches the entries that
+    can match. Act names are matched by prefix, by the prefix of any of
+    their words and, for misspelled queries, by trigram similarity; prompt
+    texts are matched by whole words. Matches come ranked in that order,
+    then alphabetically.
+    """
+
+    def __init__(self, acts, prompts):
+        """Initialize a new instance of the PromptIndex class.
+        Args:
+        - acts (iterable): The act names, e.g. 'Linux Terminal'.
+        - prompts (iterable): The prompt of each act.
+        """
+        # Keep the first prompt of each act, sorted by normalized name so ...
+        # ...that IDs follow alphabetical order
+        catalog = {}
+        for act, prompt in zip(acts, prompts):
+            catalog.setdefault(str(act), str(prompt))
+        entries = sorted(catalog.items(), key=lambda item: (
+            normalize(item[0]), item[0]
+        ))
+        self.acts = [act for act, _ in entries]
+        self.prompts = dict(entries)
+        self.names = [normalize(act) for act in self.acts]
+        # Every word-initial suffix of every name, sorted for prefix ...
+        # ...lookups by bisection
+        suffixes = sorted(
+            (name[start:], id_)
+            for id_, name in enumerate(self.names)
+            for start in [0] + [
+                i + 1 for i, char in enumerate(name) if char == " "
+            ]
+        )
+        self.suffixes = [suffix for suffix, _ in suffixes]
+        self.suffix_ids = array("I", [id_ for _, id_ in suffixes])
+        # Posting lists of IDs sorted in ascending order, stored as ...
+        # ...arrays of 4-byte integers to keep large catalogs compact
+        grams = {}
+        words = {}
+        self.gram_counts = array("H")
+        for id_, name in enumerate(self.names):
+            name_grams = trigrams(name)
+            self.gram_counts.append(min(len(name_grams), 0xFFFF))
+            for gram in name_grams:
+                grams.setdefault(gram, array("I")).append(id_)
+            for word in set(normalize(self.prompts[self.acts[id_]]).split()):
+                words.setdefault(word, array("I")).append(id_)
+        self.grams = grams
+        self.common = {
+            word for word, postings in words.items()
+            if len(postings) > STOP_SHARE * len(self.acts)
+        }
+        self.words = {
+            word: postings for word, postings in words.items()
+            if word not in self.common
+        }
+
+
+    def __len__(self) -> int:
+        return len(self.acts)
+
+
+    def prompt(self, act: str) -> str:
+        """Method to get the prompt of an act.
+        Args:
+        - act (string): The act name.
+        Returns:
+        - str: The prompt, or None if the act is not in the catalog.
+        """
+        return self.prompts.get(act)
+
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> list:
+        """Method to find the acts that best match a query. Each stage only
+        touches the index entries that can match, and later stages are
+        skipped once enough matches have been found.
+        Args:
+        - query (string): What the user typed.
+        - limit (int): The maximum number of matches.
+        Returns:
+        - list: The matching act names, best first; the first acts in
+        alphabetical order if the query is empty.
+        """
+        query = normalize(query)
+        if not query:
+            return self.acts[:limit]
+        found = []
+        seen = set()
+
+        def add(ids) -> bool:
+            # Collect new IDs and tell whether enough have been found
+            for id_ in ids:
+                if id_ not in seen:
+                    seen.add(id_)
+                    found.append(id_)
+                    if len(found) >= limit:
+                        return True
+            return False
+
+        if (
+            add(self.prefixed(self.names, range(len(self.names)), query))
+            or add(self.prefixed(self.suffixes, self.suffix_ids, query))
+            or add(self.containing(query.split(), limit))
+        ):
+            return [self.acts[id_] for id_ in found]
+        add(self.similar(query, limit, seen))
+        return [self.acts[id_] for id_ in found]
+
+
+    @staticmethod
+    def prefixed(keys: list, ids, prefix: str):
+        """Method to iterate over the IDs of the sorted keys that start
+        with a prefix.
+        Args:
+        - keys (list): The sorted keys.
+        - ids (sequence): The ID of each key.
+        - prefix (string): The normalized prefix.
+        Yields:
+        - int: The IDs, in the order of their keys.
+        """
+        i = bisect.bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            yield ids[i]
+            i += 1
+
+
+    def containing(self, words: list, limit: int) -> list:
+        """Method to find the prompts that contain all the words, except
+        those too common to be indexed.
+        Args:
+        - words (list): The normalized words.
+        - limit (int): The maximum number of matches.
+        Returns:
+        - list: The IDs, in alphabetical order of their acts.
+        """
+        # A word found in no prompt rules every prompt out, while a word ...
+        # ...too common to be indexed rules none out
+        if any(
+            word not in self.words and word not in self.common
+            for word in words
+        ):
+            return []
+        # Walk the shortest posting list, as the intersection cannot be ...
+        # ...longer, in ID order (i.e. alphabetical order) and stop at ...
+        # ...the limit, so that the cost does not grow with the catalog
+        postings = sorted(
+            (self.words[word] for word in set(words) if word in self.words),
+            key=len,
+        )
+        if not postings:
+            return []
+        shortest, others = postings[0], postings[1:]
+        if not others:
+            return list(shortest[:limit])
+        # Position reached in each other list, which only moves forward ...
+        # ...as the IDs ascend
+        starts = [0] * len(others)
+        matched = []
+        for id_ in shortest:
+            for i, other in enumerate(others):
+                starts[i] = bisect.bisect_left(other, id_, starts[i])
+                # No later ID can be in a list walked to its end
+                if starts[i] == len(other):
+                    return matched
+                if other[starts[i]] != id_:
+                    break
+            else:
+                matched.append(id_)
+                if len(matched) >= limit:
+                    break
+        return matched
+
+
+    def similar(self, query: str, limit: int, exclude: set) -> list:
+        """Method to find the act names closest to a possibly misspelled
+        query by the share of trigrams they have in common.
+        Args:
+        - query (string): The normalized query.
+        - limit (int): The maximum number of matches.
+        - exclude (set): IDs already matched.
+        Returns:
+        - list: The IDs, most similar first.
+        """
+        query_grams = trigrams(query)
+        shared = Counter()
+        for gram in query_grams:
+            postings = self.grams.get(gram, ())
+            if len(postings) <= MAX_POSTINGS:
+                shared.update(postings)
+        # Only the names sharing the most trigrams can be the most ...
+        # ...similar, so score those alone
+        candidates = heapq.nlargest(
+            SIMILAR_CANDIDATES * (limit + len(exclude)), shared.items(),
+            key=itemgetter(1),
+        )
+        scores = [
+            # Jaccard similarity of the two sets of trigrams
+            (count / (len(query_grams) + self.gram_counts[id_] - count), id_)
+            for id_, count in candidates if id_ not in exclude
+        ]
+        best = heapq.nlargest(limit, scores, key=lambda score: (
+            score[0], -score[1]
+        ))
+        return [id_ for score, id_ in best if score >= MIN_SIMILARITY]
@@ -0,0 +1,118 @@
+def persona_instructions(persona: str) -> str:
+    """Function that builds the system instructions of a built-in persona.
+    Args:
+    - persona (string): The role selected by the user, e.g. 'a Linux
+    Terminal'.
+    Returns:
+    - str: The instructions, or an empty string if there is no persona.
+    """
+    return "You are {}".format(persona) if persona else ""
+
+
+def assemble_messages(turns, instructions: str = "", persona: str = "",
+                      user_message: str = None) -> list:
+    """Function that builds the 'messages' parameter of a chat completion
+    request with the content that stays the same between requests first:
+    the instructions, then the persona, then the conversation so far, and
+    finally the new user turn. Requests then share the longest possible
+    prefix, which is what the provider's prompt cache reuses.
+    Args:
+    - turns (TurnLog): The conversation so far.
+    - instructions (string): Fixed system instructions, if any.
+    - persona (string): The built-in persona selected by the user, if any.
+    - user_message (string): A new user message not in the log yet.
+    Returns:
+    - list: {'role', 'content'} dictionaries.
+    """
+    system = "\n\n".join(
+        part for part in (instructions, persona_instructions(persona))
+        if part
+    )
+    messages = [{"role": "system", "content": system}] if system else []
+    # System messages logged by older versions of the app are replaced ...
+    # ...by the single leading system message
+    messages += [
+        message for message in turns.payload()
+        if message["role"] != "system"
+    ]
+    if user_message is not None:
+        messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+def assemble_user_message(request: str, *context: str) -> str:
+    """Function that builds a user message with its context, such as code
+    files, placed before the request, so that the same files followed by
+    different requests share a prefix.
+    Args:
+    - request (string): What the user asks for.
+    - context (string): The context parts, from the most to the least
+    stable. Empty parts are skipped.
+    Returns:
+    - str: The user message.
+    """
+    return "  \n".join([part for part in context if part] + [request])
+
+
+def cached_tokens(usage) -> int:
+    """Function that reads the number of prompt tokens served from the
+    provider's prompt cache.
+    Args:
+    - usage: The 'usage' of a chat completion or an Assistants run, or
+    None.
+    Returns:
+    - int: The number of cached prompt tokens, 0 if not reported.
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    # Older client versions keep unknown fields as plain dictionaries
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", 0) or 0
+
+
+
+class PrefixCacheStats:
+    """Define the class that accumulates the prompt tokens of a session
+    and the share of them served from the provider's prompt cache.
+    """
+
+    __slots__ = ("prompt_tokens", "cached_tokens")
+
+    def __init__(self):
+        """Initialize a new instance of the PrefixCacheStats class.
+        """
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+
+    def record(self, usage) -> str:
+        """Method to add the usage of a request to the totals.
+        Args:
+        - usage: The 'usage' of a chat completion or an Assistants run, or
+        None.
+        Returns:
+        - str: A report of the cache hit rate of the request and of the
+        session, or an empty string if no usage was reported.
+        """
+        if usage is None or not usage.prompt_tokens:
+            return ""
+        cached = cached_tokens(usage)
+        self.prompt_tokens += usage.prompt_tokens
+        self.cached_tokens += cached
+        return (
+            "Prompt cache: {:,} of {:,} prompt tokens cached ({:.0%}); "
+            "{:.0%} this session.".format(
+                cached, usage.prompt_tokens, cached / usage.prompt_tokens,
+                self.hit_rate(),
+            )
+        )
+
+
+    def hit_rate(self) -> float:
+        """Method to get the share of prompt tokens served from the cache.
+        Returns:
+        - float: The hit rate between 0 and 1.
+        """
+        if not self.prompt_tokens:
+            return 0.0
+        return self.cached_tokens / self.prompt_tokens
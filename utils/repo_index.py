@@ -0,0 +1,385 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+
+# Folder holding the shallow clones and the indexes of the repositories
+REPO_CACHE_DIR = os.environ.get("REPO_CACHE_DIR", ".repo_cache")
+# Whether paths on the server may be indexed, besides remote URLs
+ALLOW_LOCAL_PATHS = os.environ.get("REPO_ALLOW_LOCAL_PATHS", "") == "1"
+# Maximum disk space of one clone, in megabytes, beyond which it is dropped
+REPO_MAX_MB = float(os.environ.get("REPO_MAX_MB", "200"))
+# Number of repositories kept in the cache, least recently used dropped first
+REPO_CACHE_MAX_CLONES = int(os.environ.get("REPO_CACHE_MAX_CLONES", "20"))
+# Maximum duration of a clone or a fetch, in seconds
+REPO_CLONE_TIMEOUT_SECONDS = int(
+    os.environ.get("REPO_CLONE_TIMEOUT_SECONDS", "300")
+)
+# Seconds between two checks of the size of a clone in progress
+CLONE_POLL_SECONDS = 0.5
+# Maximum number of characters of repository context added to a prompt
+MAX_CONTEXT_CHARS = int(os.environ.get("REPO_CONTEXT_CHARS", "24000"))
+# Maximum number of characters of the summary of a single file
+MAX_FILE_SUMMARY_CHARS = 800
+# Files larger than this are listed in the manifest but not summarized
+MAX_FILE_BYTES = 512 * 1024
+# Number of indexes kept per repository, newest first
+KEEP_INDEXES = 3
+# Files that describe the project as a whole and are summarized first
+KEY_FILES = re.compile(
+    r"^(readme|license|copying|requirements|setup|pyproject|package|"
+    r"cargo|go\.mod|pom|build\.gradle|dockerfile|makefile|environment)",
+    re.IGNORECASE,
+)
+# Top-level definitions of common programming languages
+DEFINITION = re.compile(
+    r"^(?:export\s+)?(?:default\s+)?(?:pub\s+)?(?:async\s+)?"
+    r"(?:def|class|function|func|fn|struct|interface|enum|trait|module|"
+    r"(?:public\s+)?(?:abstract\s+)?(?:final\s+)?class)\b[^\n]*",
+    re.MULTILINE,
+)
+# Headings of Markdown and reStructuredText documents
+HEADING = re.compile(r"^#{1,3} [^\n]*", re.MULTILINE)
+# Number of leading lines used to summarize files without definitions
+HEAD_LINES = 8
+
+
+
+class RepoIndexError(Exception):
+    """Raised when a repository cannot be cloned, fetched or read.
+    """
+
+
+
+# {cache folder: lock held while the repository is cloned or indexed}
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+
+def folder_lock(folder: str) -> threading.Lock:
+    """Function that returns the lock of a cache folder, so that sessions
+    indexing the same repository wait for each other.
+    Args:
+    - folder (string): The cache folder of the repository.
+    Returns:
+    - threading.Lock: The lock of the folder.
+    """
+    with _locks_lock:
+        return _locks.setdefault(folder, threading.Lock())
+
+
+def disk_usage(path: str) -> int:
+    """Function that returns the size of the files under a folder.
+    Args:
+    - path (string): The folder.
+    Returns:
+    - int: The size in bytes.
+    """
+    size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                # Git moved or removed the file while it was being counted
+                pass
+    return size
+
+
+def run_git(process, watched: str):
+    """Function that waits for a git command, stopping it if it writes more
+    than REPO_MAX_MB into a folder or runs for too long.
+    Args:
+    - process (git.cmd.Git.AutoInterrupt): The running command.
+    - watched (string): The folder the command writes to.
+    """
+    deadline = time.monotonic() + REPO_CLONE_TIMEOUT_SECONDS
+    while process.poll() is None:
+        time.sleep(CLONE_POLL_SECONDS)
+        if disk_usage(watched) > REPO_MAX_MB * 1024 * 1024:
+            error = "The repository is larger than {:g} MB.".format(
+                REPO_MAX_MB
+            )
+        elif time.monotonic() > deadline:
+            error = "The repository took too long to download."
+        else:
+            continue
+        process.terminate()
+        process.proc.wait()
+        raise RepoIndexError(error)
+    # Raises a GitCommandError if the command failed
+    process.wait()
+
+
+def evict_clones(keep: str):
+    """Function that removes the least recently used repositories from the
+    cache until at most REPO_CACHE_MAX_CLONES remain. Repositories being
+    cloned or indexed by another session are left alone.
+    Args:
+    - keep (string): The cache folder of the repository in use.
+    """
+    try:
+        names = os.listdir(REPO_CACHE_DIR)
+    except FileNotFoundError:
+        return
+    folders = sorted(
+        (
+            os.path.join(REPO_CACHE_DIR, name) for name in names
+            if os.path.isdir(os.path.join(REPO_CACHE_DIR, name))
+            and os.path.join(REPO_CACHE_DIR, name) != keep
+        ),
+        key=os.path.getmtime,
+    )
+    for folder in folders[:max(len(folders) + 1 - REPO_CACHE_MAX_CLONES, 0)]:
+        lock = folder_lock(folder)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            shutil.rmtree(folder, ignore_errors=True)
+        finally:
+            lock.release()
+
+
+def cache_dir(source: str) -> str:
+    """Function that returns the cache folder of a repository.
+    Args:
+    - source (string): The URL or local path of the repository.
+    Returns:
+    - str: The cache folder, named after a hash of the source.
+    """
+    key = hashlib.sha1(source.strip().rstrip("/").encode()).hexdigest()[:16]
+    return os.path.join(REPO_CACHE_DIR, key)
+
+
+def snapshot(source: str):
+    """Function that resolves the latest commit of a repository, making
+    or updating a shallow bare clone of remote repositories. The caller
+    holds the lock of the repository's cache folder.
+    Args:
+    - source (string): The HTTPS URL or local path of the repository.
+    Returns:
+    - git.Commit: The commit to index.
+    """
+    # Imported on first use to keep the page's cold start light
+    from git import Git, Repo
+    from git.exc import GitError
+
+    try:
+        if os.path.isdir(source):
+            if not ALLOW_LOCAL_PATHS:
+                raise RepoIndexError(
+                    "Indexing local paths is disabled on this server."
+                )
+            return Repo(source).head.commit
+        if not source.startswith("https://"):
+            raise RepoIndexError("Please enter an HTTPS URL.")
+        folder = cache_dir(source)
+        clone = os.path.join(folder, "clone.git")
+        if not os.path.isdir(clone):
+            # Only the latest commit is needed, without a working tree. ...
+            # ...It is cloned next to its final place and moved there ...
+            # ...once complete, so that no partial clone is ever reused
+            os.makedirs(folder, exist_ok=True)
+            temporary = tempfile.mkdtemp(prefix="clone-", dir=folder)
+            try:
+                run_git(
+                    Git(folder).clone(
+                        source, temporary, depth=1, bare=True,
+                        as_process=True,
+                    ),
+                    temporary,
+                )
+                os.rename(temporary, clone)
+            finally:
+                shutil.rmtree(temporary, ignore_errors=True)
+            return Repo(clone).head.commit
+        repo = Repo(clone)
+        try:
+            run_git(
+                repo.git.fetch(
+                    "--depth=1", "origin", "HEAD", as_process=True
+                ),
+                clone,
+            )
+        except RepoIndexError:
+            # The repository outgrew the limit, so it is cloned anew next time
+            shutil.rmtree(clone, ignore_errors=True)
+            raise
+        return repo.commit("FETCH_HEAD")
+    except (GitError, ValueError, OSError) as error:
+        raise RepoIndexError(str(error)) from error
+
+
+def summarize_file(path: str, data: bytes) -> str:
+    """Function that summarizes a file locally, without calling any API.
+    Args:
+    - path (string): The path of the file in the repository.
+    - data (bytes): The content of the file.
+    Returns:
+    - str: The summary, at most MAX_FILE_SUMMARY_CHARS long.
+    """
+    if b"\0" in data[:8192]:
+        return "(binary file)"
+    text = data.decode("utf-8", errors="replace")
+    name = os.path.basename(path)
+    if name.lower().startswith(("license", "copying")):
+        # The first line names the license
+        summary = text.strip().split("\n", 1)[0]
+    elif KEY_FILES.match(name):
+        # Project files are short and worth reading as they are
+        summary = text.strip()
+    elif name.lower().endswith((".md", ".rst")):
+        summary = "\n".join(HEADING.findall(text))
+    else:
+        summary = "\n".join(
+            line.rstrip(" {:") for line in DEFINITION.findall(text)
+        )
+    if not summary:
+        summary = "\n".join(
+            line for line in text.strip().splitlines()[:HEAD_LINES]
+        )
+    if len(summary) > MAX_FILE_SUMMARY_CHARS:
+        summary = summary[:MAX_FILE_SUMMARY_CHARS].rstrip() + "\n..."
+    return summary
+
+
+def build_index(commit, previous: dict = None) -> tuple:
+    """Function that builds the manifest and the file summaries of a
+    commit, re-summarizing only the files whose content changed since the
+    previous index.
+    Args:
+    - commit (git.Commit): The commit to index.
+    - previous (dict): An earlier index of the same repository, or None.
+    Returns:
+    - tuple: (index, number of files summarized anew).
+    """
+    known = (previous or {}).get("files", {})
+    files = {}
+    reindexed = 0
+    for blob in commit.tree.traverse():
+        if blob.type != "blob":
+            continue
+        entry = known.get(blob.path)
+        # Unchanged content has the same blob SHA, so its summary is reused
+        if entry is None or entry["blob"] != blob.hexsha:
+            summary = (
+                "(large file)" if blob.size > MAX_FILE_BYTES
+                else summarize_file(blob.path, blob.data_stream.read())
+            )
+            entry = {"blob": blob.hexsha, "size": blob.size,
+                     "summary": summary}
+            reindexed += 1
+        files[blob.path] = entry
+    return {"sha": commit.hexsha, "files": files}, reindexed
+
+
+def index_commit(source: str, folder: str) -> tuple:
+    """Function that indexes the latest commit of a repository, under the
+    lock of its cache folder.
+    Args:
+    - source (string): The HTTPS URL or local path of the repository.
+    - folder (string): The cache folder of the repository.
+    Returns:
+    - tuple: (index, number of files summarized anew).
+    """
+    commit = snapshot(source)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, "index-{}.json".format(commit.hexsha))
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f), 0
+    # Start from the newest index of the repository, if any
+    cached = sorted(
+        (
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if name.startswith("index-") and name.endswith(".json")
+        ),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    previous = None
+    if cached:
+        with open(cached[0]) as f:
+            previous = json.load(f)
+    index, reindexed = build_index(commit, previous)
+    index["source"] = source
+    index["indexed_at"] = time.time()
+    # Write atomically so that concurrent sessions never read a partial file
+    temporary = "{}.{}.tmp".format(path, threading.get_ident())
+    with open(temporary, "w") as f:
+        json.dump(index, f)
+    os.replace(temporary, path)
+    for old in cached[KEEP_INDEXES - 1:]:
+        os.remove(old)
+    return index, reindexed
+
+
+def load_index(source: str) -> tuple:
+    """Function that returns the index of the latest commit of a
+    repository, from the cache when that commit has been indexed before.
+    Args:
+    - source (string): The HTTPS URL or local path of the repository.
+    Returns:
+    - tuple: (index, number of files summarized anew).
+    """
+    folder = cache_dir(source)
+    try:
+        with folder_lock(folder):
+            index, reindexed = index_commit(source, folder)
+            # Mark the repository as recently used
+            os.utime(folder)
+    finally:
+        # Make room in the cache, even after a failed clone
+        evict_clones(folder)
+    return index, reindexed
+
+
+def build_repo_context(index: dict,
+                       max_chars: int = MAX_CONTEXT_CHARS) -> str:
+    """Function that renders an index as prompt context: the manifest of
+    the files, then as many file summaries as fit, project files and
+    shallow paths first.
+    Args:
+    - index (dict): The index of the repository.
+    - max_chars (int): The maximum length of the context.
+    Returns:
+    - str: The repository context.
+    """
+    files = index["files"]
+    header = "Snapshot of {} at commit {} ({} files).".format(
+        index.get("source", "the repository"), index["sha"][:7], len(files)
+    )
+    manifest = ["File manifest:"]
+    used = len(header)
+    for number, (path, entry) in enumerate(sorted(files.items())):
+        line = "- {} ({:,} bytes)".format(path, entry["size"])
+        # Keep at most half of the budget for the manifest
+        if used + len(line) > max_chars // 2:
+            manifest.append("- ... and {} more files".format(
+                len(files) - number
+            ))
+            break
+        manifest.append(line)
+        used += len(line) + 1
+    summaries = ["File summaries:"]
+    ordered = sorted(
+        files,
+        key=lambda path: (
+            not KEY_FILES.match(os.path.basename(path)),
+            path.count("/"),
+            path,
+        ),
+    )
+    for path in ordered:
+        block = "### {}\n{}".format(path, files[path]["summary"])
+        if used + len(block) > max_chars:
+            break
+        summaries.append(block)
+        used += len(block) + 1
+    return "\n".join([header, "\n".join(manifest), "\n".join(summaries)])
@@ -0,0 +1,290 @@
+import hashlib
+import math
+import os
+import re
+from collections import Counter, namedtuple
+
+
+# Number of chunks attached to each prompt
+TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "5"))
+# Maximum number of characters of retrieved code attached to a prompt
+MAX_RETRIEVED_CHARS = int(os.environ.get("RETRIEVAL_MAX_CHARS", "12000"))
+# Embedding model used to rerank chunks, or empty to use BM25 alone
+EMBEDDING_MODEL = os.environ.get("RETRIEVAL_EMBEDDING_MODEL", "")
+# Maximum number of lines of a chunk
+MAX_CHUNK_LINES = 60
+# BM25 parameters: term frequency saturation and length normalization
+K1 = 1.5
+B = 0.75
+# Constant of the reciprocal rank fusion of BM25 and embedding ranks
+RRF_K = 60
+# Unindented lines that start a new function, class or block of code
+CHUNK_START = re.compile(
+    r"^(?:@|(?:export\s+)?(?:default\s+)?(?:pub\s+)?(?:async\s+)?"
+    r"(?:def|class|function|func|fn|struct|interface|enum|impl|trait|"
+    r"module|public|private|protected|static|Sub|Function)\b)"
+)
+# Identifiers and words of code and prose
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# Boundaries between the words of camelCase and PascalCase identifiers
+CAMEL_BOUNDARY = re.compile(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+
+Chunk = namedtuple("Chunk", ["file_name", "start", "end", "text"])
+
+
+
+def tokenize(text: str) -> list:
+    """Function that splits text into identifier-aware search terms. Each
+    identifier is kept whole and also split into the words of its
+    snake_case or camelCase parts, so that 'parseConfig' matches
+    'parse_config', 'config' and 'parse'.
+    Args:
+    - text (string): The code or the prompt.
+    Returns:
+    - list: The lowercase terms.
+    """
+    terms = []
+    for identifier in IDENTIFIER.findall(text):
+        words = [
+            word.lower()
+            for part in identifier.split("_")
+            for word in CAMEL_BOUNDARY.split(part)
+            if len(word) > 1
+        ]
+        terms.extend(words)
+        if len(words) > 1:
+            terms.append(identifier.lower())
+    return terms
+
+
+def split_chunks(file_name: str, code: str) -> list:
+    """Function that splits a file into chunks at its top-level
+    definitions, so that each function or class is retrieved as a whole.
+    Args:
+    - file_name (string): The name of the file.
+    - code (string): The content of the file.
+    Returns:
+    - list: The Chunk objects, with 1-based inclusive line numbers.
+    """
+    lines = code.splitlines()
+    starts = [0]
+    for number, line in enumerate(lines):
+        # Decorators stay with the definition that follows them
+        if number and CHUNK_START.match(line) \
+                and not lines[number - 1].startswith("@"):
+            starts.append(number)
+    # Long blocks are cut into windows of at most MAX_CHUNK_LINES lines
+    bounds = []
+    for start, end in zip(starts, starts[1:] + [len(lines)]):
+        for window in range(start, end, MAX_CHUNK_LINES):
+            bounds.append((window, min(window + MAX_CHUNK_LINES, end)))
+    return [
+        Chunk(file_name, start + 1, end, "\n".join(lines[start:end]))
+        for start, end in bounds
+        if "\n".join(lines[start:end]).strip()
+    ]
+
+
+
+class RetrievalIndex:
+    """Define the class for the BM25 index over the chunks of the uploaded
+    code files. Only files whose content changed are re-chunked when the
+    index is updated.
+    """
+
+    def __init__(self):
+        """Initialize a new instance of the RetrievalIndex class.
+        """
+        # {file name: content hash} of the indexed files
+        self.hashes = {}
+        # {chunk ID: Chunk}
+        self.chunks = {}
+        # {chunk ID: number of terms}
+        self.lengths = {}
+        # {term: {chunk ID: term frequency}}
+        self.postings = {}
+        # {chunk text hash: embedding}, kept across updates
+        self.embeddings = {}
+        self.next_id = 0
+
+
+    def update(self, files: dict):
+        """Method to bring the index in line with the uploaded files.
+        Args:
+        - files (dict): {file name: code} of the uploaded files.
+        """
+        for file_name in list(self.hashes):
+            if file_name not in files:
+                self.remove(file_name)
+        for file_name, code in files.items():
+            digest = hashlib.sha1(code.encode("utf-8")).hexdigest()
+            if self.hashes.get(file_name) == digest:
+                continue
+            self.remove(file_name)
+            self.hashes[file_name] = digest
+            for chunk in split_chunks(file_name, code):
+                terms = Counter(tokenize(chunk.text))
+                self.chunks[self.next_id] = chunk
+                self.lengths[self.next_id] = sum(terms.values())
+                for term, frequency in terms.items():
+                    self.postings.setdefault(term, {})[self.next_id] = (
+                        frequency
+                    )
+                self.next_id += 1
+
+
+    def remove(self, file_name: str):
+        """Method to drop the chunks of a file from the index.
+        Args:
+        - file_name (string): The name of the file.
+        """
+        self.hashes.pop(file_name, None)
+        stale = [
+            chunk_id for chunk_id, chunk in self.chunks.items()
+            if chunk.file_name == file_name
+        ]
+        for chunk_id in stale:
+            del self.chunks[chunk_id]
+            del self.lengths[chunk_id]
+        if stale:
+            stale = set(stale)
+            for term in list(self.postings):
+                postings = self.postings[term]
+                for chunk_id in stale.intersection(postings):
+                    del postings[chunk_id]
+                if not postings:
+                    del self.postings[term]
+
+
+    def bm25(self, query: str, exclude: set = frozenset()) -> list:
+        """Method to rank the chunks by their BM25 score for a query.
+        Args:
+        - query (string): The prompt.
+        - exclude (set): Names of the files to leave out.
+        Returns:
+        - list: (score, chunk ID) pairs, best first.
+        """
+        count = len(self.chunks)
+        if not count:
+            return []
+        average = sum(self.lengths.values()) / count
+        scores = Counter()
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term, {})
+            idf = math.log(
+                1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)
+            )
+            for chunk_id, frequency in postings.items():
+                norm = K1 * (1 - B + B * self.lengths[chunk_id] / average)
+                scores[chunk_id] += (
+                    idf * frequency * (K1 + 1) / (frequency + norm)
+                )
+        return [
+            (score, chunk_id) for chunk_id, score in scores.most_common()
+            if self.chunks[chunk_id].file_name not in exclude
+        ]
+
+
+    def rerank(self, embed, query: str, ranked: list) -> list:
+        """Method to fuse the BM25 ranking with the cosine similarity of
+        embeddings, using reciprocal rank fusion.
+        Args:
+        - embed (function): Called as embed(model, texts) to compute the
+        embeddings of a list of texts.
+        - query (string): The prompt.
+        - ranked (list): The BM25 ranking as (score, chunk ID) pairs.
+        Returns:
+        - list: The chunk IDs, best first.
+        """
+        chunk_ids = [chunk_id for _, chunk_id in ranked]
+        keys = {
+            chunk_id: hashlib.sha1(
+                self.chunks[chunk_id].text.encode("utf-8")
+            ).hexdigest()
+            for chunk_id in chunk_ids
+        }
+        # Only chunks without a cached embedding are sent to the API
+        missing = [
+            chunk_id for chunk_id in chunk_ids
+            if keys[chunk_id] not in self.embeddings
+        ]
+        vectors = embed(
+            EMBEDDING_MODEL,
+            [query] + [self.chunks[i].text for i in missing],
+        )
+        for chunk_id, vector in zip(missing, vectors[1:]):
+            self.embeddings[keys[chunk_id]] = vector
+        # OpenAI embeddings are normalized, so the dot product is the ...
+        # ...cosine similarity
+        similarity = {
+            chunk_id: sum(
+                a * b
+                for a, b in zip(vectors[0], self.embeddings[keys[chunk_id]])
+            )
+            for chunk_id in chunk_ids
+        }
+        by_embedding = sorted(chunk_ids, key=similarity.get, reverse=True)
+        fused = Counter()
+        for ranking in (chunk_ids, by_embedding):
+            for rank, chunk_id in enumerate(ranking):
+                fused[chunk_id] += 1 / (RRF_K + rank + 1)
+        return [chunk_id for chunk_id, _ in fused.most_common()]
+
+
+    def search(self, query: str, exclude: set = frozenset(), embed=None,
+               top_k: int = TOP_K,
+               max_chars: int = MAX_RETRIEVED_CHARS) -> list:
+        """Method to select the chunks most relevant to a prompt.
+        Args:
+        - query (string): The prompt.
+        - exclude (set): Names of the files to leave out.
+        - embed (function): Called as embed(model, texts) to rerank the
+        chunks by embeddings when RETRIEVAL_EMBEDDING_MODEL is set, or
+        None.
+        - top_k (int): The maximum number of chunks.
+        - max_chars (int): The maximum total length of the chunks.
+        Returns:
+        - list: The Chunk objects, in file and line order.
+        """
+        ranked = self.bm25(query, exclude)
+        if not ranked:
+            return []
+        if EMBEDDING_MODEL and embed is not None:
+            # Rerank a shortlist of BM25 candidates by meaning
+            chunk_ids = self.rerank(embed, query, ranked[:top_k * 4])
+        else:
+            chunk_ids = [chunk_id for _, chunk_id in ranked]
+        selected = []
+        used = 0
+        for chunk_id in chunk_ids[:top_k]:
+            chunk = self.chunks[chunk_id]
+            if used + len(chunk.text) > max_chars:
+                continue
+            selected.append(chunk)
+            used += len(chunk.text)
+        return sorted(selected, key=lambda chunk: (chunk.file_name,
+                                                   chunk.start))
+
+
+
+def format_chunks(chunks: list) -> str:
+    """Function that renders retrieved chunks for a prompt.
+    Args:
+    - chunks (list): The Chunk objects.
+    Returns:
+    - str: The code excerpts, or an empty string if there are none.
+    """
+    if not chunks:
+        return ""
+    excerpts = [
+        "`{}` (lines {}-{}):  \n```{}  \n{}  \n```".format(
+            chunk.file_name, chunk.start, chunk.end,
+            os.path.splitext(chunk.file_name)[1].lstrip(".").lower(),
+            chunk.text,
+        )
+        for chunk in chunks
+    ]
+    return (
+        "Relevant excerpts from my other uploaded files:  \n"
+        + "  \n".join(excerpts)
+    )
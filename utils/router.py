@@ -0,0 +1,141 @@
+import re
+import threading
+from collections import namedtuple
+
+
+# Models adequate for each category of prompt, from the least to the ...
+# ...most capable
+CANDIDATES = {
+    "simple": ("gpt-4o-mini", "gpt-4o", "o3-mini"),
+    "code": ("gpt-4o", "o3-mini"),
+    "reasoning": ("o3-mini", "o1"),
+}
+# Model that users tend to pick when unsure, used to report the latency ...
+# ...saved by routing
+REFERENCE_MODEL = "o1"
+# Typical latencies in seconds, used until latencies have been observed
+PRIOR_LATENCY = {"gpt-4o-mini": 3.0, "gpt-4o": 5.0, "o3-mini": 10.0,
+                 "o1": 30.0, "gpt-4.5-preview": 20.0}
+# Weight of the newest observation in the moving average of latencies
+SMOOTHING = 0.2
+# CodeMaxGPT actions mapped to the category of prompt they produce
+ACTION_CATEGORIES = {
+    "Debug Code": "reasoning",
+    "Refactor Code": "code",
+    "Refactor Code to OOP": "code",
+    "Comment Code": "code",
+    "Review Code": "code",
+    "Generate GitHub README": "code",
+    "Suggest a Solution For a Coding Challenge": "reasoning",
+}
+# Words that usually ask for multi-step reasoning
+REASONING_WORDS = re.compile(
+    r"\b(prove|proof|derive|algorithm|complexity|optimi[sz]e|step[- ]by[- ]"
+    r"step|trade-?offs?|architecture|debug)\b",
+    re.IGNORECASE,
+)
+# Signs that a prompt contains code
+CODE_PATTERN = re.compile(
+    r"```|^\s*(def|class|import|from|function|public|#include|SELECT)\b"
+    r"|[{};]\s*$",
+    re.MULTILINE,
+)
+
+RouteDecision = namedtuple(
+    "RouteDecision", ["model", "category", "expected", "reference_expected"]
+)
+
+
+
+def classify(prompt: str, action: str = None) -> str:
+    """Function that cheaply classifies a prompt without calling any API.
+    Args:
+    - prompt (string): The user's prompt.
+    - action (string): The CodeMaxGPT action that built the prompt, if any.
+    Returns:
+    - str: 'simple', 'code' or 'reasoning'.
+    """
+    if action in ACTION_CATEGORIES:
+        return ACTION_CATEGORIES[action]
+    if REASONING_WORDS.search(prompt) or len(prompt) > 4000:
+        return "reasoning"
+    if CODE_PATTERN.search(prompt):
+        return "code"
+    return "simple"
+
+
+
+class ModelRouter:
+    """Define the class that picks the fastest adequate GPT model for each
+    prompt and learns the latency of every model from observed requests.
+    """
+
+    def __init__(self):
+        """Initialize a new instance of the ModelRouter class.
+        """
+        self.lock = threading.Lock()
+        # Moving average of the observed latency of each model, in seconds
+        self.latency = dict(PRIOR_LATENCY)
+
+
+    def expected(self, model: str) -> float:
+        """Method to get the expected latency of a model.
+        Args:
+        - model (string): The GPT model.
+        Returns:
+        - float: The expected latency in seconds.
+        """
+        with self.lock:
+            return self.latency.get(model, max(PRIOR_LATENCY.values()))
+
+
+    def route(self, prompt: str, action: str = None) -> RouteDecision:
+        """Method to choose the model for a prompt.
+        Args:
+        - prompt (string): The user's prompt.
+        - action (string): The CodeMaxGPT action that built the prompt, if
+        any.
+        Returns:
+        - RouteDecision: The model, the category of the prompt, and the
+        expected latency of the model and of the reference model.
+        """
+        category = classify(prompt, action)
+        model = min(CANDIDATES[category], key=self.expected)
+        return RouteDecision(
+            model, category, self.expected(model),
+            self.expected(REFERENCE_MODEL),
+        )
+
+
+    def record(self, model: str, seconds: float):
+        """Method to update the expected latency of a model with the
+        latency of a finished request.
+        Args:
+        - model (string): The GPT model.
+        - seconds (float): The observed latency.
+        """
+        with self.lock:
+            previous = self.latency.get(model, seconds)
+            self.latency[model] = (
+                (1 - SMOOTHING) * previous + SMOOTHING * seconds
+            )
+
+
+
+def describe(decision: RouteDecision, seconds: float) -> str:
+    """Function that reports a routing decision and the latency saved
+    compared with the reference model.
+    Args:
+    - decision (RouteDecision): The routing decision.
+    - seconds (float): The observed latency of the request.
+    Returns:
+    - str: The report.
+    """
+    report = "Auto: routed this {} prompt to {} ({:.1f} s).".format(
+        decision.category, decision.model, seconds
+    )
+    if decision.model != REFERENCE_MODEL:
+        report += " About {:.1f} s faster than {} would typically be.".format(
+            max(0.0, decision.reference_expected - seconds), REFERENCE_MODEL
+        )
+    return report
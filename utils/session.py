@@ -0,0 +1,364 @@
+import os
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+# The services and helpers are imported by the factories below on first ...
+# ...use, since every page imports this module and they pull in the ...
+# ...OpenAI client, which would weigh on each page's cold start
+
+
+# Number of most recent turns loaded when a session is (re)hydrated
+HISTORY_WINDOW = int(os.environ.get("CONVERSATION_WINDOW", "50"))
+# Seconds of inactivity after which a session's history is evicted ...
+# ...from server memory
+SESSION_IDLE_SECONDS = int(os.environ.get("SESSION_IDLE_SECONDS", "1800"))
+# Seconds between two checks for a rerun or a closed tab while waiting ...
+# ...for a request
+WAIT_POLL_SECONDS = 0.5
+# Desktop version of Talk to GPT offered for download
+DESKTOP_APP_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "assets", "ChatGPT-Tkinter-Desktop-App.exe",
+)
+
+
+
+class SessionRegistry:
+    """Define the class that tracks the activity of every browser session
+    and evicts the history of idle sessions from server memory.
+    """
+
+    def __init__(self):
+        """Initialize a new instance of the SessionRegistry class.
+        """
+        self.lock = threading.Lock()
+        # {session ID: [last active time, weak ref to state, evictable keys]}
+        self.sessions = {}
+
+
+    def touch(self, session_id: str, state, keys: list):
+        """Method to mark a session as active.
+        Args:
+        - session_id (string): The ID of the browser session.
+        - state (SessionState): The state owned by the session, which
+        outlives its script runs.
+        - keys (list): The session state keys that may be evicted.
+        """
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None or entry[1]() is not state:
+                entry = [0, weakref.ref(state), set()]
+                self.sessions[session_id] = entry
+            entry[0] = time.monotonic()
+            entry[2].update(keys)
+
+
+    def evict_idle(self, max_idle_seconds: int) -> int:
+        """Method to drop the history of sessions that have been idle for
+        too long. The history is reloaded from the store on their next
+        rerun.
+        Args:
+        - max_idle_seconds (int): The allowed period of inactivity.
+        Returns:
+        - int: The number of sessions evicted.
+        """
+        now = time.monotonic()
+        with self.lock:
+            idle = [
+                (session_id, entry)
+                for session_id, entry in self.sessions.items()
+                if now - entry[0] > max_idle_seconds
+            ]
+            for session_id, _ in idle:
+                del self.sessions[session_id]
+        for _, (_, state_ref, keys) in idle:
+            state = state_ref()
+            # Skip sessions that Streamlit has already disposed of
+            if state is None:
+                continue
+            for key in keys:
+                if key in state:
+                    del state[key]
+        return len(idle)
+
+
+    def states(self, min_idle_seconds: float = 0) -> dict:
+        """Method to get the state of every live session.
+        Args:
+        - min_idle_seconds (float): Only return the sessions that have
+        been inactive for at least this long.
+        Returns:
+        - dict: {session ID: session state object}.
+        """
+        now = time.monotonic()
+        with self.lock:
+            refs = [
+                (session_id, entry[1])
+                for session_id, entry in self.sessions.items()
+                if now - entry[0] >= min_idle_seconds
+            ]
+        return {
+            session_id: state_ref()
+            for session_id, state_ref in refs
+            if state_ref() is not None
+        }
+
+
+
+@st.cache_resource
+def get_store():
+    """Function that creates the conversation store shared by all
+    sessions. The backend is selected by the CONVERSATION_STORE
+    environment variable and is SQLite by default.
+    """
+    from utils.conversation_store import create_store
+
+    return create_store()
+
+
+@st.cache_resource
+def get_registry() -> SessionRegistry:
+    """Function that creates the session registry shared by all sessions.
+    """
+    return SessionRegistry()
+
+
+@st.cache_resource
+def get_profiler():
+    """Function that creates the memory profiler shared by all sessions.
+    """
+    from utils.memory import MemoryProfiler
+
+    return MemoryProfiler()
+
+
+@st.cache_resource
+def get_router():
+    """Function that creates the model router shared by all sessions, so
+    that latencies observed in one session benefit the others.
+    """
+    from utils.router import ModelRouter
+
+    return ModelRouter()
+
+
+@st.cache_resource
+def get_core():
+    """Function that starts the async execution core shared by all
+    sessions, so that its event loop and API clients outlive reruns.
+    """
+    from utils.async_core import AsyncCore
+
+    return AsyncCore()
+
+
+@st.cache_resource
+def get_audio_server():
+    """Function that starts the audio streaming endpoint shared by all
+    sessions on the event loop of the execution core.
+    Returns:
+    - AudioStreamServer: The endpoint, whose 'server' is None if it is
+    not configured or could not start.
+    """
+    from utils.audio_stream import AudioStreamServer
+
+    server = AudioStreamServer(get_core())
+    server.start()
+    return server
+
+
+@st.cache_resource
+def get_chat_service():
+    """Function that creates the chat logic of Talk to GPT, shared by all
+    sessions as well as with the command line and the HTTP API.
+    """
+    from service.chat import ChatService
+
+    return ChatService(get_core(), get_store(), get_router())
+
+
+@st.cache_resource
+def get_coder_service():
+    """Function that creates the coding assistant logic of CodeMaxGPT,
+    shared by all sessions as well as with the command line and the HTTP
+    API.
+    """
+    from service.coder import CoderService
+
+    return CoderService(get_core(), get_store(), get_router())
+
+
+@st.cache_resource
+def get_renderer():
+    """Function that creates the markdown renderer shared by all sessions,
+    so that a message is rendered once however many sessions display it.
+    """
+    from utils.markdown_render import MarkdownRenderer
+
+    return MarkdownRenderer()
+
+
+@st.cache_resource
+def get_desktop_app() -> bytes:
+    """Function that reads the desktop version of Talk to GPT once for all
+    sessions. Streamlit's static file route would serve the binary as
+    text, so it is offered through a download button, whose media file is
+    stored once however many sessions display it.
+    Returns:
+    - bytes: The binary, or None if it is not deployed.
+    """
+    try:
+        with open(DESKTOP_APP_PATH, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+@st.cache_resource(show_spinner="Loading the built-in prompts...")
+def get_prompt_index(url: str, _transform):
+    """Function that loads a catalog of built-in prompts and indexes it
+    once for all sessions, instead of keeping a copy in each session.
+    Args:
+    - url (string): The CSV file of the catalog, with 'act' and 'prompt'
+    columns.
+    - _transform (function): Rewrites each prompt before indexing.
+    Returns:
+    - PromptIndex: The search index of the catalog.
+    """
+    # Import pandas on first use to keep the pages' cold start fast
+    import pandas as pd
+    from utils.prompt_search import PromptIndex
+
+    df = pd.read_csv(url)
+    return PromptIndex(df["act"], df["prompt"].apply(_transform))
+
+
+@st.cache_resource
+def get_challenge_fetcher():
+    """Function that creates the fetcher of coding challenges shared by all
+    sessions, so that a popular problem is fetched once for everyone.
+    """
+    from utils.challenges import ChallengeFetcher
+
+    return ChallengeFetcher()
+
+
+@st.cache_resource
+def get_transfer_service():
+    """Function that creates the export and import of sessions, shared by
+    all sessions as well as with the command line and the HTTP API.
+    """
+    from service.transfer import TransferService
+
+    return TransferService(get_store())
+
+
+@st.cache_resource
+def get_batch_jobs():
+    """Function that creates the registry of tracked Batch API jobs, kept
+    per session, so that tracking continues across reruns.
+    """
+    from utils.batch import BatchRegistry
+
+    return BatchRegistry()
+
+
+def get_session_id() -> str:
+    """Function that returns a session ID that survives page refreshes by
+    mirroring it in the 'sid' query parameter of the URL.
+    """
+    if "session_id" not in st.session_state:
+        # Resume the session named in the URL, or start a new one
+        params = st.experimental_get_query_params()
+        st.session_state["session_id"] = (
+            params.get("sid", [""])[0] or uuid.uuid4().hex
+        )
+        st.experimental_set_query_params(sid=st.session_state["session_id"])
+    return st.session_state["session_id"]
+
+
+def wait(future, label: str = "Waiting for the response"):
+    """Function that waits for a request running on the execution core
+    while letting Streamlit interrupt the script. Streamlit only stops a
+    script for a rerun or a closed tab when the script updates the page,
+    so a placeholder showing the elapsed time is updated between short
+    waits. If the script is interrupted, the request is cancelled.
+    Args:
+    - future (concurrent.futures.Future): The request, as returned by
+    AsyncCore.submit or AsyncCore.submit_all.
+    - label (string): The text shown while waiting.
+    Returns:
+    - The result of the request. Its exception is raised instead if it
+    failed.
+    """
+    placeholder = st.empty()
+    start = time.monotonic()
+    try:
+        while True:
+            try:
+                result = future.result(timeout=WAIT_POLL_SECONDS)
+                break
+            except FutureTimeoutError:
+                placeholder.caption("{}... {:.0f} s".format(
+                    label, time.monotonic() - start
+                ))
+    except BaseException:
+        # The user moved on or the request failed: stop it upstream
+        future.cancel()
+        raise
+    placeholder.empty()
+    return result
+
+
+def session_state_of(ctx):
+    """Function that returns the session state object that lives as long
+    as the browser session. The 'session_state' of a script run context is
+    a thread-safe wrapper created anew by each script runner, and dropped
+    when the run ends, so it cannot be tracked between reruns.
+    Args:
+    - ctx (ScriptRunContext): The context of the current script run.
+    Returns:
+    - SessionState: The state owned by the session, or the wrapper if this
+    version of Streamlit does not expose it.
+    """
+    return getattr(ctx.session_state, "_state", ctx.session_state)
+
+
+def hydrate_session(page: str, keys: list, loader):
+    """Function that keeps a page's history resident only while its
+    session is active. Idle sessions are evicted first, then the page's
+    recent window of turns is loaded if it is not in memory yet, and the
+    oldest turns are dropped if the session exceeds its memory budget.
+    Args:
+    - page (string): The web app being rendered.
+    - keys (list): The session state keys that hold the page's history.
+    - loader (function): Called as loader(store, session_id, window) to
+    rebuild those keys from the store.
+    """
+    session_id = get_session_id()
+    marker = "hydrated-{}".format(page)
+    # Register the session and evict sessions that have gone idle
+    ctx = get_script_run_ctx()
+    registry = get_registry()
+    if ctx is not None:
+        registry.touch(session_id, session_state_of(ctx), keys + [marker])
+    registry.evict_idle(SESSION_IDLE_SECONDS)
+    # Lazily load the most recent window of turns for this page
+    if marker not in st.session_state:
+        store = get_store()
+        # Keep the whole session from expiring in stores where it does
+        store.touch(session_id)
+        loader(store, session_id, HISTORY_WINDOW)
+        st.session_state[marker] = True
+    # Keep the session within SESSION_MEMORY_BUDGET_MB, as well as the ...
+    # ...sessions that went idle since their last check
+    from utils.memory import MEMORY_CHECK_SECONDS
+
+    profiler = get_profiler()
+    if ctx is not None:
+        profiler.check(session_id, session_state_of(ctx))
+    profiler.check_all(registry.states(MEMORY_CHECK_SECONDS))
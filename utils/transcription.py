@@ -0,0 +1,122 @@
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+# Maximum length of a segment of a long recording, in seconds
+SEGMENT_SECONDS = float(os.environ.get("TRANSCRIPTION_SEGMENT_SECONDS", "30"))
+# Maximum number of words repeated across the overlap of two segments
+MAX_OVERLAP_WORDS = 8
+# Seconds between two calls of on_wait while no segment finishes
+WAIT_POLL_SECONDS = 0.5
+
+
+
+def _normalize(word: str) -> str:
+    """Function that strips case and punctuation from a word so that the
+    same word transcribed at the end of one segment and at the start of
+    the next one compares equal.
+    """
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def stitch_transcripts(texts: list) -> str:
+    """Function that joins the transcripts of consecutive segments,
+    dropping the words repeated because the segments overlap.
+    Args:
+    - texts (list): The transcripts of the segments, in order.
+    Returns:
+    - str: The transcript of the whole recording.
+    """
+    words = []
+    for text in texts:
+        new_words = text.split()
+        # Find the longest run of words ending the transcript so far ...
+        # ...that also starts the next segment
+        for size in range(
+            min(MAX_OVERLAP_WORDS, len(words), len(new_words)), 0, -1
+        ):
+            tail = [_normalize(word) for word in words[-size:]]
+            head = [_normalize(word) for word in new_words[:size]]
+            if tail == head:
+                new_words = new_words[size:]
+                break
+        words.extend(new_words)
+    return " ".join(words)
+
+
+def transcribe_segments(core, client, segments: list,
+                        on_partial=None, on_wait=None) -> str:
+    """Function that transcribes the segments of a recording concurrently
+    through OpenAI's whisper model, so that the time to transcript depends
+    on the longest segment rather than the whole recording. At most
+    TRANSCRIPTION_WORKERS segments are transcribed at the same time across
+    all sessions.
+    Args:
+    - core (AsyncCore): The execution core that runs the requests.
+    - client (AsyncOpenAI): The OpenAI client used to call the API.
+    - segments (list): (file name, audio bytes) for each segment.
+    - on_partial (function): Called from the calling thread with the
+    transcript available so far each time a segment finishes.
+    - on_wait (function): Called from the calling thread with the seconds
+    elapsed every WAIT_POLL_SECONDS until the transcript is complete. A
+    Streamlit page updates the page there, which lets Streamlit stop the
+    script for a rerun or a closed tab; the requests are then cancelled.
+    Returns:
+    - str: The transcript of the whole recording.
+    """
+    texts = [None] * len(segments)
+    futures = {
+        core.submit(
+            client.audio.transcriptions.create(
+                model="whisper-1", file=segment
+            ),
+            limit="transcription",
+        ): i
+        for i, segment in enumerate(segments)
+    }
+    start = time.monotonic()
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(
+                pending, timeout=WAIT_POLL_SECONDS,
+                return_when=FIRST_COMPLETED,
+            )
+            if on_wait is not None:
+                on_wait(time.monotonic() - start)
+            for future in done:
+                texts[futures[future]] = future.result().text
+            if not done or on_partial is None:
+                continue
+            # Show the finished segments in order, marking the gaps
+            on_partial(
+                " … ".join(
+                    stitch_transcripts(run) for run in _finished_runs(texts)
+                )
+            )
+    except BaseException:
+        # Stop transcribing the other segments if one of them failed or ...
+        # ...the user moved on
+        for future in futures:
+            future.cancel()
+        raise
+    return stitch_transcripts(texts)
+
+
+def _finished_runs(texts: list) -> list:
+    """Function that groups the transcripts of finished segments into runs
+    of consecutive segments.
+    """
+    runs, run = [], []
+    for text in texts:
+        if text is None:
+            if run:
+                runs.append(run)
+            run = []
+        else:
+            run.append(text)
+    if run:
+        runs.append(run)
+    return runs
@@ -0,0 +1,68 @@
+import io
+import tempfile
+import streamlit as st
+from service.transfer import TransferError
+from utils.session import get_session_id, get_transfer_service
+
+
+# Size of an export kept in memory while it is written, beyond which it ...
+# ...is spooled to a temporary file on disk
+SPOOL_MAX_BYTES = 1024 * 1024
+
+
+
+def show_transfer_panel():
+    """Function that displays, in the sidebar, the export of the current
+    session (the conversations of both web apps, their metadata and the
+    uploaded files) and the import of an exported one. Importing does not
+    run any completion.
+    """
+    transfer = get_transfer_service()
+    with st.sidebar.expander(":floppy_disk: Save or restore a session"):
+        # Export the session only on request, as it reads every turn
+        audio = st.checkbox(
+            "Include audio references",
+            help=(
+                "Mark the spoken replies with the text-to-speech settings "
+                "they were read with, so that they can be synthesized "
+                "again."
+            ),
+        )
+        if st.button("Export this session"):
+            session_id = get_session_id()
+            # Write the export line by line instead of joining it into ...
+            # ...one string. Streamlit 1.20 only takes bytes or regular ...
+            # ...files, so the spool is read back once for the button
+            with tempfile.SpooledTemporaryFile(SPOOL_MAX_BYTES) as spool:
+                with st.spinner("Exporting the session..."):
+                    for line in transfer.export(session_id, audio):
+                        spool.write(line.encode("utf-8"))
+                    spool.seek(0)
+                st.download_button(
+                    "Download the export",
+                    data=spool.read(),
+                    file_name="session-{}.jsonl".format(session_id[:8]),
+                    mime="application/x-ndjson",
+                )
+
+        # Import an export into a new session, read line by line
+        uploaded = st.file_uploader(
+            "Restore an exported session", type=["jsonl"]
+        )
+        if uploaded is not None and st.button("Restore"):
+            try:
+                with st.spinner("Restoring the session..."):
+                    result = transfer.restore(
+                        io.TextIOWrapper(uploaded, encoding="utf-8")
+                    )
+            except (TransferError, UnicodeDecodeError) as error:
+                st.error("The session could not be restored: {}".format(
+                    error
+                ))
+                return
+            st.success(
+                "Restored {} turns and {} files. [Open the restored "
+                "session](?sid={})".format(
+                    result["turns"], result["files"], result["session_id"]
+                )
+            )
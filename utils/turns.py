@@ -0,0 +1,157 @@
+from datetime import datetime
+
+
+
+def count_tokens(text: str) -> int:
+    """Function that estimates the number of tokens in a text, using the
+    rule of thumb of roughly four characters per token.
+    Args:
+    - text (string): The text to measure.
+    Returns:
+    - int: The estimated number of tokens.
+    """
+    return (len(text) + 3) // 4 if text else 0
+
+
+
+class Turn:
+    """Define the class for a single message of a conversation.
+    """
+
+    __slots__ = ("role", "content", "timestamp", "modality", "tokens")
+
+    def __init__(self, role: str, content: str, modality: str = "",
+                 timestamp: datetime = None, tokens: int = None):
+        """Initialize a new instance of the Turn class.
+        Args:
+        - role (string): 'system', 'user' or 'assistant'.
+        - content (string): The text of the message.
+        - modality (string): Type of communication ('text' or 'speak'),
+        empty for system messages.
+        - timestamp (datetime): When the message was created. Defaults to
+        now.
+        - tokens (int): The number of tokens in the message. Estimated
+        from the content if not provided.
+        """
+        self.role = role
+        self.content = content
+        self.modality = modality
+        self.timestamp = timestamp or datetime.now()
+        self.tokens = count_tokens(content) if tokens is None else tokens
+
+
+
+class TurnLog:
+    """Define the class for the single, append-only log of turns that both
+    web apps render their chat history from and derive their API payloads
+    from.
+    """
+
+    __slots__ = ("turns", "persisted")
+
+    def __init__(self, turns: list = None):
+        """Initialize a new instance of the TurnLog class.
+        Args:
+        - turns (list): Turns loaded from the conversation store, which are
+        considered already persisted.
+        """
+        self.turns = list(turns or [])
+        # Number of leading turns already written to the conversation store
+        self.persisted = len(self.turns)
+
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+
+    def __iter__(self):
+        return iter(self.turns)
+
+
+    def append(self, role: str, content: str, modality: str = "",
+               timestamp: datetime = None, tokens: int = None) -> Turn:
+        """Method to add a new turn to the end of the log.
+        Args:
+        - role (string): 'system', 'user' or 'assistant'.
+        - content (string): The text of the message.
+        - modality (string): Type of communication ('text' or 'speak').
+        - timestamp (datetime): When the message was created.
+        - tokens (int): The number of tokens in the message.
+        Returns:
+        - Turn: The new turn.
+        """
+        turn = Turn(role, content, modality, timestamp, tokens)
+        self.turns.append(turn)
+        return turn
+
+
+    def last(self, role: str = None) -> Turn:
+        """Method to get the latest turn, optionally of a given role.
+        Args:
+        - role (string): The role to look for. Any role if not provided.
+        Returns:
+        - Turn: The latest matching turn, or None.
+        """
+        for turn in reversed(self.turns):
+            if role is None or turn.role == role:
+                return turn
+        return None
+
+
+    def payload(self) -> list:
+        """Method to build the 'messages' parameter of a chat completion
+        request from the log.
+        Returns:
+        - list: {'role', 'content'} dictionaries, oldest first.
+        """
+        return [
+            {"role": turn.role, "content": turn.content}
+            for turn in self.turns if turn.content is not None
+        ]
+
+
+    def dialogs(self, modality: str = None) -> list:
+        """Method to pair every user message with the bot's reply to it.
+        A user message that did not get a reply is paired with None.
+        Args:
+        - modality (string): Only include turns of this type of
+        communication. All turns if not provided.
+        Returns:
+        - list: (user turn, bot turn) tuples, oldest first.
+        """
+        pairs = []
+        for turn in self.turns:
+            if modality is not None and turn.modality != modality:
+                continue
+            if turn.role == "user":
+                pairs.append((turn, None))
+            # Attach the reply to the latest unanswered user message
+            elif turn.role == "assistant" and pairs and pairs[-1][1] is None:
+                pairs[-1] = (pairs[-1][0], turn)
+        return pairs
+
+
+    def unpersisted(self) -> list:
+        """Method to get the turns not yet written to the conversation
+        store and mark them as written.
+        Returns:
+        - list: The new turns, oldest first.
+        """
+        new_turns = self.turns[self.persisted:]
+        self.persisted = len(self.turns)
+        return new_turns
+
+
+    def trim(self, count: int) -> int:
+        """Method to drop the oldest turns from memory to save space. Only
+        turns already written to the conversation store are dropped, so
+        they can still be reloaded from it.
+        Args:
+        - count (int): The maximum number of turns to drop.
+        Returns:
+        - int: The number of turns dropped.
+        """
+        count = min(count, self.persisted)
+        del self.turns[:count]
+        self.persisted -= count
+        return count